@@ -9,13 +9,18 @@ Date: 21-06-2023
 
 from pathlib import Path
 import logging
+import sys
 import yaml
 import argparse
 from dataclasses import dataclass, field
 from juno_library import Pipeline
-from typing import Optional, Union, List, ClassVar
+from typing import Optional, Union, List, ClassVar, Dict
 from version import __package_name__, __version__, __description__
 
+sys.path.insert(0, str(Path(__file__).parent.joinpath("workflow", "scripts")))
+from input_checksums import can_reuse_outputs, input_checksums, read_checksums
+from resource_model import run_features
+
 
 def main() -> None:
     juno_clustering = JunoClustering()
@@ -40,13 +45,27 @@ class JunoClustering(Pipeline):
             metavar="STR",
             help="Path to previous juno-clustering run.",
         )
+        self.add_argument(
+            "--recluster-from",
+            type=Path,
+            required=False,
+            metavar="STR",
+            help="Path to an earlier run of the same samples. If its recorded input checksums match, its alignment and distances are reused and only clustering is rerun.",
+        )
+        self.add_argument(
+            "--state-db",
+            type=Path,
+            required=False,
+            metavar="STR",
+            help="Path to a state store (SQLite) which holds the samples, distances, clusters and exclusions of all runs. Created if it does not exist and updated by each run.",
+        )
         self.add_argument(
             "--clustering-preset",
             type=str,
             required=True,
             metavar="STR",
             help="Type of clustering that should be performed.",
-            choices=["mycobacterium_tuberculosis"],
+            choices=["mycobacterium_tuberculosis", "salmonella"],
         )
         self.add_argument(
             "--presets-path",
@@ -76,6 +95,8 @@ class JunoClustering(Pipeline):
 
         # Optional arguments are loaded into self here
         self.previous_clustering: Optional[str] = args.previous_clustering
+        self.recluster_from: Optional[str] = args.recluster_from
+        self.state_db: Optional[Path] = args.state_db
         self.clustering_preset: str = args.clustering_preset
         self.presets_path: Optional[Path] = args.presets_path
         self.merged_cluster_separator: str = args.merged_cluster_separator
@@ -94,6 +115,14 @@ class JunoClustering(Pipeline):
                 list_sing_args.append(
                     f"--bind {self.previous_clustering}:{self.previous_clustering}"
                 )
+            if self.recluster_from:
+                list_sing_args.append(
+                    f"--bind {self.recluster_from}:{self.recluster_from}"
+                )
+            if self.state_db:
+                # SQLite writes its journal next to the database
+                state_dir = self.state_db.resolve().parent
+                list_sing_args.append(f"--bind {state_dir}:{state_dir}")
             self.snakemake_args["singularity_args"] = " ".join(list_sing_args)
         if self.time_limit < 300:
             self.time_limit = 600
@@ -108,6 +137,8 @@ class JunoClustering(Pipeline):
             "output_dir": str(self.output_dir),
             "exclusion_file": str(self.exclusion_file),
             "previous_clustering": str(self.previous_clustering),
+            "recluster_from": str(self.recluster_from),
+            "state_db": str(self.state_db.resolve()) if self.state_db else "None",
             "merged_cluster_separator": str(self.merged_cluster_separator),
             "clustering_preset": str(self.clustering_preset),
             "cluster_threshold": str(self.cluster_threshold),  # from presets
@@ -119,6 +150,48 @@ class JunoClustering(Pipeline):
             "contamination_threshold": str(self.contamination_threshold),  # from presets
             "input_collection_name": str(self.input_collection_name),
         }
+        # computed once here instead of every time the Snakefile is parsed
+        self.user_parameters["run_features"] = run_features(
+            self.sample_inputs(),
+            str(self.previous_clustering),
+            "aln.fa.gz" if self.clustering_type == "alignment" else "cgmlst_alleles.tsv.gz",
+        )
+        # decided once here, so the Snakefile does not hash the inputs every time it is parsed
+        self.user_parameters["recluster_only"] = str(self.recluster_only())
+
+    def recluster_only(self) -> bool:
+        """
+        Whether the inputs are unchanged since the run in recluster_from, so
+        its alignment and distances can be reused and only clustering is rerun
+        """
+        if self.recluster_from is None:
+            return False
+        recorded = read_checksums(Path(self.recluster_from, "input_checksums.yaml"))
+        inputs = input_checksums(
+            self.sample_inputs(),
+            str(self.previous_clustering),
+            {**self.snakemake_config, **self.user_parameters},
+        )
+        reuse = can_reuse_outputs(recorded, inputs, self.clustering_type)
+        if reuse:
+            logging.info(f"Inputs are unchanged since {self.recluster_from}, only reclustering")
+        else:
+            logging.info(f"Inputs have changed since {self.recluster_from}, running all steps")
+        return reuse
+
+    def sample_inputs(self) -> Dict[str, str]:
+        """
+        Input of each sample, as listed in the manifests of the Snakefile
+        """
+        if self.clustering_type == "alignment":
+            return {
+                sample: str(values["assembly"])
+                for sample, values in self.sample_dict.items()
+            }
+        return {
+            sample: str(self.input_dir.joinpath("cgmlst", sample, "results_alleles.tsv"))
+            for sample in self.sample_dict
+        }
 
     def set_presets(self) -> None:
         if self.presets_path is None:
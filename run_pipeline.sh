@@ -54,17 +54,33 @@ export -f __conda_reactivate
 export -f __conda_hashr
 
 #----------------------------------------------#
-# Run collfinder to get previous clustering run
+# Find previous clustering run
+
+case $PROJECT_NAME in
+  myco)
+    TYPE="mycobacterium_tuberculosis"
+    ;;
+  salm)
+    TYPE="salmonella"
+    ;;
+  *)
+    TYPE="unknown"
+    ;;
+esac
 
 mamba env create -f envs/collfinder.yaml --name collfinder_env
 conda activate collfinder_env
 
-# Run collfinder.py in subshell
+# Find the previous clustering run and its downstream collection with curated files
+# in one iRODS session, the result is printed as JSON
 # exclude collections with input_collection = irods_runsheet_sys__runsheet__input_collection
 # to be able to rerun (after adding curated clusters.csv)
+# the previous run is cached for reruns of the same runsheet, curated files are always looked up
+# an earlier run of the same runsheet is looked up too, a rerun reuses its alignment and distances
+# if the inputs are unchanged (e.g. when only curated clusters were added)
 
 set -x
-PREVIOUS_RUN=$( python workflow/scripts/collfinder.py \
+PROVENANCE=$( python workflow/scripts/resolve_provenance.py \
     -i ${irods_runsheet_sys__runsheet__input_collection} \
     -x "sys::pipeline::gitrepo=https://github.com/RIVM-bioinformatics/juno-clustering.git" \
     -m projectID \
@@ -73,49 +89,53 @@ PREVIOUS_RUN=$( python workflow/scripts/collfinder.py \
     -X "user::data::state=invalid" \
     -X "user::pipeline::input_collection=${irods_runsheet_sys__runsheet__input_collection}" \
     -X "sys::runsheet::input_collection=${irods_runsheet_sys__runsheet__input_collection}" \
-    -l "../output/log/collfinder.log"
-    )
-
-# Run find_downstream_clusterfile.py in subshell
-set -x
-CURATED_CLUSTERING_COLL=$( python workflow/scripts/find_downstream_curated_files.py \
-    -p ${PREVIOUS_RUN} \
-    -x "sys::data::state=valid" \
-    -X "user::data::state=invalid" \
-    -l "../output/log/find_downstream_curated_files.log"
+    -R "sys::runsheet::input_collection" \
+    -Y "user::data::state=invalid" \
+    -c "../output/log/provenance_cache.json" \
+    -l "../output/log/resolve_provenance.log"
     )
 
-# Download the previous run collection and downstream collection containing curated cluster file
+PREVIOUS_RUN=$( echo "${PROVENANCE}" | python -c 'import json, sys; print(json.load(sys.stdin)["previous_run"] or "")' )
+CURATED_CLUSTERING_COLL=$( echo "${PROVENANCE}" | python -c 'import json, sys; print(json.load(sys.stdin)["curated_collection"] or "")' )
+EARLIER_RUN=$( echo "${PROVENANCE}" | python -c 'import json, sys; print(json.load(sys.stdin)["earlier_run"] or "")' )
+
+# Fetch the files of the previous run which are needed for this clustering type (see config/previous_run_manifest.yaml)
+# in parallel, files which are already present with a matching checksum are skipped
+# curated files replace those of the previous run (originals are kept as .old) and copies are stored in ../output
+# the outputs of an earlier run of the same runsheet are fetched to a separate directory
+FETCH_ARGS=(
+    -t "${TYPE}"
+    -O "../output"
+    -l "../output/log/fetch_previous_run.log"
+)
 if [ ! -z "${PREVIOUS_RUN}" ] ; then
-    iget -r -v ${PREVIOUS_RUN}
     l_previous_run="$(pwd)/$(basename ${PREVIOUS_RUN})"
-    
-    # copy previous clustering file to the output collection
-    cp ${l_previous_run}/clusters.csv ../output/clusters_previous.csv
-    
+    FETCH_ARGS+=(
+        -p "${PREVIOUS_RUN}"
+        -o "${l_previous_run}"
+    )
+    if [ ! -z "${CURATED_CLUSTERING_COLL}" ] ; then
+        FETCH_ARGS+=(
+            -c "${CURATED_CLUSTERING_COLL}"
+            -C "$(pwd)/$(basename ${CURATED_CLUSTERING_COLL})"
+        )
+    fi
+
     # set provenance information for previous clustering:
     echo user::pipeline::input_collection: "${PREVIOUS_RUN}" >> ${output_dir}/metadata.yml
 fi
+if [ ! -z "${EARLIER_RUN}" ] ; then
+    l_earlier_run="$(pwd)/earlier_run_$(basename ${EARLIER_RUN})"
+    FETCH_ARGS+=(
+        -r "${EARLIER_RUN}"
+        -R "${l_earlier_run}"
+    )
+fi
+if [ ! -z "${PREVIOUS_RUN}" ] || [ ! -z "${EARLIER_RUN}" ] ; then
+    python workflow/scripts/fetch_previous_run.py "${FETCH_ARGS[@]}"
+fi
 
 if [ ! -z "${CURATED_CLUSTERING_COLL}" ] ; then
-    iget -r -v ${CURATED_CLUSTERING_COLL}
-    l_curated_clustering_coll="$(pwd)/$(basename ${CURATED_CLUSTERING_COLL})"
-    if [ -f "${l_curated_clustering_coll}/clusters.csv" ]; then
-    # copy the curated clusters.csv files to the output collection
-        cp "${l_curated_clustering_coll}/clusters.csv" "../output/clusters_previous_curated.csv"
-        # copy the clusters.csv from the downstream to the previous_run folder
-        mv "${l_previous_run}/clusters.csv" "${l_previous_run}/clusters.csv.old"
-        cp "${l_curated_clustering_coll}/clusters.csv" "${l_previous_run}/clusters.csv"
-    fi
-
-    if [ -f "${l_curated_clustering_coll}/list_excluded_samples.tsv" ]; then
-    # copy the curated list_excluded_samples.tsv files to the output collection
-        cp "${l_curated_clustering_coll}/list_excluded_samples.tsv" "../output/list_excluded_samples_previous_curated.tsv"
-        # copy the list_excluded_samples.tsv from the downstream to the previous_run folder
-        mv "${l_previous_run}/list_excluded_samples.tsv" "${l_previous_run}/list_excluded_samples.tsv.old"
-        cp "${l_curated_clustering_coll}/list_excluded_samples.tsv" "${l_previous_run}/list_excluded_samples.tsv"
-    fi
-
     # set provenance information for previous clustering:
     echo user::pipeline::input_collection_1: "${CURATED_CLUSTERING_COLL}" >> ${output_dir}/metadata.yml
 fi
@@ -138,29 +158,26 @@ else
     QUEUE="bio"
 fi
 
-case $PROJECT_NAME in
-  myco)
-    TYPE="mycobacterium_tuberculosis"
-    ;;
-  salm)
-    TYPE="salmonella"
-    ;;
-  *)
-    TYPE="unknown"
-    ;;
-esac
-
 set -euo pipefail
 
 # make a copy of the input dir (to get rename permissions)
 input_dir_copy="${input_dir}_copy"
 cp -r ${input_dir} ${input_dir_copy}
 
+# the manifest records which input file became which sample, next to the logs of the run
 python workflow/scripts/rename_files.py \
     --input-dir "${input_dir_copy}" \
     --input-coll "${irods_runsheet_sys__runsheet__input_collection}" \
+    -m "../output/log/rename_manifest.tsv" \
     -l "../output/log/rename_files.log"
 
+# reuse the alignment and distances of an earlier run of this runsheet, if its inputs are unchanged
+RECLUSTER_ARGS=()
+if [ ! -z "${EARLIER_RUN}" ] && [ -f "${l_earlier_run}/input_checksums.yaml" ] ; then
+    echo "Reusing outputs of earlier run if inputs are unchanged: ${EARLIER_RUN}"
+    RECLUSTER_ARGS=(--recluster-from "${l_earlier_run}")
+fi
+
 if [ ! -z "${PREVIOUS_RUN}" ] ; then
     echo "Using previous clustering run: ${PREVIOUS_RUN}"
     python juno_clustering.py \
@@ -169,13 +186,15 @@ if [ ! -z "${PREVIOUS_RUN}" ] ; then
         -o "${output_dir}" \
         --clustering-preset "${TYPE}" \
         --previous-clustering "${l_previous_run}" \
-        --input-collection-name "${irods_runsheet_sys__runsheet__input_collection}"
+        --input-collection-name "${irods_runsheet_sys__runsheet__input_collection}" \
+        ${RECLUSTER_ARGS[@]+"${RECLUSTER_ARGS[@]}"}
 else  
 python juno_clustering.py \
     --queue "${QUEUE}" \
     -i "${input_dir_copy}" \
     -o "${output_dir}" \
-    --clustering-preset "${TYPE}"
+    --clustering-preset "${TYPE}" \
+    ${RECLUSTER_ARGS[@]+"${RECLUSTER_ARGS[@]}"}
 fi
 
 result=$?
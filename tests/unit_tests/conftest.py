@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# scripts in workflow/scripts are not a package, make them importable for tests
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "workflow" / "scripts"))
@@ -0,0 +1,55 @@
+"""
+In-memory stand-in for the parts of the iRODS API used by the iRODS scripts.
+"""
+
+from irods.models import Collection, CollectionMeta
+
+
+class FakeQuery:
+    """
+    GenQuery on a list of (collection, attr, value) AVUs, which records round trips.
+    """
+
+    def __init__(self, session, columns, criteria=()):
+        self.session = session
+        self.columns = columns
+        self.criteria = criteria
+
+    def filter(self, *criteria):
+        return FakeQuery(self.session, self.columns, self.criteria + criteria)
+
+    def __iter__(self):
+        self.session.round_trips += 1
+        rows = []
+        for collection, attr, value in self.session.avus:
+            row = {
+                Collection.name: collection,
+                CollectionMeta.name: attr,
+                CollectionMeta.value: value,
+            }
+            if all(self.matches(row, criterion) for criterion in self.criteria):
+                result = {column: row[column] for column in self.columns}
+                if result not in rows:
+                    rows.append(result)
+        return iter(rows)
+
+    @staticmethod
+    def matches(row, criterion):
+        if criterion.op == "=":
+            return row[criterion.query_key] == criterion.value
+        if criterion.op == "in":
+            return row[criterion.query_key] in criterion.value
+        raise NotImplementedError(criterion.op)
+
+
+class FakeSession:
+    def __init__(self, avus):
+        self.avus = avus
+        self.round_trips = 0
+
+    def query(self, *columns):
+        return FakeQuery(self, columns)
+
+    @property
+    def collections(self):
+        raise AssertionError("metadata should be fetched with queries")
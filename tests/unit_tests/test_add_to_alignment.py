@@ -0,0 +1,51 @@
+import unittest
+import gzip
+import io
+import tempfile
+from pathlib import Path
+
+import add_to_alignment
+
+
+class TestScanFasta(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+        self.content = ">a desc\nACGTN\nAC\n>b\nNNNN\n"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_plain_and_gzip_are_equal(self):
+        plain = self.tmp / "sample.fasta"
+        plain.write_text(self.content)
+        compressed = self.tmp / "sample.fa.gz"
+        # two gzip members, as written by bgzip
+        with open(compressed, "wb") as f:
+            f.write(gzip.compress(self.content[:10].encode()))
+            f.write(gzip.compress(self.content[10:].encode()))
+
+        expected = ([("a", ">a desc\nACGTN\nAC\n"), ("b", ">b\nNNNN\n")], 5, 11)
+        self.assertEqual(add_to_alignment.scan_fasta(plain), expected)
+        self.assertEqual(add_to_alignment.scan_fasta(compressed), expected)
+
+    def test_lowercase_n_is_not_counted(self):
+        plain = self.tmp / "sample.fasta"
+        plain.write_text(">a\nNNnn\nac\n")
+        self.assertEqual(add_to_alignment.scan_fasta(plain)[1:], (2, 6))
+
+    def test_has_fasta_ext(self):
+        self.assertTrue(add_to_alignment.has_fasta_ext(Path("x.fa.gz")))
+        self.assertTrue(add_to_alignment.has_fasta_ext(Path("x.fasta")))
+        self.assertFalse(add_to_alignment.has_fasta_ext(Path("x.json")))
+        self.assertFalse(add_to_alignment.has_fasta_ext(Path("x.gz")))
+
+
+class TestPassThroughPreviousAln(unittest.TestCase):
+    def test_names_and_trailing_newline(self):
+        output = io.StringIO()
+        names = add_to_alignment.pass_through_previous_aln(
+            io.StringIO(">a x\nAC\nGT\n>b\nTT"), output
+        )
+        self.assertEqual(names, ["a", "b"])
+        self.assertEqual(output.getvalue(), ">a x\nAC\nGT\n>b\nTT\n")
@@ -0,0 +1,126 @@
+import unittest
+import shutil
+import subprocess
+import tempfile
+from argparse import Namespace
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import cgmlst_distances
+import combine_cgmlst_profiles as ccp
+
+
+def brute_force(matrix, missing_data):
+    n = matrix.shape[0]
+    distances = np.zeros((n, n), dtype=int)
+    for i in range(n):
+        for j in range(n):
+            for a, b in zip(matrix[i], matrix[j]):
+                if missing_data == "ignore" and (a == ccp.MISSING or b == ccp.MISSING):
+                    continue
+                distances[i, j] += a != b
+    return distances
+
+
+def generate_profiles(n_samples, n_loci, missing_rate, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.integers(1, 4, size=(n_samples, n_loci)).astype(np.uint16)
+    matrix[rng.random(matrix.shape) < missing_rate] = ccp.MISSING
+    return matrix
+
+
+def read_distances(path):
+    df = pd.read_csv(path, sep="\t", header=None, names=["sample1", "sample2", "distance"])
+    return df.sort_values(["sample1", "sample2"]).reset_index(drop=True)
+
+
+class TestComputeDistances(unittest.TestCase):
+    def test_against_brute_force(self):
+        matrix = generate_profiles(12, 30, 0.2)
+        for missing_data in cgmlst_distances.MISSING_DATA_MODES:
+            expected = brute_force(matrix, missing_data)
+            # a tiny memory budget forces one query profile per batch
+            batches = list(
+                cgmlst_distances.compute_distances(
+                    matrix, matrix, missing_data, max_distance=15, memory_mb=0
+                )
+            )
+            self.assertEqual(len(batches), matrix.shape[0])
+            observed = np.full(expected.shape, -1)
+            for i, j, distances in batches:
+                observed[i, j] = distances
+            np.testing.assert_array_equal(
+                observed, np.where(expected <= 15, expected, -1)
+            )
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+        # missing loci, so the missing data semantics are compared as well
+        self.matrix = generate_profiles(10, 25, 0.2, seed=1)
+        self.samples = [f"s{i}" for i in range(10)]
+        self.loci = [f"l{i}" for i in range(25)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_main(self, n_samples, output, previous_distances=None):
+        alleles = self.tmp / f"alleles_{n_samples}.tsv.gz"
+        ccp.write_allele_matrix(
+            alleles, self.samples[:n_samples], self.loci, self.matrix[:n_samples]
+        )
+        cgmlst_distances.main(
+            Namespace(
+                input=alleles,
+                output=output,
+                previous_distances=previous_distances,
+                max_distance=20,
+                missing_data="ignore",
+                memory_mb=1,
+            )
+        )
+        return alleles
+
+    def test_new_vs_all(self):
+        self.run_main(6, self.tmp / "previous.tsv")
+        self.run_main(10, self.tmp / "incremental.tsv", self.tmp / "previous.tsv")
+        self.run_main(10, self.tmp / "full.tsv")
+        pd.testing.assert_frame_equal(
+            read_distances(self.tmp / "incremental.tsv"),
+            read_distances(self.tmp / "full.tsv"),
+        )
+
+    @unittest.skipIf(shutil.which("distle") is None, "distle is not installed")
+    def test_against_distle(self):
+        # distle ignores missing loci, as in the export the pipeline used to pass to it
+        self.assertTrue((self.matrix == ccp.MISSING).any(axis=1).all())
+        self.run_main(10, self.tmp / "engine.tsv")
+        ccp.write_allele_matrix(
+            self.tmp / "profiles.tsv",
+            self.samples,
+            self.loci,
+            self.matrix,
+            missing=ccp.MISSING_EXPORT,
+        )
+        subprocess.run(
+            [
+                "distle",
+                "--input-format",
+                "cgmlst",
+                "--output-mode",
+                "full",
+                "--maxdist",
+                "20",
+                str(self.tmp / "profiles.tsv"),
+                str(self.tmp / "distle.tsv"),
+            ],
+            check=True,
+        )
+        pd.testing.assert_frame_equal(
+            read_distances(self.tmp / "engine.tsv"),
+            read_distances(self.tmp / "distle.tsv"),
+        )
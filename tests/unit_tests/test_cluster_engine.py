@@ -0,0 +1,154 @@
+import unittest
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from cluster_engine import ClusterEngine
+
+
+def make_previous_clustering(rows):
+    return pd.DataFrame(rows, columns=["sample", "curated_cluster", "final_cluster"])
+
+
+class TestClusterEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.warnings_path = Path(self.tmpdir.name) / "WARNINGS.txt"
+        self.engine = ClusterEngine(10, "|", self.warnings_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_new_clusters_in_order_of_appearance(self):
+        self.engine.add_edges(["c", "a", "d"], ["b", "a", "e"])
+        self.assertEqual(
+            self.engine.infer(), {"c": "A001", "b": "A001", "a": "A002", "d": "A003", "e": "A003"}
+        )
+
+    def test_previous_clusters(self):
+        self.engine.set_previous_clustering(
+            make_previous_clustering(
+                [
+                    ["a", np.nan, "A001"],
+                    ["b", np.nan, "A002"],
+                    ["d", "B001", "A003"],
+                ]
+            )
+        )
+        self.engine.add_edges(["a", "c", "d"], ["b", "f", "e"])
+        self.assertEqual(
+            self.engine.infer(),
+            {"a": "A001|A002", "b": "A001|A002", "c": "A003", "f": "A003", "d": "B001", "e": "B001"},
+        )
+        self.assertIn("Final clusters", self.warnings_path.read_text())
+
+    def test_add_batch(self):
+        self.engine.add_edges(["a", "c"], ["b", "d"])
+        self.engine.infer()
+        result = self.engine.add_batch(["e", "b", "f"], ["a", "c", "g"], [3, 5, 11])
+        self.assertEqual(
+            result.changes,
+            {"a": ("A001", "A001|A002"), "b": ("A001", "A001|A002"),
+             "c": ("A002", "A001|A002"), "d": ("A002", "A001|A002"), "e": (None, "A001|A002")},
+        )
+        self.assertEqual([merge.clusters for merge in result.merges], [("A001", "A002")])
+        # the edge above the threshold does not add samples
+        self.assertNotIn("f", self.engine.assignments())
+
+        result = self.engine.add_batch(["h"], ["i"])
+        self.assertEqual(result.changes, {"h": (None, "A003"), "i": (None, "A003")})
+        self.assertEqual(result.merges, [])
+
+    def test_remove_samples_splits_cluster(self):
+        self.engine.set_previous_clustering(
+            make_previous_clustering([["a", np.nan, "A001"], ["c", np.nan, "A002"]])
+        )
+        # b joins the previous clusters of a and c, e hangs on d
+        self.engine.add_edges(["a", "b", "d"], ["b", "c", "e"])
+        self.engine.infer()
+        self.warnings_path.unlink()
+
+        result = self.engine.remove_samples(["b", "e", "x"])
+        self.assertEqual(
+            result.changes,
+            {"a": ("A001|A002", "A001"), "b": ("A001|A002", None),
+             "c": ("A001|A002", "A002"), "e": ("A003", None)},
+        )
+        self.assertEqual(result.splits, [("A001|A002", ("A001", "A002"), ("b",))])
+        self.assertEqual(self.engine.assignments(), {"a": "A001", "c": "A002", "d": "A003"})
+        self.assertFalse(self.warnings_path.exists())
+
+    def test_remove_samples_matches_full_recompute(self):
+        self.engine.set_previous_clustering(
+            make_previous_clustering(
+                [["a", np.nan, "A001"], ["c", np.nan, "A002"], ["e", np.nan, "A003"]]
+            )
+        )
+        edges = [["a", "b"], ["b", "c"], ["c", "d"], ["d", "e"], ["a", "e"]]
+        self.engine.add_edges(*zip(*edges))
+        self.engine.infer()
+        self.engine.remove_samples(["a"])
+
+        full = ClusterEngine(10, "|", Path(self.tmpdir.name) / "full.WARNINGS.txt")
+        full.previous = self.engine.previous
+        full.add_edges(*zip(*[edge for edge in edges if "a" not in edge]))
+        self.assertEqual(self.engine.assignments(), full.infer())
+        self.assertEqual(
+            self.warnings_path.read_text().splitlines()[-1],
+            full.warnings_path.read_text().splitlines()[-1],
+        )
+
+    def test_removed_samples_edges_are_skipped(self):
+        # chunks of one edge and edges added after the index was built
+        engine = ClusterEngine(10, "|", self.warnings_path, spill_dir=self.tmpdir.name)
+        with mock.patch("cluster_engine.EDGE_INDEX_CHUNK_SIZE", 1):
+            engine.add_edges(["a", "b", "d", "a"], ["b", "c", "e", "f"])
+            engine.infer()
+            engine.remove_samples(["b"])
+            engine.add_batch(["c", "g"], ["g", "h"])
+            engine.remove_samples(["g"])
+            # b is added again, its earlier edge to c is gone
+            engine.add_batch(["b"], ["a"])
+            engine.remove_samples(["f"])
+        self.assertEqual(
+            sorted(sorted(engine.samples[i] for i in group) for group in engine.components()),
+            [["a", "b"], ["c"], ["d", "e"], ["h"]],
+        )
+        path = Path(self.tmpdir.name) / "state.npz"
+        engine.save(path)
+        loaded = ClusterEngine.load(path)
+        self.assertEqual(
+            sorted(tuple(sorted(loaded.samples[i] for i in edge)) for edge in loaded.edges),
+            [("a", "b"), ("d", "e")],
+        )
+
+    def test_sample_ids(self):
+        engine = ClusterEngine(10, "|", self.warnings_path, sample_ids=True)
+        # components are named in order of first appearance, not by id
+        engine.add_edges([7, 2, 5], [3, 9, 3])
+        self.assertEqual(len(engine), 5)
+        self.assertEqual(engine.infer(), {7: "A001", 3: "A001", 5: "A001", 2: "A002", 9: "A002"})
+        result = engine.remove_samples([3, 0])
+        self.assertEqual(result.changes[3], ("A001", None))
+        # the pieces have no previous cluster, so get new names in order of first appearance
+        self.assertEqual(engine.assignments(), {7: "A003", 5: "A004", 2: "A002", 9: "A002"})
+
+    def test_save_and_load(self):
+        self.engine.set_previous_clustering(make_previous_clustering([["a", "B001", "B001"]]))
+        self.engine.add_edges(["a", "c"], ["b", "d"])
+        assignments = self.engine.infer()
+        path = Path(self.tmpdir.name) / "state.npz"
+        self.engine.save(path)
+
+        engine = ClusterEngine.load(path)
+        self.assertEqual(engine.assignments(), assignments)
+        self.assertEqual(engine.previous, {"a": ("B001", "B001")})
+        result = engine.add_batch(["d"], ["e"])
+        self.assertEqual(result.changes, {"e": (None, "B002")})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import unittest
+import tempfile
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+import cluster
+from cluster_server import ClusterServer, ClusterService, parse_args, send_request
+
+SAMPLES = ["a", "b", "c", "d", "e", "f"]
+DISTANCES = {
+    ("a", "b"): 3,
+    ("a", "c"): 40,
+    ("b", "c"): 35,
+    ("c", "d"): 2,
+    ("a", "e"): 8,
+    ("d", "e"): 9,
+    ("b", "f"): 60,
+}
+
+
+def distance(sample1, sample2):
+    if sample1 == sample2:
+        return 0
+    return DISTANCES.get((sample1, sample2), DISTANCES.get((sample2, sample1), 100))
+
+
+def write_distances(path, samples):
+    "Distances in the order of snp-dists --molten"
+    rows = [(s1, s2, distance(s1, s2)) for s1 in samples for s2 in samples]
+    pd.DataFrame(rows).to_csv(path, sep="\t", header=False, index=False)
+
+
+class TestClusterService(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmpdir.name)
+        self.previous_clustering = tmp / "clusters_previous.csv"
+        pd.DataFrame(
+            [["a", "A001", "", "A001"], ["b", "A001", "", "A001"]],
+            columns=["sample", "inferred_cluster", "curated_cluster", "final_cluster"],
+        ).to_csv(self.previous_clustering, index=False)
+        self.distances_previous = tmp / "distances_previous.tsv"
+        write_distances(self.distances_previous, SAMPLES[:2])
+        self.args = parse_args(
+            [
+                "--socket", str(tmp / "cluster.sock"),
+                "--state", str(tmp / "state.npz"),
+                "--previous-clustering", str(self.previous_clustering),
+                "--distances", str(self.distances_previous),
+                "--output", str(tmp / "clusters.csv"),
+                "--threshold", "10",
+            ]
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def cluster_batch(self):
+        tmp = Path(self.tmpdir.name)
+        write_distances(tmp / "distances.tsv", SAMPLES)
+        argv = [
+            "--previous-clustering", str(self.previous_clustering),
+            "--distances", str(tmp / "distances.tsv"),
+            "--output", str(tmp / "clusters_batch.csv"),
+            "--threshold", "10",
+        ]
+        if self.args.exclude_list:
+            argv += ["--exclude-list", str(self.args.exclude_list)]
+        args = cluster.parse_args(argv)
+        cluster.main(args)
+        return args.output.read_text()
+
+    def add_samples(self, service):
+        for i, sample in enumerate(SAMPLES[2:], start=2):
+            service.add(sample, {other: distance(sample, other) for other in SAMPLES[:i]})
+
+    def test_checkpoint_matches_batch(self):
+        service = ClusterService.from_run(self.args)
+        self.add_samples(service)
+        service.checkpoint()
+        self.assertEqual(self.args.output.read_text(), self.cluster_batch())
+
+    def test_add_reports_changes(self):
+        service = ClusterService.from_run(self.args)
+        self.assertEqual(
+            service.add("c", {"a": 40, "b": 35})["changes"], {"c": [None, "A002"]}
+        )
+        response = service.add("e", {"a": 8, "b": 100, "c": 100})
+        self.assertEqual(response["changes"], {"e": [None, "A001"]})
+        response = service.add("d", {"a": 100, "b": 100, "c": 2, "e": 9})
+        self.assertEqual(response["merges"][0]["clusters"], ("A001", "A002"))
+        self.assertEqual(service.query(["d", "x"])["clusters"], {"d": "A001|A002", "x": None})
+
+    def test_unknown_neighbours_are_rejected(self):
+        service = ClusterService.from_run(self.args)
+        with self.assertRaisesRegex(ValueError, "unknown samples, e.g. TYPO"):
+            service.add("c", {"a": 3, "TYPO": 1})
+        self.assertEqual(service.query(["c", "TYPO"])["clusters"], {"c": None, "TYPO": None})
+        self.assertNotIn("TYPO", service.engine.index)
+
+    def test_samples_are_added_once(self):
+        service = ClusterService.from_run(self.args)
+        service.add("c", {"a": 40, "b": 35})
+        with self.assertRaisesRegex(ValueError, "already added"):
+            service.add("c", {"a": 3})
+        self.assertRaises(ValueError, service.add, "a", {"b": 1})
+        self.assertEqual(service.query(["c"])["clusters"], {"c": "A002"})
+
+    def test_remove_matches_batch(self):
+        service = ClusterService.from_run(self.args)
+        self.add_samples(service)
+        response = service.remove(["e_contig1"])
+        self.assertEqual(response["splits"][0]["clusters"], ("A001", "A004"))
+        self.assertRaises(ValueError, service.add, "e", {"a": 8})
+        service.checkpoint()
+
+        self.args.exclude_list = Path(self.tmpdir.name) / "list_excluded_samples.tsv"
+        self.args.exclude_list.write_text("sample\ne\n")
+        self.assertEqual(self.args.output.read_text(), self.cluster_batch())
+
+    def test_restart_from_state(self):
+        service = ClusterService.from_run(self.args)
+        service.add("c", {"a": 40, "b": 35})
+        service.checkpoint()
+        service = ClusterService.from_run(self.args)
+        self.assertEqual(service.query(["c"])["clusters"], {"c": "A002"})
+
+    def test_socket(self):
+        service = ClusterService.from_run(self.args)
+        socket_path = Path(self.tmpdir.name) / "cluster.sock"
+        server = ClusterServer(socket_path, service)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            response = send_request(
+                socket_path, {"op": "add", "sample": "c_contig1", "distances": {"a": 4}}
+            )
+            self.assertEqual(response, {"ok": True, "changes": {"c": [None, "A001"]}, "merges": []})
+            response = send_request(socket_path, {"op": "unknown"})
+            self.assertFalse(response["ok"])
+            response = send_request(
+                socket_path, {"op": "add", "sample": "d", "distances": {"TYPO": 1}}
+            )
+            self.assertFalse(response["ok"])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
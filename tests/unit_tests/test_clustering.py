@@ -1,7 +1,131 @@
 import unittest
+import random
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+import cluster
+from sample_registry import SampleRegistry, samples_in_distances
+
+
+def make_distances(rows):
+    df = pd.DataFrame(rows, columns=["sample1", "sample2", "distance"])
+    for col in ["sample1", "sample2"]:
+        df[col] = df[col].astype("category")
+    return df
 
 
 class TestClustering(unittest.TestCase):
     def test_clustering(self):
         # TODO: add unit tests
         pass
+
+
+class TestExcludeSamples(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.exclude_list = Path(self.tmpdir.name) / "list_excluded_samples.tsv"
+        self.df_distances = make_distances(
+            [
+                ["a", "a", 0],
+                ["a", "b", 1],
+                ["b", "c", 2],
+                ["c", "c", 0],
+            ]
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_empty_exclude_list(self):
+        self.exclude_list.touch()
+        df = cluster.exclude_samples(self.df_distances, self.exclude_list)
+        self.assertEqual(len(df), 4)
+
+    def test_duplicated_exclude_list(self):
+        self.exclude_list.write_text(
+            "sample\treason\tdate\n"
+            "b\tlow_coverage\t2024-01-01 00:00:00\n"
+            "b\tlow_coverage\t2024-02-01 00:00:00\n"
+        )
+        self.assertEqual(cluster.read_exclude_list(self.exclude_list), {"b"})
+        df = cluster.exclude_samples(self.df_distances, self.exclude_list)
+        self.assertEqual(df[["sample1", "sample2"]].values.tolist(), [["a", "a"], ["c", "c"]])
+
+    def test_clean_categories_merge(self):
+        df = make_distances([["a_contig1", "a", 0], ["a", "b_contig1", 1]])
+        df = cluster.clean_sample_columns(df, ["sample1", "sample2"], "_contig1")
+        self.assertEqual(df["sample1"].tolist(), ["a", "a"])
+        self.assertEqual(df["sample2"].tolist(), ["a", "b"])
+        self.assertEqual(len(df["sample1"].cat.categories), 1)
+
+
+class TestMemoryLimit(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmpdir.name)
+        rng = random.Random(1)
+        samples = [f"s{i:02}_contig1" for i in range(60)]
+        rows = [
+            [s1, s2, 0 if s1 == s2 else rng.randint(0, 1000)]
+            for s1 in samples
+            for s2 in samples
+        ]
+        pd.DataFrame(rows).to_csv(tmp / "distances.tsv", sep="\t", header=False, index=False)
+        pd.DataFrame(
+            [["s01", "A001", "", "A001"], ["s05", "A002", "B001", "B001"], ["s07", "A003", "", "A003"]],
+            columns=["sample", "inferred_cluster", "curated_cluster", "final_cluster"],
+        ).to_csv(tmp / "clusters_previous.csv", index=False)
+        (tmp / "list_excluded_samples.tsv").write_text("sample\treason\tdate\ns03\tlow_coverage\t2024-01-01\n")
+        self.argv = [
+            "--distances", str(tmp / "distances.tsv"),
+            "--previous-clustering", str(tmp / "clusters_previous.csv"),
+            "--exclude-list", str(tmp / "list_excluded_samples.tsv"),
+            "--threshold", "10",
+            "--warnings-path", str(tmp / "WARNINGS.txt"),
+            "--spill-dir", str(tmp),
+        ]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def cluster(self, memory_limit, output, sample_registry=None, previous_registry=None):
+        argv = self.argv + ["--output", str(Path(self.tmpdir.name) / output)]
+        if memory_limit is not None:
+            argv += ["--memory-limit", str(memory_limit)]
+        if sample_registry is not None:
+            argv += ["--sample-registry", str(sample_registry)]
+        if previous_registry is not None:
+            argv += ["--previous-sample-registry", str(previous_registry)]
+        args = cluster.parse_args(argv)
+        cluster.main(args)
+        return args.output.read_text()
+
+    def test_identical_output(self):
+        # the smallest chunks (1000 rows), so the 3600 distances are read in 4 chunks
+        self.assertEqual(self.cluster(1e-6, "chunked.csv"), self.cluster(None, "clusters.csv"))
+        # the spilled edges are removed
+        self.assertEqual(list(Path(self.tmpdir.name).glob("cluster_*")), [])
+
+    def test_sample_registry(self):
+        tmp = Path(self.tmpdir.name)
+        previous = SampleRegistry()
+        previous.add(["s59", "s03", "unrelated"])
+        previous.save(tmp / "previous_registry")
+        expected = self.cluster(None, "clusters.csv")
+        for memory_limit in [None, 1e-6]:
+            prefix = tmp / f"registry_{memory_limit}"
+            self.assertEqual(
+                self.cluster(memory_limit, f"{prefix.name}.csv", prefix, tmp / "previous_registry"),
+                expected,
+            )
+            registry = SampleRegistry.load(prefix)
+            # previous ids are kept and every sample of the distances is registered
+            self.assertEqual(registry.names_of([0, 1, 2]).tolist(), ["s59", "s03", "unrelated"])
+            self.assertEqual(
+                set(registry.names_of(range(len(registry))).tolist()),
+                set(samples_in_distances(tmp / "distances.tsv")) | {"unrelated"},
+            )
+        # without a previous registry
+        self.assertEqual(self.cluster(None, "new_registry.csv", tmp / "new_registry"), expected)
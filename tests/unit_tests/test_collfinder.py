@@ -0,0 +1,71 @@
+import unittest
+
+import collfinder
+from fake_irods import FakeSession
+
+
+def make_avus(n_runs):
+    avus = [("/zone/input", "projectID", "myco"), ("/zone/input", "finish_time", "50")]
+    for i in range(n_runs):
+        run = f"/zone/run{i:03d}"
+        avus += [
+            (run, "projectID", "myco" if i % 2 == 0 else "salm"),
+            (run, "sys::data::state", "valid"),
+            (run, "finish_time", f"{100 + i}.5"),
+        ]
+    return avus
+
+
+class TestCollfinder(unittest.TestCase):
+    def test_finds_latest_matching_run(self):
+        avus = make_avus(10) + [
+            ("/zone/run008", "user::data::state", "invalid"),
+            ("/zone/run009", "sys::data::state", "invalid"),
+        ]
+        session = FakeSession(avus)
+        input_meta = collfinder.get_collection_metadata(session, "/zone/input")
+        previous = collfinder.find_previous_collection(
+            session,
+            input_meta,
+            ["projectID"],
+            "finish_time",
+            ["sys::data::state=valid"],
+            ["user::data::state=invalid"],
+        )
+        # run008 is excluded and run009 is of another project
+        self.assertEqual(previous, "/zone/run006")
+
+    def test_round_trips_do_not_grow_per_collection(self):
+        session = FakeSession(make_avus(200))
+        input_meta = collfinder.get_collection_metadata(session, "/zone/input")
+        previous = collfinder.find_previous_collection(
+            session,
+            input_meta,
+            ["projectID"],
+            "finish_time",
+            ["sys::data::state=valid"],
+            ["user::data::state=invalid"],
+        )
+        self.assertEqual(previous, "/zone/run198")
+        # input metadata, one query per (excluded) AVU and 100 candidates in batches
+        n_batches = -(-100 // collfinder.IN_BATCH_SIZE)
+        self.assertEqual(session.round_trips, 1 + 3 + n_batches)
+
+    def test_no_candidates(self):
+        session = FakeSession(make_avus(4))
+        previous = collfinder.find_previous_collection(
+            session, {"projectID": "unknown"}, ["projectID"], "finish_time"
+        )
+        self.assertIsNone(previous)
+        self.assertEqual(session.round_trips, 1)
+
+    def test_invalid_extra_metadata_is_ignored(self):
+        session = FakeSession(make_avus(4))
+        previous = collfinder.find_previous_collection(
+            session, {"projectID": "myco"}, ["projectID"], "finish_time", ["invalid"]
+        )
+        self.assertEqual(previous, "/zone/run002")
+
+
+if __name__ == "__main__":
+    unittest.main()
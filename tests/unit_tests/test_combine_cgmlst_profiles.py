@@ -0,0 +1,57 @@
+import unittest
+import tempfile
+from unittest import mock
+from pathlib import Path
+
+import numpy as np
+
+import combine_cgmlst_profiles as ccp
+
+
+class TestAlleleCodebook(unittest.TestCase):
+    def test_codes_per_locus(self):
+        codebook = ccp.AlleleCodebook(["l1", "l2"])
+        self.assertEqual(codebook.encode(0, "12"), 1)
+        self.assertEqual(codebook.encode(0, "INF-7"), 2)
+        self.assertEqual(codebook.encode(0, "7"), 2)
+        self.assertEqual(codebook.encode(1, "7"), 1)
+        self.assertEqual(codebook.encode(1, "LNF"), ccp.MISSING)
+        self.assertEqual(codebook.encode(1, ""), ccp.MISSING)
+
+    def test_incremental_matches_from_scratch(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = Path(tmpdir)
+            profiles = []
+            for i, calls in enumerate([["1", "2"], ["1", "LNF"], ["a1b2", "2"]]):
+                path = tmpdir / f"profile_{i}.tsv"
+                path.write_text("FILE\tl1\tl2\n" + f"s{i}.fasta\t" + "\t".join(calls) + "\n")
+                profiles.append(path)
+
+            codebook = ccp.AlleleCodebook(["l1", "l2"])
+            samples, matrix = ccp.encode_profiles(profiles[:2], codebook, [])
+            ccp.write_allele_matrix(tmpdir / "alleles.tsv.gz", samples, codebook.loci, matrix)
+            codebook.to_tsv(tmpdir / "codes.tsv.gz")
+
+            samples, loci, matrix = ccp.read_allele_matrix(tmpdir / "alleles.tsv.gz")
+            codebook = ccp.AlleleCodebook.from_tsv(tmpdir / "codes.tsv.gz", loci)
+            new_samples, new_matrix = ccp.encode_profiles(profiles[1:], codebook, samples)
+
+        self.assertEqual(matrix.dtype, np.uint8)
+        self.assertEqual(samples + new_samples, ["s0", "s1", "s2"])
+        np.testing.assert_array_equal(
+            np.vstack([matrix, new_matrix]), [[1, 1], [1, 0], [2, 1]]
+        )
+
+    def test_read_in_chunks(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "alleles.tsv.gz"
+            ccp.write_allele_matrix(
+                path, ["007", "s1", "s2"], ["l1", "l2"], np.array([[1, 2], [0, 300], [3, 0]])
+            )
+            with mock.patch.object(ccp, "READ_CHUNK_SIZE", 1):
+                samples, loci, matrix = ccp.read_allele_matrix(path)
+
+        self.assertEqual(samples, ["007", "s1", "s2"])
+        self.assertEqual(loci, ["l1", "l2"])
+        self.assertEqual(matrix.dtype, np.uint16)
+        np.testing.assert_array_equal(matrix, [[1, 2], [0, 300], [3, 0]])
@@ -0,0 +1,99 @@
+import unittest
+import tempfile
+import random
+from pathlib import Path
+
+import pandas as pd
+
+import cluster
+from distance_summary import DistanceSummary
+
+
+def make_distances(n_samples, seed=1):
+    rng = random.Random(seed)
+    samples = [f"s{i:02}" for i in range(n_samples)]
+    distances = {}
+    rows = []
+    for s1 in samples:
+        for s2 in samples:
+            if (s2, s1) not in distances:
+                distances[(s1, s2)] = 0 if s1 == s2 else rng.randint(0, 30)
+            rows.append([s1, s2, distances.get((s1, s2), distances.get((s2, s1)))])
+    return pd.DataFrame(rows, columns=["sample1", "sample2", "distance"])
+
+
+class TestDistanceSummary(unittest.TestCase):
+    def test_matches_pandas(self):
+        df = make_distances(20)
+        summary = DistanceSummary(10, max_distance=25)
+        summary.update(df.astype({"sample1": "category", "sample2": "category"}))
+
+        df_other = df[df["sample1"] != df["sample2"]]
+        df_expected = (
+            df_other.sort_values(["sample1", "distance", "sample2"])
+            .drop_duplicates("sample1")
+            .set_index("sample1")
+        )
+        df_neighbours = summary.neighbours().set_index("sample")
+        self.assertEqual(df_neighbours["nearest_neighbour"].to_dict(), df_expected["sample2"].to_dict())
+        self.assertEqual(df_neighbours["nearest_distance"].to_dict(), df_expected["distance"].to_dict())
+        self.assertEqual(
+            df_neighbours["n_within_threshold"].to_dict(),
+            (df_other["distance"] <= 10).groupby(df_other["sample1"]).sum().to_dict(),
+        )
+
+        df_histogram = summary.histogram()
+        pairs = df_other[df_other["sample1"] < df_other["sample2"]]["distance"]
+        self.assertEqual(df_histogram["n_pairs"].sum(), 20 * 19 / 2)
+        self.assertEqual(df_histogram["n_pairs"].iloc[3], (pairs == 3).sum())
+        self.assertEqual(df_histogram["distance"].iloc[-1], ">25")
+        self.assertEqual(df_histogram["n_pairs"].iloc[-1], (pairs > 25).sum())
+
+    def test_chunks_give_same_summary(self):
+        df = make_distances(15).astype({"sample1": "category", "sample2": "category"})
+        whole = DistanceSummary(10)
+        whole.update(df)
+        chunked = DistanceSummary(10)
+        for start in range(0, len(df), 7):
+            chunk = df.iloc[start : start + 7].copy()
+            chunk["sample1"] = chunk["sample1"].cat.remove_unused_categories()
+            chunk["sample2"] = chunk["sample2"].cat.remove_unused_categories()
+            chunked.update(chunk)
+        pd.testing.assert_frame_equal(chunked.neighbours(), whole.neighbours())
+        pd.testing.assert_frame_equal(chunked.histogram(), whole.histogram())
+
+
+class TestClusterSummary(unittest.TestCase):
+    def test_written_in_both_modes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            df = make_distances(40)
+            df["sample1"] = df["sample1"] + "_contig1"
+            df.to_csv(tmp / "distances.tsv", sep="\t", header=False, index=False)
+            (tmp / "list_excluded_samples.tsv").write_text("sample\ns05\n")
+            outputs = []
+            for memory_limit in [None, 1e-6]:
+                argv = [
+                    "--distances", str(tmp / "distances.tsv"),
+                    "--exclude-list", str(tmp / "list_excluded_samples.tsv"),
+                    "--threshold", "2",
+                    "--warnings-path", str(tmp / "WARNINGS.txt"),
+                    "--output", str(tmp / "clusters.csv"),
+                    "--spill-dir", str(tmp),
+                    "--neighbours", str(tmp / f"neighbours_{memory_limit}.tsv"),
+                    "--distance-histogram", str(tmp / f"histogram_{memory_limit}.tsv"),
+                    "--max-distance", "20",
+                ]
+                if memory_limit is not None:
+                    argv += ["--memory-limit", str(memory_limit)]
+                args = cluster.parse_args(argv)
+                cluster.main(args)
+                outputs.append((args.neighbours.read_text(), args.distance_histogram.read_text()))
+            self.assertEqual(outputs[0], outputs[1])
+            df_neighbours = pd.read_csv(tmp / "neighbours_None.tsv", sep="\t")
+            self.assertEqual(len(df_neighbours), 39)
+            self.assertNotIn("s05", set(df_neighbours["sample"]) | set(df_neighbours["nearest_neighbour"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
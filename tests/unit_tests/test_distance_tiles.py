@@ -0,0 +1,112 @@
+import unittest
+import io
+import itertools
+import tempfile
+from pathlib import Path
+
+import distance_tiles
+import split_alignment
+
+MAX_DISTANCE = 3
+
+
+def fake_distle(sequences, names, precomputed=None):
+    """
+    Distances of all ordered pairs within MAX_DISTANCE as distle writes them in full mode,
+    with precomputed distances of the leading samples taken as given
+    """
+    precomputed = precomputed or {}
+    lines = []
+    for a, b in itertools.product(names, names):
+        if (a, b) in precomputed:
+            lines.append(precomputed[(a, b)])
+            continue
+        distance = sum(x != y for x, y in zip(sequences[a], sequences[b]))
+        if distance <= MAX_DISTANCE:
+            lines.append(f"{a}\t{b}\t{distance}\n")
+    return lines
+
+
+def chunk_names(chunks_dir, chunk):
+    with open(split_alignment.chunk_path(chunks_dir, chunk)) as f:
+        return [line[1:].split()[0] for line in f if line.startswith(">")]
+
+
+class TestGatherTiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+        sequences = ["AAAAAA", "AAAAAC", "AAAACC", "CCCCCC", "AAAAAA", "ACAAAA", "CCCCCA"]
+        self.sequences = {f"s{i}": seq for i, seq in enumerate(sequences)}
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_tiles(self, names, previous_names, tile_size, previous_distances=None):
+        """
+        Split, calculate the scheduled tiles as the rules do and gather them
+        """
+        chunks_dir = self.tmp / "chunks"
+        aln = "".join(f">{name}\n{self.sequences[name]}\n" for name in names)
+        chunks = split_alignment.split_alignment(
+            io.StringIO(aln), chunks_dir, tile_size, previous_names
+        )
+        if previous_distances:
+            with open(previous_distances) as f:
+                split_alignment.split_previous_distances(f, chunks_dir, previous_names, tile_size)
+        new_chunks = {chunk for chunk, _, is_new in chunks if is_new}
+        tiles = []
+        for chunk_a, chunk_b in distance_tiles.list_tiles(chunks):
+            names_a = chunk_names(chunks_dir, chunk_a)
+            if chunk_a in new_chunks:
+                leading = fake_distle(self.sequences, names_a)
+            else:
+                leading = split_alignment.chunk_distances_path(chunks_dir, chunk_a).read_text()
+                leading = leading.splitlines(keepends=True)
+            if chunk_a == chunk_b:
+                lines = leading
+            else:
+                # chunk A followed by chunk B, with the distances within chunk A as precomputed
+                precomputed = {tuple(line.split("\t")[:2]): line for line in leading}
+                names_b = chunk_names(chunks_dir, chunk_b)
+                all_lines = fake_distle(self.sequences, names_a + names_b, precomputed)
+                output = io.StringIO()
+                distance_tiles.select_cross_pairs(io.StringIO("".join(all_lines)), set(names_b), output)
+                lines = output.getvalue().splitlines(keepends=True)
+            tile = self.tmp / f"tile_{chunk_a}_{chunk_b}.tsv"
+            tile.write_text("".join(lines))
+            tiles.append(tile)
+        output = self.tmp / "distances.tsv"
+        distance_tiles.gather_tiles(output, tiles, previous_distances)
+        return chunks, output.read_text().splitlines()
+
+    def assert_all_pairs_once(self, names, lines):
+        expected = sorted(line.rstrip("\n") for line in fake_distle(self.sequences, names))
+        self.assertEqual(len(lines), len(set(lines)))
+        self.assertEqual(sorted(lines), expected)
+        self_pairs = [line for line in lines if line.split("\t")[0] == line.split("\t")[1]]
+        self.assertEqual(len(self_pairs), len(names))
+
+    def test_from_scratch(self):
+        names = list(self.sequences)
+        chunks, lines = self.run_tiles(names, [], 3)
+        # 3 chunks, 3 diagonal and 3 off-diagonal tiles
+        self.assertEqual(len(distance_tiles.list_tiles(chunks)), 6)
+        self.assert_all_pairs_once(names, lines)
+
+    def test_previous_tiles_are_not_calculated(self):
+        names = list(self.sequences)
+        previous = self.tmp / "previous.tsv"
+        previous.write_text("".join(fake_distle(self.sequences, names[:4])))
+        chunks, lines = self.run_tiles(names, names[:4], 3, previous)
+
+        self.assertEqual([is_new for _, _, is_new in chunks], [False, False, True])
+        # only tiles with the chunk of new samples
+        self.assertEqual(
+            distance_tiles.list_tiles(chunks),
+            [("0000", "0002"), ("0001", "0002"), ("0002", "0002")],
+        )
+        self.assert_all_pairs_once(names, lines)
+        # self pairs of new samples only come from their diagonal tile
+        tile = (self.tmp / "tile_0000_0002.tsv").read_text().splitlines()
+        self.assertFalse(any(line.split("\t")[0] == line.split("\t")[1] for line in tile))
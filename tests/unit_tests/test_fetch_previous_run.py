@@ -0,0 +1,132 @@
+import unittest
+import tempfile
+from argparse import Namespace
+from pathlib import Path
+
+from fetch_previous_run import (
+    CONFIG_DIR,
+    LocalBackend,
+    fetch_collection,
+    fetch_previous_run,
+)
+
+
+class CountingBackend(LocalBackend):
+    def __init__(self):
+        self.downloads = []
+
+    def download(self, collection, name, local_path):
+        self.downloads.append(name)
+        super().download(collection, name, local_path)
+
+
+class TestFetchPreviousRun(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmpdir.name)
+        self.remote = tmp / "remote_run"
+        self.remote.mkdir()
+        for name in [
+            "aln.fa.gz",
+            "distances.tsv",
+            "clusters.csv",
+            "list_excluded_samples.tsv",
+            "list_excluded_samples.ledger.tsv.gz",
+            "clustering.log",
+        ]:
+            (self.remote / name).write_text(f"previous {name}\n")
+        self.curated = tmp / "remote_curation"
+        self.curated.mkdir()
+        (self.curated / "clusters.csv").write_text("curated clusters.csv\n")
+        self.args = Namespace(
+            previous_run=str(self.remote),
+            curated_collection=None,
+            clustering_preset="mycobacterium_tuberculosis",
+            output_dir=tmp / "previous_run",
+            curated_dir=tmp / "curation",
+            output_copies_dir=tmp / "output",
+            manifest=CONFIG_DIR / "previous_run_manifest.yaml",
+            presets=CONFIG_DIR / "presets.yaml",
+            threads=2,
+            recluster_from=None,
+            recluster_dir=tmp / "earlier_run",
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_fetches_only_manifest_files(self):
+        fetch_previous_run(LocalBackend(), self.args)
+        fetched = sorted(path.name for path in self.args.output_dir.iterdir())
+        self.assertEqual(
+            fetched,
+            [
+                "aln.fa.gz",
+                "clusters.csv",
+                "distances.tsv",
+                "list_excluded_samples.ledger.tsv.gz",
+                "list_excluded_samples.tsv",
+            ],
+        )
+        self.assertEqual(
+            (self.args.output_copies_dir / "clusters_previous.csv").read_text(),
+            "previous clusters.csv\n",
+        )
+
+    def test_missing_required_file(self):
+        (self.remote / "distances.tsv").unlink()
+        with self.assertRaises(FileNotFoundError):
+            fetch_previous_run(LocalBackend(), self.args)
+
+    def test_skips_files_with_matching_checksum(self):
+        backend = CountingBackend()
+        fetch_collection(backend, self.remote, ["clusters.csv", "distances.tsv"], [], self.args.output_dir)
+        (self.args.output_dir / "distances.tsv").write_text("changed\n")
+        backend.downloads = []
+        fetch_collection(backend, self.remote, ["clusters.csv", "distances.tsv"], [], self.args.output_dir)
+        self.assertEqual(backend.downloads, ["distances.tsv"])
+        self.assertEqual(
+            (self.args.output_dir / "distances.tsv").read_text(), "previous distances.tsv\n"
+        )
+
+    def test_curated_files_replace_previous(self):
+        self.args.curated_collection = str(self.curated)
+        fetch_previous_run(LocalBackend(), self.args)
+        previous = self.args.output_dir
+        self.assertEqual((previous / "clusters.csv").read_text(), "curated clusters.csv\n")
+        self.assertEqual((previous / "clusters.csv.old").read_text(), "previous clusters.csv\n")
+        # the exclusion list was not curated, so the ledger is kept
+        self.assertTrue((previous / "list_excluded_samples.ledger.tsv.gz").exists())
+        copies = self.args.output_copies_dir
+        self.assertEqual((copies / "clusters_previous.csv").read_text(), "previous clusters.csv\n")
+        self.assertEqual(
+            (copies / "clusters_previous_curated.csv").read_text(), "curated clusters.csv\n"
+        )
+
+    def test_curated_exclusion_list_replaces_ledger(self):
+        (self.curated / "list_excluded_samples.tsv").write_text("curated\n")
+        self.args.curated_collection = str(self.curated)
+        fetch_previous_run(LocalBackend(), self.args)
+        previous = self.args.output_dir
+        self.assertFalse((previous / "list_excluded_samples.ledger.tsv.gz").exists())
+        self.assertTrue((previous / "list_excluded_samples.ledger.tsv.gz.old").exists())
+        self.assertEqual((previous / "list_excluded_samples.tsv").read_text(), "curated\n")
+
+    def test_recluster_run(self):
+        (self.remote / "input_checksums.yaml").write_text("inputs: {}\n")
+        self.args.recluster_from = str(self.remote)
+        self.args.previous_run = None
+        fetch_previous_run(LocalBackend(), self.args)
+        fetched = sorted(path.name for path in self.args.recluster_dir.iterdir())
+        self.assertEqual(fetched, ["aln.fa.gz", "distances.tsv", "input_checksums.yaml"])
+        self.assertFalse(self.args.output_dir.exists())
+
+    def test_recluster_run_without_checksums(self):
+        self.args.recluster_from = str(self.remote)
+        fetch_previous_run(LocalBackend(), self.args)
+        self.assertFalse(self.args.recluster_dir.exists())
+        self.assertTrue((self.args.output_dir / "clusters.csv").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+from input_checksums import (
+    can_reuse_outputs,
+    input_checksums,
+    link_output,
+    output_checksums,
+    output_sizes,
+    read_checksums,
+    write_checksums,
+)
+
+CONFIG = {"clustering_type": "alignment", "max_distance": "200", "N_content_threshold": "0.5"}
+
+
+class TestInputChecksums(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmpdir.name)
+        self.inputs = {}
+        for sample in ["s1", "s2"]:
+            self.inputs[sample] = tmp / f"{sample}.fasta"
+            self.inputs[sample].write_text(f">{sample}\nACGT\n")
+        self.previous = tmp / "previous_run"
+        self.previous.mkdir()
+        (self.previous / "aln.fa.gz").write_text("previous alignment")
+        (self.previous / "distances.tsv").write_text("previous distances")
+        self.run_dir = tmp / "run"
+        self.run_dir.mkdir()
+        (self.run_dir / "aln.fa.gz").write_text("alignment")
+        (self.run_dir / "distances.tsv").write_text("distances")
+        write_checksums(
+            self.run_dir / "input_checksums.yaml",
+            input_checksums(self.inputs, str(self.previous), CONFIG),
+            output_checksums(self.run_dir, "alignment"),
+            output_sizes(self.run_dir, "alignment"),
+        )
+        self.recorded = read_checksums(self.run_dir / "input_checksums.yaml")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_same_inputs(self):
+        inputs = input_checksums(self.inputs, str(self.previous), CONFIG)
+        self.assertTrue(can_reuse_outputs(self.recorded, inputs, "alignment"))
+
+    def test_changed_inputs(self):
+        changed = [
+            input_checksums(dict(reversed(self.inputs.items())), str(self.previous), CONFIG),
+            input_checksums(self.inputs, "None", CONFIG),
+            input_checksums(self.inputs, str(self.previous), {**CONFIG, "max_distance": "300"}),
+        ]
+        self.inputs["s2"].write_text(">s2\nACGA\n")
+        changed.append(input_checksums(self.inputs, str(self.previous), CONFIG))
+        for inputs in changed:
+            self.assertFalse(can_reuse_outputs(self.recorded, inputs, "alignment"))
+        self.assertFalse(can_reuse_outputs(None, changed[0], "alignment"))
+
+    def test_link_output(self):
+        output = Path(self.tmpdir.name) / "distances.tsv"
+        link_output(self.run_dir, "distances.tsv", self.recorded, output)
+        self.assertEqual(output.read_text(), "distances")
+        self.assertTrue(output.samefile(self.run_dir / "distances.tsv"))
+        output.unlink()
+        (self.run_dir / "distances.tsv").write_text("cut")
+        with self.assertRaises(ValueError):
+            link_output(self.run_dir, "distances.tsv", self.recorded, output)
+        # runs which did not record sizes
+        del self.recorded["sizes"]
+        link_output(self.run_dir, "distances.tsv", self.recorded, output)
+        self.assertEqual(output.read_text(), "cut")
+
+
+if __name__ == "__main__":
+    unittest.main()
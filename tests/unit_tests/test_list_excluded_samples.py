@@ -0,0 +1,72 @@
+import unittest
+import hashlib
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+import list_excluded_samples
+
+
+class TestMergeExclusions(unittest.TestCase):
+    def test_first_date_is_kept(self):
+        df_previous = pd.DataFrame(
+            [
+                ["b", "low_coverage", "2024-01-01 00:00:00"],
+                ["b", "low_coverage", "2023-01-01 00:00:00"],
+            ],
+            columns=list_excluded_samples.LEDGER_COLUMNS,
+        )
+        df_new = pd.DataFrame(
+            [
+                ["b", "low_coverage", "2025-01-01 00:00:00"],
+                ["b", "not_NLA", "2025-01-01 00:00:00"],
+                ["a", "low_coverage", "2025-01-01 00:00:00"],
+            ],
+            columns=list_excluded_samples.LEDGER_COLUMNS,
+        )
+        df = list_excluded_samples.merge_exclusions(df_previous, df_new)
+        self.assertEqual(
+            df.astype(str).values.tolist(),
+            [
+                ["a", "low_coverage", "2025-01-01 00:00:00"],
+                ["b", "low_coverage", "2023-01-01 00:00:00"],
+                ["b", "not_NLA", "2025-01-01 00:00:00"],
+            ],
+        )
+
+
+class TestQCCache(unittest.TestCase):
+    def test_cached_files_are_not_parsed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cached = Path(tmpdir) / "cached.json"
+            cached.write_text("not json")
+            new = Path(tmpdir) / "new.json"
+            new.write_text('{"mean_coverage": "25.5", "rrs_rrl_snp_counts": "1"}')
+            df_cache = pd.DataFrame(
+                [["cached", None, None, None, hashlib.md5(b"not json").hexdigest(), 10.0, 0.0]],
+                columns=list_excluded_samples.QC_CACHE_COLUMNS,
+            )
+
+            df = list_excluded_samples.read_input_data([cached, new], df_cache, 2)
+
+        self.assertEqual(df["sample"].tolist(), ["cached", "new"])
+        self.assertEqual(df["mean_coverage"].tolist(), [10.0, 25.5])
+
+    def test_unchanged_files_are_not_read(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cached = Path(tmpdir) / "cached.json"
+            cached.write_text("not json")
+            stat = cached.stat()
+            # a checksum that does not match, so reading the file would parse it and fail
+            df_cache = pd.DataFrame(
+                [["cached", str(cached), stat.st_size, stat.st_mtime_ns, "0", 10.0, 0.0]],
+                columns=list_excluded_samples.QC_CACHE_COLUMNS,
+            )
+
+            df = list_excluded_samples.read_input_data([cached], df_cache)
+            self.assertEqual(df["mean_coverage"].tolist(), [10.0])
+
+            cached.write_text('{"mean_coverage": "30", "rrs_rrl_snp_counts": "0"}')
+            df = list_excluded_samples.read_input_data([cached], df_cache)
+            self.assertEqual(df["mean_coverage"].tolist(), [30.0])
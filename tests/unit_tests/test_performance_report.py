@@ -0,0 +1,64 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from performance_report import compare_reports, read_benchmarks, summarise_benchmarks
+
+
+def write_benchmark(path, wall_s, max_rss_mb):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(
+        {
+            "s": [wall_s],
+            "h:m:s": ["0:00:00"],
+            "max_rss": [max_rss_mb],
+            "max_vms": [0.0],
+            "max_uss": [0.0],
+            "max_pss": [0.0],
+            "io_in": [1.0],
+            "io_out": [2.0],
+            "mean_load": [100.0],
+            "cpu_time": [wall_s],
+        }
+    ).to_csv(path, sep="\t", index=False)
+
+
+class TestPerformanceReport(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.benchmark_dir = Path(self.tmpdir.name)
+        write_benchmark(self.benchmark_dir / "clustering_from_previous.tsv", 100, 2048)
+        write_benchmark(self.benchmark_dir / "distance_calculation_snp_tile/0000_0002.tsv", 60, 512)
+        write_benchmark(self.benchmark_dir / "distance_calculation_snp_tile/0000_0001.tsv", 90, 1024)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_summarise_per_rule(self):
+        df = summarise_benchmarks(read_benchmarks(self.benchmark_dir)).set_index("rule")
+        self.assertEqual(df.loc["distance_calculation_snp_tile", "jobs"], 2)
+        self.assertEqual(df.loc["distance_calculation_snp_tile", "wall_s"], 150)
+        self.assertEqual(df.loc["distance_calculation_snp_tile", "max_rss_mb"], 1024)
+        self.assertEqual(df.loc["distance_calculation_snp_tile", "io_out_mb"], 4)
+        self.assertEqual(df.loc["clustering_from_previous", "jobs"], 1)
+
+    def test_compare_flags_regressions(self):
+        df_report = summarise_benchmarks(read_benchmarks(self.benchmark_dir))
+        df_previous = df_report.copy()
+        df_previous.loc[df_previous["rule"] == "clustering_from_previous", "wall_s"] = 10
+        df = compare_reports(df_report, df_previous, 1.5, 60).set_index("rule")
+        self.assertTrue(df.loc["clustering_from_previous", "regression"])
+        self.assertEqual(df.loc["clustering_from_previous", "wall_s_ratio"], 10)
+        self.assertFalse(df.loc["distance_calculation_snp_tile", "regression"])
+
+    def test_compare_without_previous_report(self):
+        df_report = summarise_benchmarks(read_benchmarks(self.benchmark_dir))
+        df = compare_reports(df_report, None, 1.5, 60)
+        self.assertFalse(df["regression"].any())
+        self.assertTrue(df["previous_wall_s"].isna().all())
+
+
+if __name__ == "__main__":
+    unittest.main()
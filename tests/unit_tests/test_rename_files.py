@@ -0,0 +1,73 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from rename_files import rename_input_dir, rewrite_fasta_header
+
+SEQUENCE = "ACGTN" * 30 + "\n"
+
+
+class TestRenameFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_dir = Path(self.tmpdir.name) / "input"
+        self.fasta_dir = self.input_dir / "mtb_typing" / "consensus"
+        self.json_dir = self.input_dir / "mtb_typing" / "seq_exp_json"
+        self.fasta_dir.mkdir(parents=True)
+        self.json_dir.mkdir(parents=True)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_rewrite_header_copies_sequence(self):
+        src = self.fasta_dir / "s1.fasta"
+        src.write_text(">s1 consensus\n" + SEQUENCE * 3)
+        dst = self.fasta_dir / "s1_run1.fasta"
+        rewrite_fasta_header(src, dst)
+        self.assertFalse(src.exists())
+        self.assertEqual(dst.read_text(), ">s1_run1 consensus\n" + SEQUENCE * 3)
+
+    def test_rewrite_header_keeps_sequence(self):
+        src = self.fasta_dir / "s1.fasta"
+        src.write_text(">a_much_longer_old_header\n" + SEQUENCE)
+        dst = self.fasta_dir / "s1_run1.fasta"
+        rewrite_fasta_header(src, dst)
+        self.assertFalse(src.exists())
+        # the header is not padded, the file only differs in its id
+        self.assertEqual(dst.read_text(), ">s1_run1\n" + SEQUENCE)
+
+    def test_rewrite_header_already_renamed(self):
+        src = self.fasta_dir / "s1.fasta"
+        src.write_text(">s1_run1 consensus\n" + SEQUENCE)
+        inode = src.stat().st_ino
+        dst = self.fasta_dir / "s1_run1.fasta"
+        rewrite_fasta_header(src, dst)
+        self.assertEqual(dst.stat().st_ino, inode)
+        self.assertEqual(dst.read_text(), ">s1_run1 consensus\n" + SEQUENCE)
+
+    def test_rename_input_dir(self):
+        for sample in ["s1", "s2", "s3"]:
+            (self.fasta_dir / f"{sample}.fasta").write_text(f">{sample}\n" + SEQUENCE)
+            (self.json_dir / f"{sample}.json").write_text("{}")
+        (self.json_dir / "notes.txt").write_text("")
+        manifest = Path(self.tmpdir.name) / "rename_manifest.tsv"
+
+        renamed = rename_input_dir(self.input_dir, "/zone/collections/run1", threads=4, manifest=manifest)
+
+        self.assertEqual(len(renamed), 6)
+        self.assertEqual(
+            sorted(path.name for path in self.fasta_dir.iterdir()),
+            ["s1_run1.fasta", "s2_run1.fasta", "s3_run1.fasta"],
+        )
+        self.assertEqual((self.fasta_dir / "s2_run1.fasta").read_text(), ">s2_run1\n" + SEQUENCE)
+        self.assertTrue((self.json_dir / "notes.txt").exists())
+        df_manifest = pd.read_csv(manifest, sep="\t")
+        self.assertEqual(df_manifest.columns.tolist(), ["type", "old_path", "new_path"])
+        self.assertEqual(df_manifest["type"].tolist(), ["fasta"] * 3 + ["json"] * 3)
+        self.assertTrue(all(Path(path).exists() for path in df_manifest["new_path"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import tempfile
+from argparse import Namespace
+from pathlib import Path
+
+from fake_irods import FakeSession
+from resolve_provenance import read_cache, resolve_provenance, write_cache
+
+
+def make_avus():
+    return [
+        ("/zone/runsheet2", "projectID", "myco"),
+        ("/zone/runsheet2", "finish_time", "300"),
+        ("/zone/clustering1", "projectID", "myco"),
+        ("/zone/clustering1", "finish_time", "100"),
+        ("/zone/clustering1", "sys::dataset_id", "42"),
+        ("/zone/clustering1", "sys::data::state", "valid"),
+        ("/zone/clustering2", "projectID", "salm"),
+        ("/zone/clustering2", "finish_time", "200"),
+        ("/zone/clustering2", "sys::data::state", "valid"),
+    ]
+
+
+class TestResolveProvenance(unittest.TestCase):
+    def setUp(self):
+        self.args = Namespace(
+            input_collection="/zone/runsheet2",
+            match_attr=["projectID"],
+            run_number_attr="finish_time",
+            extra_metadata=["sys::data::state=valid"],
+            extra_metadata_not=["projectID=salm"],
+        )
+
+    def test_previous_run_and_curated_collection(self):
+        avus = make_avus() + [
+            ("/zone/curation1", "user::pipeline::input_collection_id", "42")
+        ]
+        provenance = resolve_provenance(FakeSession(avus), self.args, {})
+        self.assertEqual(
+            provenance,
+            {
+                "previous_run": "/zone/clustering1",
+                "curated_collection": "/zone/curation1",
+                "earlier_run": None,
+            },
+        )
+
+    def test_no_previous_run(self):
+        session = FakeSession(make_avus()[:2])
+        provenance = resolve_provenance(session, self.args, {})
+        self.assertEqual(
+            provenance, {"previous_run": None, "curated_collection": None, "earlier_run": None}
+        )
+
+    def test_rerun_uses_cache_and_finds_new_curation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = Path(tmp) / "cache.json"
+            cache = read_cache(cache_path)
+            resolve_provenance(FakeSession(make_avus()), self.args, cache)
+            write_cache(cache_path, cache)
+
+            # curated files were added before the rerun
+            session = FakeSession(
+                make_avus()
+                + [("/zone/curation1", "user::pipeline::input_collection_id", "42")]
+            )
+            provenance = resolve_provenance(session, self.args, read_cache(cache_path))
+        self.assertEqual(provenance["previous_run"], "/zone/clustering1")
+        self.assertEqual(provenance["curated_collection"], "/zone/curation1")
+        # only the lookup of curated files: dataset id and downstream collection
+        self.assertEqual(session.round_trips, 2)
+
+    def test_earlier_run_of_same_runsheet(self):
+        avus = make_avus() + [
+            ("/zone/clustering3", "projectID", "myco"),
+            ("/zone/clustering3", "finish_time", "400"),
+            ("/zone/clustering3", "sys::data::state", "valid"),
+            ("/zone/clustering3", "sys::runsheet::input_collection", "/zone/runsheet2"),
+        ]
+        self.args.extra_metadata_not.append("sys::runsheet::input_collection=/zone/runsheet2")
+        self.args.rerun_attr = "sys::runsheet::input_collection"
+        self.args.rerun_not = ["user::data::state=invalid"]
+        provenance = resolve_provenance(FakeSession(avus), self.args, {})
+        self.assertEqual(provenance["previous_run"], "/zone/clustering1")
+        self.assertEqual(provenance["earlier_run"], "/zone/clustering3")
+
+    def test_missing_run_number_attr(self):
+        session = FakeSession(make_avus()[:1])
+        with self.assertRaises(ValueError):
+            resolve_provenance(session, self.args, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import yaml
+
+from resource_model import ResourceModel, calibrate, run_features
+
+
+def write_run(run_dir, n_samples, max_rss_mb, cpu_time, wall_time):
+    benchmark_dir = run_dir / "benchmark"
+    benchmark_dir.mkdir(parents=True)
+    with open(benchmark_dir / "run_features.yaml", "w") as f:
+        yaml.safe_dump(
+            {
+                "n_samples": float(n_samples),
+                "n_new_samples": 10.0,
+                "input_mb": 1.0,
+                "previous_mb": 0.0,
+            },
+            f,
+        )
+    pd.DataFrame(
+        {
+            "s": [wall_time],
+            "h:m:s": ["0:00:00"],
+            "max_rss": [max_rss_mb],
+            "cpu_time": [cpu_time],
+        }
+    ).to_csv(benchmark_dir / "clustering_from_previous.tsv", sep="\t", index=False)
+
+
+class TestResourceModel(unittest.TestCase):
+    def test_no_model_uses_fixed_resources(self):
+        model = ResourceModel()
+        self.assertEqual(model.mem_gb("clustering", {"n_samples": 10}, 64), 64)
+        self.assertEqual(model.threads("clustering", {"n_samples": 10}, 4), 4)
+
+    def test_no_features_uses_fixed_resources(self):
+        model = ResourceModel({"clustering": {"mem_gb": {"intercept": 1.0}}})
+        self.assertEqual(model.mem_gb("clustering", None, 64), 64)
+
+    def test_run_features_count_new_samples(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            previous = tmp / "previous"
+            previous.mkdir()
+            (previous / "clusters.csv").write_text(
+                "sample,inferred_cluster,curated_cluster,final_cluster\na,A001,,A001\nb,A001,,A001\n"
+            )
+            (previous / "aln.fa.gz").write_bytes(b"x" * 1024**2)
+            inputs = {}
+            for sample in ["b", "c"]:
+                inputs[sample] = tmp / f"{sample}.fasta"
+                inputs[sample].write_bytes(b"x" * 1024**2)
+            features = run_features(inputs, str(previous), "aln.fa.gz")
+        self.assertEqual(
+            features,
+            {"n_samples": 3.0, "n_new_samples": 1.0, "input_mb": 1.0, "previous_mb": 1.0},
+        )
+
+    def test_estimates_are_bounded(self):
+        model = ResourceModel(
+            {
+                "clustering": {
+                    "mem_gb": {"intercept": 1.0, "n_samples": 0.01},
+                    "threads": {"intercept": 0.5, "n_samples": 0.001},
+                }
+            },
+            mem_headroom=1.0,
+        )
+        self.assertEqual(model.mem_gb("clustering", {"n_samples": 100}, 64), 2)
+        self.assertEqual(model.mem_gb("clustering", {"n_samples": 10**6}, 64), 64)
+        self.assertEqual(model.mem_gb("clustering", {"n_samples": 100}, 64, attempt=2), 64)
+        self.assertEqual(model.threads("clustering", {"n_samples": 0}, 4), 1)
+        self.assertEqual(model.threads("clustering", {"n_samples": 10**6}, 4), 4)
+
+    def test_calibrate_covers_observed_runs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            runs = []
+            for i, (n_samples, max_rss_mb) in enumerate(
+                [(1000, 2048), (2000, 5120), (3000, 6144), (4000, 8192)]
+            ):
+                runs.append(Path(tmp) / f"run{i}")
+                write_run(runs[-1], n_samples, max_rss_mb, cpu_time=20, wall_time=10)
+            model = calibrate(runs, ResourceModel(mem_headroom=1.0))
+        self.assertEqual(model.rules["clustering_from_previous"]["n_runs"], 4)
+        for n_samples, max_rss_mb in [(1000, 2), (2000, 5), (3000, 6), (4000, 8)]:
+            self.assertGreaterEqual(
+                model.mem_gb("clustering_from_previous", {"n_samples": n_samples}, 64),
+                max_rss_mb,
+            )
+        self.assertEqual(model.threads("clustering_from_previous", {}, 16), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from sample_registry import SampleRegistry, samples_in_distances
+
+
+class TestSampleRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.prefix = Path(self.tmpdir.name) / "sample_registry"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_ids_are_appended(self):
+        registry = SampleRegistry()
+        self.assertEqual(registry.add(["b", "a", "b"]).tolist(), [0, 1, 0])
+        registry.save(self.prefix)
+
+        registry = SampleRegistry.load(self.prefix)
+        self.assertIsInstance(registry.names, np.memmap)
+        # longer names widen the stored names, ids stay the same
+        self.assertEqual(registry.add(["a", "a_much_longer_name"]).tolist(), [1, 2])
+        registry.save(self.prefix)
+
+        registry = SampleRegistry.load(self.prefix)
+        self.assertEqual(registry.ids(["a_much_longer_name", "b", "a_much", "c"]).tolist(), [2, 0, -1, -1])
+        self.assertEqual(registry.names_of([2, 0]).tolist(), ["a_much_longer_name", "b"])
+        self.assertIn("a", registry)
+        self.assertNotIn("c", registry)
+
+    def test_missing_registry_is_empty(self):
+        registry = SampleRegistry.load(self.prefix)
+        self.assertEqual(len(registry), 0)
+        self.assertEqual(registry.ids(["a"]).tolist(), [-1])
+
+    def test_samples_in_distances(self):
+        distances = Path(self.tmpdir.name) / "distances.tsv"
+        distances.write_text("b_contig1\tb_contig1\t0\nb_contig1\ta\t3\na\ta\t0\na\tc\t5\n")
+        self.assertEqual(samples_in_distances(distances, chunksize=2), ["b", "a", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import tempfile
+import random
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pandas as pd
+
+import cluster
+from spanning_tree import SpanningForest, minimum_spanning_forest
+
+NS = {"g": "http://graphml.graphdrawing.org/xmlns"}
+
+
+class TestMinimumSpanningForest(unittest.TestCase):
+    def test_forest(self):
+        df_edges = pd.DataFrame(
+            [
+                ["a", "b", 3],
+                ["b", "a", 3],
+                ["b", "c", 1],
+                ["a", "c", 2],
+                ["c", "c", 0],
+                ["d", "e", 5],
+            ],
+            columns=["sample1", "sample2", "distance"],
+        )
+        df_forest = minimum_spanning_forest(df_edges)
+        self.assertEqual(
+            df_forest.values.tolist(), [["b", "c", 1], ["a", "c", 2], ["d", "e", 5]]
+        )
+
+    def test_chunks_give_same_forest(self):
+        rng = random.Random(2)
+        samples = [f"s{i:03}" for i in range(300)]
+        df = pd.DataFrame(
+            [[rng.choice(samples), rng.choice(samples), rng.randint(0, 12)] for _ in range(5000)],
+            columns=["sample1", "sample2", "distance"],
+        )
+        whole = SpanningForest(10, margin=2)
+        whole.update(df)
+        chunked = SpanningForest(10, margin=2)
+        for start in range(0, len(df), 700):
+            chunked.update(df.iloc[start : start + 700])
+        pd.testing.assert_frame_equal(chunked.edges(), whole.edges())
+        df_tree = whole.edges().query("not near_threshold")
+        self.assertEqual(
+            df_tree["distance"].sum(),
+            minimum_spanning_forest(df[df["distance"] <= 10])["distance"].sum(),
+        )
+
+
+class TestClusterSpanningTree(unittest.TestCase):
+    def test_graphml(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            rng = random.Random(3)
+            samples = [f"s{i:02}" for i in range(50)]
+            distances = {}
+            rows = []
+            for s1 in samples:
+                for s2 in samples:
+                    if (s2, s1) not in distances:
+                        distances[(s1, s2)] = 0 if s1 == s2 else rng.randint(0, 200)
+                    rows.append([s1 + "_contig1", s2, distances.get((s1, s2), distances.get((s2, s1)))])
+            pd.DataFrame(rows).to_csv(tmp / "distances.tsv", sep="\t", header=False, index=False)
+            outputs = []
+            for memory_limit in [None, 1e-6]:
+                argv = [
+                    "--distances", str(tmp / "distances.tsv"),
+                    "--threshold", "10",
+                    "--warnings-path", str(tmp / "WARNINGS.txt"),
+                    "--output", str(tmp / "clusters.csv"),
+                    "--spill-dir", str(tmp),
+                    "--spanning-tree", str(tmp / f"spanning_tree_{memory_limit}.graphml"),
+                    "--spanning-tree-margin", "5",
+                ]
+                if memory_limit is not None:
+                    argv += ["--memory-limit", str(memory_limit)]
+                args = cluster.parse_args(argv)
+                cluster.main(args)
+                outputs.append(args.spanning_tree.read_text())
+            self.assertEqual(outputs[0], outputs[1])
+
+            df_clusters = pd.read_csv(tmp / "clusters.csv")
+            graph = ET.parse(tmp / "spanning_tree_None.graphml").getroot().find("g:graph", NS)
+            nodes = graph.findall("g:node", NS)
+            self.assertEqual(len(nodes), len(df_clusters))
+            self.assertEqual(
+                {data.get("key") for data in nodes[0].findall("g:data", NS)},
+                {"inferred_cluster", "final_cluster"},
+            )
+            edges = graph.findall("g:edge", NS)
+            near = [edge for edge in edges if edge.find("g:data[@key='near_threshold']", NS).text == "true"]
+            self.assertEqual(
+                len(edges) - len(near), len(df_clusters) - df_clusters["inferred_cluster"].nunique()
+            )
+            inferred = df_clusters.set_index("sample")["inferred_cluster"]
+            for edge in near:
+                self.assertNotEqual(inferred[edge.get("source")], inferred[edge.get("target")])
+
+
+if __name__ == "__main__":
+    unittest.main()
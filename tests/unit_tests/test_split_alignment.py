@@ -0,0 +1,63 @@
+import unittest
+import io
+import tempfile
+from pathlib import Path
+
+import split_alignment
+
+
+def alignment(names):
+    return "".join(f">{name} desc\nAC\nGT\n" for name in names)
+
+
+class TestSplitAlignment(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tmp = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_chunks_from_scratch(self):
+        names = [f"s{i}" for i in range(5)]
+        chunks = split_alignment.split_alignment(io.StringIO(alignment(names)), self.tmp, 2)
+
+        self.assertEqual(chunks, [("0000", 2, True), ("0001", 2, True), ("0002", 1, True)])
+        self.assertEqual(split_alignment.read_chunks(self.tmp), chunks)
+        self.assertEqual(
+            (self.tmp / "chunk_0002.fa").read_text(), alignment(["s4"])
+        )
+
+    def test_new_sequences_start_a_chunk(self):
+        names = [f"s{i}" for i in range(6)]
+        chunks = split_alignment.split_alignment(
+            io.StringIO(alignment(names)), self.tmp, 2, names[:3]
+        )
+
+        self.assertEqual(
+            chunks,
+            [("0000", 2, False), ("0001", 1, False), ("0002", 2, True), ("0003", 1, True)],
+        )
+        self.assertEqual((self.tmp / "chunk_0001.fa").read_text(), alignment(["s2"]))
+        self.assertEqual((self.tmp / "chunk_0002.fa").read_text(), alignment(["s3", "s4"]))
+
+    def test_previous_sequences_come_first(self):
+        with self.assertRaises(ValueError):
+            split_alignment.split_alignment(
+                io.StringIO(alignment(["s1", "s0"])), self.tmp, 2, ["s0"]
+            )
+
+    def test_previous_distances_within_chunks(self):
+        names = [f"s{i}" for i in range(5)]
+        split_alignment.split_alignment(io.StringIO(alignment(names)), self.tmp, 2, names[:3])
+        distances = "".join(
+            f"{a}\t{b}\t{int(a != b)}\n" for a in names[:3] for b in names[:3]
+        )
+        split_alignment.split_previous_distances(io.StringIO(distances), self.tmp, names[:3], 2)
+
+        self.assertEqual(
+            (self.tmp / "chunk_0000.tsv").read_text(),
+            "s0\ts0\t0\ns0\ts1\t1\ns1\ts0\t1\ns1\ts1\t0\n",
+        )
+        self.assertEqual((self.tmp / "chunk_0001.tsv").read_text(), "s2\ts2\t0\n")
+        self.assertFalse((self.tmp / "chunk_0002.tsv").exists())
@@ -0,0 +1,158 @@
+import unittest
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import cluster
+from state_store import StateStore
+
+
+def make_clusters(rows):
+    return pd.DataFrame(
+        rows, columns=["sample", "inferred_cluster", "curated_cluster", "final_cluster"]
+    )
+
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "state.sqlite"
+        self.store = StateStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def count(self, table):
+        return self.store.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def test_runs_store_changed_assignments(self):
+        run1 = self.store.add_run(
+            make_clusters([["a", "A001", np.nan, "A001"], ["b", "A001", np.nan, "A001"]]), 10
+        )
+        run2 = self.store.add_run(
+            make_clusters([["a", "A001", np.nan, "A001"], ["c", "A002", "B001", "B001"]]), 10
+        )
+        # b is removed and c is added, a is unchanged
+        self.assertEqual(self.count("clusters"), 4)
+        self.assertEqual(self.store.clusters(run1)["sample"].tolist(), ["a", "b"])
+        df = self.store.clusters()
+        self.assertEqual(df["sample"].tolist(), ["a", "c"])
+        self.assertTrue(np.isnan(df.loc[0, "curated_cluster"]))
+        self.assertEqual(self.store.cluster_members("B001", run2), ["c"])
+        self.assertEqual(self.store.samples(), ["a", "b", "c"])
+
+    def test_distances_stored_once_per_pair(self):
+        self.store.add_distances(
+            pd.DataFrame({"sample1": ["a", "b", "a", "b"], "sample2": ["a", "a", "b", "c"], "distance": [0, 3, 3, 5]})
+        )
+        self.store.add_distances(pd.DataFrame({"sample1": ["c"], "sample2": ["b"], "distance": [4]}))
+        self.assertEqual(self.count("distances"), 2)
+        self.assertEqual(self.store.distances("b"), {"a": 3, "c": 4})
+
+    def test_exclusions_keep_first_date(self):
+        self.store.add_exclusions(
+            pd.DataFrame([["a", "low_coverage", "2024-01-01 00:00:00"]], columns=["sample", "reason", "date"])
+        )
+        self.store.add_exclusions(
+            pd.DataFrame([["a", "low_coverage", "2024-02-01 00:00:00"], ["b", "not_NLA", "2024-02-01 00:00:00"]],
+                         columns=["sample", "reason", "date"])
+        )
+        self.assertEqual(
+            self.store.exclusions().values.tolist(),
+            [["a", "low_coverage", "2024-01-01 00:00:00"], ["b", "not_NLA", "2024-02-01 00:00:00"]],
+        )
+
+    def test_failed_transaction_is_rolled_back(self):
+        with self.assertRaises(ValueError):
+            with self.store.transaction():
+                self.store.add_samples(["a"])
+                raise ValueError("failed")
+        self.assertEqual(self.store.samples(), [])
+        # a new connection sees the schema
+        with StateStore(self.path) as store:
+            self.assertIsNone(store.latest_run())
+
+
+class TestClusterWithStateStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        tmp = Path(self.tmpdir.name)
+        samples = ["a_contig1", "b", "c", "d"]
+        distances = {("a_contig1", "b"): 3, ("c", "d"): 30, ("b", "d"): 8}
+        rows = [
+            [s1, s2, 0 if s1 == s2 else distances.get((s1, s2), distances.get((s2, s1), 100))]
+            for s1 in samples
+            for s2 in samples
+        ]
+        pd.DataFrame(rows).to_csv(tmp / "distances.tsv", sep="\t", header=False, index=False)
+        self.options = {
+            "distances": tmp / "distances.tsv",
+            "threshold": 10,
+            "warnings_path": tmp / "WARNINGS.txt",
+            "state_db": tmp / "state.sqlite",
+            "run_name": "run1",
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def cluster(self, output, **kwargs):
+        options = {**self.options, **kwargs, "output": Path(self.tmpdir.name) / output}
+        args = cluster.parse_args(
+            [
+                arg
+                for option, value in options.items()
+                if value is not None
+                for arg in ["--" + option.replace("_", "-"), str(value)]
+            ]
+        )
+        cluster.main(args)
+        return args.output
+
+    def test_previous_clustering_from_store(self):
+        clusters1 = self.cluster("clusters1.csv")
+        with StateStore(self.options["state_db"]) as store:
+            store.add_exclusions(
+                pd.DataFrame([["c", "low_coverage", "2024-01-01 00:00:00"]], columns=["sample", "reason", "date"])
+            )
+        from_store = self.cluster("from_store.csv", run_name="run2", memory_limit=1e-6)
+        exclude_list = Path(self.tmpdir.name) / "list_excluded_samples.tsv"
+        exclude_list.write_text("sample\nc\n")
+        from_files = self.cluster(
+            "from_files.csv", state_db=None, previous_clustering=clusters1, exclude_list=exclude_list
+        )
+        self.assertEqual(from_store.read_text(), from_files.read_text())
+
+        with StateStore(self.options["state_db"]) as store:
+            self.assertEqual(store.latest_run(), 2)
+            self.assertEqual(store.distances("b"), {"a": 3, "d": 8})
+            pd.testing.assert_frame_equal(store.clusters(1), pd.read_csv(clusters1, dtype=str), check_dtype=False)
+
+
+    def test_store_not_locked_while_clustering(self):
+        create_output = cluster.create_output
+        output_path = Path(self.tmpdir.name) / "clusters.csv"
+
+        def write_while_clustering(*args):
+            # fails with "database is locked" if the run holds a transaction
+            with StateStore(self.options["state_db"], timeout=0) as store:
+                store.add_samples(["other"])
+            self.assertFalse(output_path.exists())
+            return create_output(*args)
+
+        for memory_limit in [None, 1e-6]:
+            with mock.patch("cluster.create_output", side_effect=write_while_clustering):
+                output = self.cluster("clusters.csv", memory_limit=memory_limit)
+            self.assertTrue(output.exists())
+            output.unlink()
+        with StateStore(self.options["state_db"]) as store:
+            self.assertEqual(store.latest_run(), 2)
+            self.assertEqual(store.distances("b"), {"a": 3, "d": 8})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,8 @@ if config["clustering_preset"] == "mycobacterium_tuberculosis":
     rule copy_or_touch_list_excluded_samples:
         output:
             temp(OUT + "/previous_list_excluded_samples.tsv"),
+        benchmark:
+            OUT + "/benchmark/copy_or_touch_list_excluded_samples.tsv",
         params:
             previous_list=PREVIOUS_CLUSTERING + "/list_excluded_samples.tsv",
         shell:
@@ -17,18 +19,20 @@ fi
 
     rule list_excluded_samples:
         input:
-            seq_exp_json=expand(
-                INPUT + "/mtb_typing/seq_exp_json/{sample}.json", sample=SAMPLES
-            ),
+            seq_exp_json=OUT + "/manifests/seq_exp_json.txt",
             exclude_list=OUT + "/previous_list_excluded_samples.tsv",
         output:
-            OUT + "/list_excluded_samples.tsv",
+            exclude_list=OUT + "/list_excluded_samples.tsv",
+            ledger=OUT + "/list_excluded_samples.ledger.tsv.gz",
+            qc_cache=OUT + "/qc_metrics.tsv.gz",
+        benchmark:
+            OUT + "/benchmark/list_excluded_samples.tsv",
         log:
             OUT + "/log/list_excluded_samples.log",
         message:
             "Listing samples which should be excluded."
         resources:
-            mem_gb=config["mem_gb"]["compression"],
+            mem_gb=estimated_mem_gb("list_excluded_samples", "compression"),
         conda:
             "../envs/scripts.yaml"
         container:
@@ -37,17 +41,27 @@ fi
             coverage_threshold=config["coverage_threshold"],
             inclusion_pattern=config["inclusion_pattern"],
             contamination_threshold=config["contamination_threshold"],
-        threads: config["threads"]["compression"]
+            previous_ledger=PREVIOUS_CLUSTERING + "/list_excluded_samples.ledger.tsv.gz",
+            previous_qc_cache=PREVIOUS_CLUSTERING + "/qc_metrics.tsv.gz",
+            state_db=STATE_DB_ARG,
+        threads: estimated_threads("list_excluded_samples", "compression")
         shell:
             """
 # columns: sample, reason, date
+# the ledger holds each sample and reason once, with the date it was first excluded
 python workflow/scripts/list_excluded_samples.py \
---input {input.seq_exp_json} \
+--input-manifest {input.seq_exp_json} \
 --previous-exclude-list {input.exclude_list} \
---output {output} \
+--previous-ledger {params.previous_ledger} \
+--output {output.exclude_list} \
+--ledger-output {output.ledger} \
+--previous-qc-cache {params.previous_qc_cache} \
+--qc-cache-output {output.qc_cache} \
+--threads {threads} \
 --inclusion-pattern {params.inclusion_pattern} \
 --coverage-threshold {params.coverage_threshold} \
 --contamination-threshold {params.contamination_threshold} \
+{params.state_db} \
 2>&1> {log}
             """
 
@@ -56,12 +70,18 @@ else:
     rule touch_list_excluded_samples:
         output:
             temp(OUT + "/list_excluded_samples.tsv"),
+        benchmark:
+            OUT + "/benchmark/touch_list_excluded_samples.tsv",
         shell:
             """
 touch {output}
             """
 
 
+# cluster.py reads the distances in chunks within the memory of the job (--memory-limit),
+# so the output does not depend on it but the memory of the job can follow the resource model
+# it registers the samples of the distances while reading them: the registry gives each sample
+# an integer id which stays the same in later runs and starts from that of the previous run
 # PREVIOUS_CLUSTERING is read into config as a str
 if PREVIOUS_CLUSTERING == "None":
 
@@ -70,13 +90,20 @@ if PREVIOUS_CLUSTERING == "None":
             distances=OUT + "/distances.tsv",
             exclude_list=OUT + "/list_excluded_samples.tsv",
         output:
-            OUT + "/clusters.csv",
+            clusters=OUT + "/clusters.csv",
+            neighbours=OUT + "/neighbours.tsv",
+            distance_histogram=OUT + "/distance_histogram.tsv",
+            spanning_tree=OUT + "/spanning_tree.graphml",
+            sample_registry=OUT + "/sample_registry.npy",
+            sample_registry_index=OUT + "/sample_registry_index.npy",
+        benchmark:
+            OUT + "/benchmark/clustering_from_scratch.tsv",
         log:
             OUT + "/log/clustering.log",
         message:
             "Clustering {input.distances} with threshold {params.threshold}"
         resources:
-            mem_gb=config["mem_gb"]["clustering"],
+            mem_gb=estimated_mem_gb("clustering_from_scratch", "clustering"),
         conda:
             "../envs/clustering.yaml"
         container:
@@ -84,18 +111,29 @@ if PREVIOUS_CLUSTERING == "None":
         params:
             threshold=config["cluster_threshold"],
             merged_cluster_separator=config["merged_cluster_separator"],
-        threads: config["threads"]["clustering"]
+            max_distance=config["max_distance"],
+            sample_registry=OUT + "/sample_registry",
+            state_db=STATE_DB_ARG,
+            run_name=Path(OUT).name,
+        threads: estimated_threads("clustering_from_scratch", "clustering")
         shell:
             """
 python workflow/scripts/cluster.py \
 --threshold {params.threshold} \
 --distances {input.distances} \
---output {output} \
+--output {output.clusters} \
 --log {log} \
 --verbose \
 --merged-cluster-separator {params.merged_cluster_separator:q} \
---output {output} \
---exclude {input.exclude_list}
+--output {output.clusters} \
+--exclude {input.exclude_list} \
+--memory-limit {resources.mem_gb} \
+--neighbours {output.neighbours} \
+--distance-histogram {output.distance_histogram} \
+--max-distance {params.max_distance} \
+--spanning-tree {output.spanning_tree} \
+--sample-registry {params.sample_registry} \
+--run-name {params.run_name:q} {params.state_db}
             """
 
 else:
@@ -106,13 +144,20 @@ else:
             previous_clustering=PREVIOUS_CLUSTERING + "/clusters.csv",
             exclude_list=OUT + "/list_excluded_samples.tsv",
         output:
-            OUT + "/clusters.csv",
+            clusters=OUT + "/clusters.csv",
+            neighbours=OUT + "/neighbours.tsv",
+            distance_histogram=OUT + "/distance_histogram.tsv",
+            spanning_tree=OUT + "/spanning_tree.graphml",
+            sample_registry=OUT + "/sample_registry.npy",
+            sample_registry_index=OUT + "/sample_registry_index.npy",
+        benchmark:
+            OUT + "/benchmark/clustering_from_previous.tsv",
         log:
             OUT + "/log/clustering.log",
         message:
             "Clustering {input.distances} with threshold {params.threshold}"
         resources:
-            mem_gb=config["mem_gb"]["clustering"],
+            mem_gb=estimated_mem_gb("clustering_from_previous", "clustering"),
         conda:
             "../envs/clustering.yaml"
         container:
@@ -120,17 +165,30 @@ else:
         params:
             threshold=config["cluster_threshold"],
             merged_cluster_separator=config["merged_cluster_separator"],
-        threads: config["threads"]["clustering"]
+            max_distance=config["max_distance"],
+            sample_registry=OUT + "/sample_registry",
+            previous_sample_registry=PREVIOUS_CLUSTERING + "/sample_registry",
+            state_db=STATE_DB_ARG,
+            run_name=Path(OUT).name,
+        threads: estimated_threads("clustering_from_previous", "clustering")
         shell:
             """
 python workflow/scripts/cluster.py \
 --threshold {params.threshold} \
 --distances {input.distances} \
 --previous-clustering {input.previous_clustering} \
---output {output} \
+--output {output.clusters} \
 --log {log} \
 --verbose \
 --merged-cluster-separator {params.merged_cluster_separator:q} \
 --exclude {input.exclude_list} \
---output {output}
+--output {output.clusters} \
+--memory-limit {resources.mem_gb} \
+--neighbours {output.neighbours} \
+--distance-histogram {output.distance_histogram} \
+--max-distance {params.max_distance} \
+--spanning-tree {output.spanning_tree} \
+--sample-registry {params.sample_registry} \
+--previous-sample-registry {params.previous_sample_registry} \
+--run-name {params.run_name:q} {params.state_db}
             """
\ No newline at end of file
@@ -0,0 +1,65 @@
+# PREVIOUS_CLUSTERING is read into config as a str
+if PREVIOUS_CLUSTERING == "None":
+
+    rule combine_cgmlst_profiles_from_scratch:
+        input:
+            OUT + "/manifests/cgmlst_profiles.txt",
+        output:
+            alleles=OUT + "/cgmlst_alleles.tsv.gz",
+            codebook=OUT + "/cgmlst_allele_codes.tsv.gz",
+        benchmark:
+            OUT + "/benchmark/combine_cgmlst_profiles_from_scratch.tsv",
+        log:
+            OUT + "/log/combine_cgmlst_profiles.log",
+        message:
+            "Combining cgMLST profiles from scratch."
+        resources:
+            mem_gb=estimated_mem_gb(
+                "combine_cgmlst_profiles_from_scratch",
+                "compression",
+            ),
+        conda:
+            "../envs/scripts.yaml"
+        container:
+            "docker://ghcr.io/boasvdp/juno_clustering_scripts:0.2"
+        threads: 1
+        shell:
+            """
+python workflow/scripts/combine_cgmlst_profiles.py \
+--output {output.alleles} \
+--output-codebook {output.codebook} \
+--new-input-manifest {input} 2>&1> {log}
+            """
+
+else:
+
+    rule add_cgmlst_profiles:
+        input:
+            new_profiles=OUT + "/manifests/cgmlst_profiles.txt",
+            previous_alleles=PREVIOUS_CLUSTERING + "/cgmlst_alleles.tsv.gz",
+            previous_codebook=PREVIOUS_CLUSTERING + "/cgmlst_allele_codes.tsv.gz",
+        output:
+            alleles=OUT + "/cgmlst_alleles.tsv.gz",
+            codebook=OUT + "/cgmlst_allele_codes.tsv.gz",
+        benchmark:
+            OUT + "/benchmark/add_cgmlst_profiles.tsv",
+        log:
+            OUT + "/log/add_cgmlst_profiles.log",
+        message:
+            "Adding cgMLST profiles to {input.previous_alleles}."
+        resources:
+            mem_gb=estimated_mem_gb("add_cgmlst_profiles", "compression"),
+        conda:
+            "../envs/scripts.yaml"
+        container:
+            "docker://ghcr.io/boasvdp/juno_clustering_scripts:0.2"
+        threads: 1
+        shell:
+            """
+python workflow/scripts/combine_cgmlst_profiles.py \
+--previous-alleles {input.previous_alleles} \
+--previous-codebook {input.previous_codebook} \
+--output {output.alleles} \
+--output-codebook {output.codebook} \
+--new-input-manifest {input.new_profiles} 2>&1> {log}
+            """
@@ -1,121 +1,279 @@
-# Naive all vs all distance calculation
-# Improvement: check which distances have been calculated and only calculate the missing ones
-if PREVIOUS_CLUSTERING == "None":
-    if config["clustering_type"] == "alignment":
-        rule distance_calculation_snp:
-            input:
-                OUT + "/aln.fa",
-            output:
-                OUT + "/distances.tsv",
-            conda:
-                "../envs/distance_calculation.yaml"
-            container:
-                "docker://quay.io/biocontainers/distle:0.3.0--hc1c3326_0"
-            params:
-                max_distance=config["max_distance"],
-                output_mode="full",
-            resources:
-                mem_gb=config["mem_gb"]["distance_calculation"],
-            log:
-                OUT + "/log/distance_calculation_snp.log",
-            threads: config["threads"]["distance_calculation"]
-            shell:
-                """
-        # TODO: check if the distances have already been calculated and only calculate the missing ones, this could be added to distle
+# SNP distances are calculated in tiles of the pairwise distance matrix (scatter-gather)
+# The alignment is split into chunks of distance_tile_size samples and every pair of chunks
+# is a separate job, so the distance calculation can be spread over cluster nodes
+# New samples are appended to the previous alignment and start a new chunk, so only tiles
+# with a chunk of new samples are calculated and the previous distances are copied once
+if config["clustering_type"] == "alignment":
+    from distance_tiles import gather_tiles, list_tiles
+    from split_alignment import chunk_distances_path, read_chunks
+
+    # the previous distances within each chunk of previous samples are written next to the chunks
+    checkpoint split_alignment:
+        input:
+            aln=OUT + "/aln.fa",
+            previous_names=[]
+            if PREVIOUS_CLUSTERING == "None"
+            else OUT + "/aln_previous_names.txt",
+            previous_distances=[]
+            if PREVIOUS_CLUSTERING == "None"
+            else PREVIOUS_CLUSTERING + "/distances.tsv",
+        output:
+            temp(directory(OUT + "/distance_tiles/chunks")),
+        benchmark:
+            OUT + "/benchmark/split_alignment.tsv",
+        log:
+            OUT + "/log/split_alignment.log",
+        message:
+            "Splitting {input.aln} in chunks of {params.tile_size} samples."
+        resources:
+            mem_gb=estimated_mem_gb("split_alignment", "distance_tile"),
+        conda:
+            "../envs/scripts.yaml"
+        container:
+            "docker://ghcr.io/boasvdp/juno_clustering_scripts:0.2"
+        params:
+            tile_size=config["distance_tile_size"],
+            previous_names=""
+            if PREVIOUS_CLUSTERING == "None"
+            else "--previous-names " + OUT + "/aln_previous_names.txt",
+            previous_distances=""
+            if PREVIOUS_CLUSTERING == "None"
+            else "--previous-distances " + PREVIOUS_CLUSTERING + "/distances.tsv",
+        threads: 1
+        shell:
+            """
+python workflow/scripts/split_alignment.py \
+--input {input.aln} \
+--output-dir {output} \
+{params.previous_names} \
+{params.previous_distances} \
+--tile-size {params.tile_size} 2> {log}
+            """
+
+    def list_distance_tiles(wildcards):
+        chunks_dir = checkpoints.split_alignment.get(**wildcards).output[0]
+        return [
+            OUT + f"/distance_tiles/tile_{chunk_a}.tsv"
+            if chunk_a == chunk_b
+            else OUT + f"/distance_tiles/tile_{chunk_a}_{chunk_b}.tsv"
+            for chunk_a, chunk_b in list_tiles(read_chunks(Path(chunks_dir)))
+        ]
+
+    def chunk_is_new(chunk):
+        chunks_dir = checkpoints.split_alignment.get().output[0]
+        return any(
+            name == chunk and is_new for name, _, is_new in read_chunks(Path(chunks_dir))
+        )
+
+    def leading_tile(wildcards):
+        if chunk_is_new(wildcards.chunk_a):
+            return OUT + f"/distance_tiles/tile_{wildcards.chunk_a}.tsv"
+        return []
+
+    def leading_distances(wildcards):
+        """
+        Distances within chunk A: its diagonal tile, or the previous distances
+        split_alignment wrote next to the chunks if chunk A holds previous samples
+        """
+        chunks_dir = checkpoints.split_alignment.get().output[0]
+        return leading_tile(wildcards) or str(
+            chunk_distances_path(Path(chunks_dir), wildcards.chunk_a)
+        )
+
+    # distances within a chunk, including the distance of each sample to itself
+    rule distance_calculation_snp_tile_diagonal:
+        input:
+            OUT + "/distance_tiles/chunks",
+        output:
+            temp(OUT + "/distance_tiles/tile_{chunk}.tsv"),
+        wildcard_constraints:
+            chunk="[0-9]+",
+        benchmark:
+            OUT + "/benchmark/distance_calculation_snp_tile_diagonal/{chunk}.tsv",
+        conda:
+            "../envs/distance_calculation.yaml"
+        container:
+            "docker://quay.io/biocontainers/distle:0.3.0--hc1c3326_0"
+        params:
+            max_distance=config["max_distance"],
+            output_mode="full",
+        resources:
+            mem_gb=config["mem_gb"]["distance_tile"],
+        log:
+            OUT + "/log/distance_calculation_snp/tile_{chunk}.log",
+        threads: config["threads"]["distance_tile"]
+        shell:
+            """
         distle \
         --verbose \
         --input-format fasta \
         --output-mode {params.output_mode} \
         --maxdist {params.max_distance} \
-        {input} {output} 2>&1 > {log}
-                """
+        {input}/chunk_{wildcards.chunk}.fa {output} 2>&1 > {log}
+            """
 
-    if config["clustering_type"] == "mlst":
-        rule distance_calculation_cgmlst:
-            input:
-                OUT + "/cgmlst_profiles.tsv",
-            output:
-                OUT + "/distances.tsv",
-            conda:
-                "../envs/distance_calculation.yaml"
-            container:
-                "docker://quay.io/biocontainers/distle:0.3.0--hc1c3326_0"
-            params:
-                max_distance=config["max_distance"],
-                output_mode="full",
-            resources:
-                mem_gb=config["mem_gb"]["distance_calculation"],
-            log:
-                OUT + "/log/distance_calculation_cgmlst.log",
-            threads: config["threads"]["distance_calculation"]
-            shell:
-                """
+    # distances across chunk A and (new) chunk B
+    # distle reads chunk A followed by chunk B, with the distances within chunk A as precomputed
+    # distances of the leading samples (as for a previous alignment), so the pairs within
+    # chunk A are not calculated again; the pairs within chunk B are calculated and dropped.
+    # That is |B|^2 / 2 extra pairs per tile: few when adding a handful of new samples to
+    # a large previous clustering, and at most distance_tile_size^2 / 2 from scratch
+    rule distance_calculation_snp_tile:
+        input:
+            chunks=OUT + "/distance_tiles/chunks",
+            tile_a=leading_tile,
+        output:
+            temp(OUT + "/distance_tiles/tile_{chunk_a}_{chunk_b}.all.tsv"),
+        wildcard_constraints:
+            chunk_a="[0-9]+",
+            chunk_b="[0-9]+",
+        benchmark:
+            OUT + "/benchmark/distance_calculation_snp_tile/{chunk_a}_{chunk_b}.tsv",
+        conda:
+            "../envs/distance_calculation.yaml"
+        container:
+            "docker://quay.io/biocontainers/distle:0.3.0--hc1c3326_0"
+        params:
+            max_distance=config["max_distance"],
+            output_mode="full",
+            precomputed_distances=leading_distances,
+            tile_fasta=OUT + "/distance_tiles/tile_{chunk_a}_{chunk_b}.fa",
+        resources:
+            mem_gb=config["mem_gb"]["distance_tile"],
+        log:
+            OUT + "/log/distance_calculation_snp/tile_{chunk_a}_{chunk_b}.log",
+        threads: config["threads"]["distance_tile"]
+        shell:
+            """
+        cat {input.chunks}/chunk_{wildcards.chunk_a}.fa {input.chunks}/chunk_{wildcards.chunk_b}.fa > {params.tile_fasta}
         distle \
         --verbose \
-        --input-format cgmlst \
+        --input-format fasta \
         --output-mode {params.output_mode} \
         --maxdist {params.max_distance} \
-        {input} {output} 2>&1 > {log}
-                """
+        --precomputed-distances {params.precomputed_distances} \
+        {params.tile_fasta} {output} 2>&1 > {log}
+        rm {params.tile_fasta}
+            """
 
-else:
-    if config["clustering_type"] == "alignment":
-        rule distance_calculation_from_previous_snp:
+    # keep the pairs across chunk A and chunk B of an off-diagonal tile
+    rule select_distance_tile_pairs:
+        input:
+            chunks=OUT + "/distance_tiles/chunks",
+            distances=OUT + "/distance_tiles/tile_{chunk_a}_{chunk_b}.all.tsv",
+        output:
+            temp(OUT + "/distance_tiles/tile_{chunk_a}_{chunk_b}.tsv"),
+        wildcard_constraints:
+            chunk_a="[0-9]+",
+            chunk_b="[0-9]+",
+        benchmark:
+            OUT + "/benchmark/select_distance_tile_pairs/{chunk_a}_{chunk_b}.tsv",
+        conda:
+            "../envs/scripts.yaml"
+        container:
+            "docker://ghcr.io/boasvdp/juno_clustering_scripts:0.2"
+        resources:
+            mem_gb=estimated_mem_gb("select_distance_tile_pairs", "distance_tile"),
+        log:
+            OUT + "/log/select_distance_tile_pairs/tile_{chunk_a}_{chunk_b}.log",
+        threads: 1
+        shell:
+            """
+python workflow/scripts/distance_tiles.py \
+--input {input.distances} \
+--chunk {input.chunks}/chunk_{wildcards.chunk_b}.fa \
+--output {output} 2> {log}
+            """
+
+    rule gather_distance_tiles:
+        input:
+            # the tiles are listed from the chunks, keep them until the tiles are gathered
+            chunks=OUT + "/distance_tiles/chunks",
+            tiles=list_distance_tiles,
+            previous_distances=[]
+            if PREVIOUS_CLUSTERING == "None"
+            else PREVIOUS_CLUSTERING + "/distances.tsv",
+        output:
+            OUT + "/distances.tsv",
+        benchmark:
+            OUT + "/benchmark/gather_distance_tiles.tsv",
+        message:
+            "Gathering distance tiles in {output}."
+        run:
+            gather_tiles(
+                Path(output[0]),
+                [Path(tile) for tile in input.tiles],
+                Path(input.previous_distances) if input.previous_distances else None,
+            )
+
+
+if PREVIOUS_CLUSTERING == "None":
+    if config["clustering_type"] == "mlst":
+        rule distance_calculation_cgmlst:
             input:
-                OUT + "/aln.fa",
+                OUT + "/cgmlst_alleles.tsv.gz",
             output:
                 OUT + "/distances.tsv",
             conda:
-                "../envs/distance_calculation.yaml"
+                "../envs/scripts.yaml"
             container:
-                "docker://quay.io/biocontainers/distle:0.3.0--hc1c3326_0"
+                "docker://ghcr.io/boasvdp/juno_clustering_scripts:0.2"
             params:
                 max_distance=config["max_distance"],
-                output_mode="full",
-                previous_distances=PREVIOUS_CLUSTERING + "/distances.tsv",
+                missing_data=config["cgmlst_missing_data"],
             resources:
-                mem_gb=config["mem_gb"]["distance_calculation"],
+                mem_gb=estimated_mem_gb(
+                    "distance_calculation_cgmlst",
+                    "distance_calculation",
+                ),
+            benchmark:
+                OUT + "/benchmark/distance_calculation_cgmlst.tsv",
             log:
-                OUT + "/log/distance_calculation_snp.log",
-            threads: config["threads"]["distance_calculation"]
+                OUT + "/log/distance_calculation_cgmlst.log",
+            threads: estimated_threads("distance_calculation_cgmlst", "distance_calculation")
             shell:
                 """
-        # TODO: check if the distances have already been calculated and only calculate the missing ones, this could be added to distle
-        distle \
+        python workflow/scripts/cgmlst_distances.py \
         --verbose \
-        --input-format fasta \
-        --output-mode {params.output_mode} \
-        --maxdist {params.max_distance} \
-        --precomputed-distances {params.previous_distances} \
-        {input} {output} 2>&1 > {log}
+        --input {input} \
+        --output {output} \
+        --max-distance {params.max_distance} \
+        --missing-data {params.missing_data} 2>&1 > {log}
                 """
 
+else:
     if config["clustering_type"] == "mlst":
         rule distance_calculation_from_previous_cgmlst:
             input:
-                OUT + "/cgmlst_profiles.tsv",
+                OUT + "/cgmlst_alleles.tsv.gz",
             output:
                 OUT + "/distances.tsv",
             conda:
-                "../envs/distance_calculation.yaml"
+                "../envs/scripts.yaml"
             container:
-                "docker://quay.io/biocontainers/distle:0.3.0--hc1c3326_0"
+                "docker://ghcr.io/boasvdp/juno_clustering_scripts:0.2"
             params:
                 max_distance=config["max_distance"],
-                output_mode="full",
+                missing_data=config["cgmlst_missing_data"],
                 previous_distances=PREVIOUS_CLUSTERING + "/distances.tsv",
             resources:
-                mem_gb=config["mem_gb"]["distance_calculation"],
+                mem_gb=estimated_mem_gb(
+                    "distance_calculation_from_previous_cgmlst",
+                    "distance_calculation",
+                ),
+            benchmark:
+                OUT + "/benchmark/distance_calculation_from_previous_cgmlst.tsv",
             log:
                 OUT + "/log/distance_calculation_cgmlst.log",
-            threads: config["threads"]["distance_calculation"]
+            threads: estimated_threads("distance_calculation_from_previous_cgmlst", "distance_calculation")
             shell:
                 """
-        distle \
+        # only distances involving samples which are new since the previous run are calculated
+        python workflow/scripts/cgmlst_distances.py \
         --verbose \
-        --input-format cgmlst \
-        --output-mode {params.output_mode} \
-        --maxdist {params.max_distance} \
-        --precomputed-distances {params.previous_distances} \
-        {input} {output} 2>&1 > {log}
-                """
\ No newline at end of file
+        --input {input} \
+        --output {output} \
+        --max-distance {params.max_distance} \
+        --missing-data {params.missing_data} \
+        --previous-distances {params.previous_distances} 2>&1 > {log}
+                """
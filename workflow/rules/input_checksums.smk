@@ -0,0 +1,46 @@
+# Checksums of the inputs and outputs are recorded, so a rerun with the same inputs can reuse
+# the alignment (or allele matrix) and distances (see recluster_only.smk)
+# The inputs are hashed at the start of the run, next to the other jobs
+localrules:
+    checksum_inputs,
+    record_input_checksums,
+
+
+rule checksum_inputs:
+    input:
+        list(SAMPLE_INPUTS.values()),
+    output:
+        temp(OUT + "/input_checksums.inputs.yaml"),
+    benchmark:
+        OUT + "/benchmark/checksum_inputs.tsv",
+    message:
+        "Hashing the inputs of {params.n_samples} samples and the previous run."
+    params:
+        n_samples=len(SAMPLE_INPUTS),
+    threads: 4
+    run:
+        with open(output[0], "w") as f:
+            yaml.safe_dump(
+                input_checksums(SAMPLE_INPUTS, PREVIOUS_CLUSTERING, config, threads), f
+            )
+
+
+rule record_input_checksums:
+    input:
+        inputs=OUT + "/input_checksums.inputs.yaml",
+        outputs=[OUT + "/" + name for name in REUSABLE_OUTPUTS[config["clustering_type"]]],
+    output:
+        OUT + "/input_checksums.yaml",
+    benchmark:
+        OUT + "/benchmark/record_input_checksums.tsv",
+    message:
+        "Recording checksums of the inputs, so a rerun with the same inputs can reuse the distances."
+    run:
+        with open(input.inputs) as f:
+            inputs = yaml.safe_load(f)
+        write_checksums(
+            output[0],
+            inputs,
+            output_checksums(OUT, config["clustering_type"]),
+            output_sizes(OUT, config["clustering_type"]),
+        )
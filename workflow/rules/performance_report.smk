@@ -0,0 +1,27 @@
+# Every rule writes a benchmark (wall time, CPU time, peak memory and I/O) to OUT/benchmark
+# These are summarised per rule next to clusters.csv and compared with the previous run,
+# rules which became slower or use more memory are flagged in the regression column
+rule performance_report:
+    input:
+        pipeline_outputs,
+    output:
+        OUT + "/performance_report.tsv",
+    log:
+        OUT + "/log/performance_report.log",
+    message:
+        "Summarising benchmarks in {output}."
+    conda:
+        "../envs/scripts.yaml"
+    container:
+        "docker://ghcr.io/boasvdp/juno_clustering_scripts:0.2"
+    params:
+        benchmark_dir=OUT + "/benchmark",
+        previous_report=PREVIOUS_CLUSTERING + "/performance_report.tsv",
+    threads: 1
+    shell:
+        """
+python workflow/scripts/performance_report.py \
+--benchmark-dir {params.benchmark_dir} \
+--previous-report {params.previous_report} \
+--output {output} 2> {log}
+        """
@@ -0,0 +1,36 @@
+# The inputs are unchanged since the run in RECLUSTER_FROM (see the Snakefile),
+# so its alignment (or allele matrix) and distances are linked instead of recomputed
+localrules:
+    reuse_outputs,
+    record_input_checksums,
+
+
+rule reuse_outputs:
+    output:
+        [OUT + "/" + name for name in REUSABLE_OUTPUTS[config["clustering_type"]]],
+    benchmark:
+        OUT + "/benchmark/reuse_outputs.tsv",
+    message:
+        "Reusing the alignment and distances of {params.run_dir}."
+    params:
+        run_dir=RECLUSTER_FROM,
+    run:
+        recorded = read_checksums(params.run_dir + "/input_checksums.yaml")
+        for name, path in zip(REUSABLE_OUTPUTS[config["clustering_type"]], output):
+            link_output(params.run_dir, name, recorded, path)
+
+
+# the inputs and reused outputs are those of the earlier run, so are its checksums
+rule record_input_checksums:
+    input:
+        [OUT + "/" + name for name in REUSABLE_OUTPUTS[config["clustering_type"]]],
+    output:
+        OUT + "/input_checksums.yaml",
+    benchmark:
+        OUT + "/benchmark/record_input_checksums.tsv",
+    message:
+        "Recording the checksums of {params.run_dir}."
+    params:
+        run_dir=RECLUSTER_FROM,
+    shell:
+        "cp {params.run_dir}/input_checksums.yaml {output}"
@@ -1,13 +1,109 @@
 #!/usr/bin/env python3
 
+import gzip
 import logging
+import sys
 from pathlib import Path
 import pyfastx
-from typing import List, Tuple
-import shutil
+from typing import IO, List, Tuple
 import json
 import re
 
+from state_store import StateStore
+
+
+VALID_EXTS = {".fa", ".fasta", ".fna"}
+VALID_COMPRESSED_EXTS = {".gz", ".bgz"}
+GZIP_MAGIC = b"\x1f\x8b"
+STREAM = Path("-")
+
+
+def has_fasta_ext(filepath: Path) -> bool:
+    """
+    Check if a path has a fasta extension, optionally followed by a compression extension.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path to check, e.g. sample.fasta or sample.fa.gz.
+
+    Returns
+    -------
+    bool
+        True if the path looks like a (compressed) fasta file.
+
+    """
+    suffixes = filepath.suffixes
+    if suffixes and suffixes[-1] in VALID_COMPRESSED_EXTS:
+        suffixes = suffixes[:-1]
+    return len(suffixes) > 0 and suffixes[-1] in VALID_EXTS
+
+
+def open_fasta(filepath: Path) -> IO[str]:
+    """
+    Open a plain, gzip or bgzip compressed fasta file for reading as text.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path to the fasta file. Compression is detected from the file contents.
+        Block compressed (bgzip) files are valid multi-member gzip files.
+
+    Returns
+    -------
+    IO[str]
+        Text stream, decompressed while reading.
+
+    """
+    with open(filepath, "rb") as f:
+        is_gzip = f.read(2) == GZIP_MAGIC
+    if is_gzip:
+        return gzip.open(filepath, "rt")
+    return open(filepath)
+
+
+def scan_fasta(filepath: Path) -> Tuple[List[Tuple[str, str]], int, int]:
+    """
+    Read the records of a fasta file and count Ns in a single pass.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path to a plain or compressed fasta file.
+
+    Returns
+    -------
+    Tuple[List[Tuple[str, str]], int, int]
+        Records as (name, raw record) tuples, number of Ns and number of bases.
+        The raw record keeps the original header and line wrapping. Only
+        uppercase Ns are counted, as by the pyfastx composition used before.
+
+    """
+    list_records = []
+    N_content = 0
+    fa_size = 0
+    name = None
+    lines: List[str] = []
+    with open_fasta(filepath) as f:
+        for line in f:
+            if line.startswith(">"):
+                if name is not None:
+                    list_records.append((name, "".join(lines)))
+                name = line[1:].split(maxsplit=1)[0] if line[1:].strip() else ""
+                lines = [line]
+            else:
+                if name is None:
+                    raise ValueError(f"{filepath} does not start with a fasta header.")
+                if not line.endswith("\n"):
+                    line += "\n"
+                lines.append(line)
+                seq = line.rstrip()
+                fa_size += len(seq)
+                N_content += seq.count("N")
+    if name is not None:
+        list_records.append((name, "".join(lines)))
+    return list_records, N_content, fa_size
+
 
 def read_fasta(filepath: Path) -> pyfastx.Fasta:
     """
@@ -33,14 +129,16 @@ def read_fasta(filepath: Path) -> pyfastx.Fasta:
     return fasta
 
 
-def read_names_previous_aln(previous_aln: Path) -> List[str]:
+def pass_through_previous_aln(previous_aln: IO[str], output: IO[str]) -> List[str]:
     """
-    List names from a previous alignment.
+    Copy a previous alignment to the output and list its names.
 
     Parameters
     ----------
-    previous_aln : Path
-        Path to the previous alignment.
+    previous_aln : IO[str]
+        Text stream of the previous alignment, e.g. a decompressing pipe.
+    output : IO[str]
+        Text stream of the output alignment.
 
     Returns
     -------
@@ -48,40 +146,18 @@ def read_names_previous_aln(previous_aln: Path) -> List[str]:
         List of names in the alignment.
 
     """
-    logging.debug(f"Reading names from previous alignment {previous_aln}.")
-    aln = read_fasta(previous_aln)
-    logging.info(f"Found {len(aln)} sequences in {previous_aln}.")
-    list_names = [name for name in aln.keys()]
+    list_names = []
+    line = "\n"
+    for line in previous_aln:
+        if line.startswith(">"):
+            list_names.append(line[1:].split(maxsplit=1)[0])
+        output.write(line)
+    if not line.endswith("\n"):
+        output.write("\n")
+    logging.info(f"Found {len(list_names)} sequences in previous alignment.")
     return list_names
 
 
-def check_N_content(filepath: Path) -> float:
-    """
-    Calculate the proportion of Ns in a fasta file.
-
-    Parameters
-    ----------
-    filepath : str
-        Path to the fasta file.
-
-    Returns
-    -------
-    float
-        Proportion of Ns in the fasta file.
-
-    """
-    logging.debug(f"Checking N content in {filepath}.")
-    # TODO: check if generator here can be reused higher up
-    fasta = read_fasta(filepath)
-    fa_composition = fasta.composition
-    fa_size = fasta.size
-    logging.debug(f"Composition of {filepath}: {fa_composition}, total {fa_size}.")
-    N_content = fa_composition.get("N", 0)
-    N_pct = N_content / fa_size
-    logging.info(f"Found {N_content} Ns in {filepath} ({N_pct:.2%}).")
-    return N_pct
-
-
 def select_from_input_fasta(
     new_input: List[Path], N_pct_threshold: float, list_already_present: List[str]
 ) -> Tuple[List[str], List[str]]:
@@ -105,23 +181,27 @@ def select_from_input_fasta(
     """
     list_new_fa = []
     list_new_names = []
+    set_already_present = set(list_already_present)
     for file in new_input:
         logging.info(f"Reading input fasta {file}.")
-        N_pct = check_N_content(file)
+        # records and N content are read in a single (decompressing) pass
+        list_records, N_content, fa_size = scan_fasta(file)
+        N_pct = N_content / fa_size
+        logging.info(f"Found {N_content} Ns in {file} ({N_pct:.2%}).")
         if N_pct > N_pct_threshold:
             logging.error(f"Input fasta {file} FAILED: too many Ns ({N_pct:.2%}).")
         else:
             logging.info(f"Input fasta {file} PASSED: N content ({N_pct:.2%}).")
-            fa = read_fasta(file)
-            for seq in fa:
-                if seq.name in list_already_present:
+            for name, raw in list_records:
+                if name in set_already_present:
                     # TODO: Discuss: overwrite or skip if already in alignment? Old sequence could be extracted and written to a new file.
                     logging.warning(
-                        f"Sequence {seq.name} already in alignment. Skipping."
+                        f"Sequence {name} already in alignment. Skipping."
                     )
                 else:
-                    list_new_fa.append(seq.raw)
-                    list_new_names.append(seq.name)
+                    list_new_fa.append(raw)
+                    list_new_names.append(name)
+                    set_already_present.add(name)
     logging.info(f"Selected {len(list_new_fa)} sequences to add to alignment.")
     return list_new_fa, list_new_names
 
@@ -193,18 +273,42 @@ def check_names_in_fa(fasta_path: Path, list_names: List[str]) -> None:
 #     temp_path.rename(fasta_path)
 
 def main(args) -> None:
-    if args.previous_aln:
-        list_previous_names = read_names_previous_aln(args.previous_aln)
-        shutil.copyfile(args.previous_aln, args.output)
-    else:
-        list_previous_names = []
-    list_new_fa, list_new_names = select_from_input_fasta(
-        args.new_input, args.N_threshold, list_previous_names
-    )
-    with open(args.output, "a") as f:
+    # "-" reads the previous alignment from stdin or writes the output to stdout,
+    # so the alignment can be piped between (de)compression without temporary copies
+    output = sys.stdout if args.output == STREAM else open(args.output, "w")
+    try:
+        if args.previous_aln == STREAM:
+            logging.info("Reading previous alignment from stdin.")
+            list_previous_names = pass_through_previous_aln(sys.stdin, output)
+        elif args.previous_aln:
+            logging.info(f"Reading previous alignment {args.previous_aln}.")
+            with open_fasta(args.previous_aln) as previous_aln:
+                list_previous_names = pass_through_previous_aln(previous_aln, output)
+        else:
+            list_previous_names = []
+        list_new_fa, list_new_names = select_from_input_fasta(
+            args.new_input, args.N_threshold, list_previous_names
+        )
         for seq in list_new_fa:
-            f.write(seq)
-    check_names_in_fa(args.output, list_previous_names + list_new_names)
+            output.write(seq)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        else:
+            output.flush()
+    if args.output == STREAM:
+        logging.info(
+            f"Wrote {len(list_previous_names) + len(list_new_names)} sequences to stdout."
+        )
+    else:
+        check_names_in_fa(args.output, list_previous_names + list_new_names)
+    if args.previous_names_output:
+        with open(args.previous_names_output, "w") as f:
+            f.writelines(f"{name}\n" for name in list_previous_names)
+    if args.state_db:
+        with StateStore(args.state_db) as store:
+            store.add_samples(list_previous_names + list_new_names, in_alignment=True)
+        logging.info(f"Recorded {len(list_new_names)} new sequences in {args.state_db}.")
 
     # Rename headers if mapping is provided
     # if sample_date_map:
@@ -221,7 +325,7 @@ if __name__ == "__main__":
         "--previous-aln",
         type=Path,
         metavar="STR",
-        help="Path to previous alignment.",
+        help="Path to previous alignment, optionally gzip compressed. Use - to read from stdin.",
     )
     parser.add_argument(
         "--new-input",
@@ -229,6 +333,13 @@ if __name__ == "__main__":
         metavar="STR",
         help="Path to new input sequences.",
         nargs="+",
+        default=[],
+    )
+    parser.add_argument(
+        "--new-input-manifest",
+        type=Path,
+        metavar="STR",
+        help="Path to a file listing new input sequences, one path per line. Input files are read in place.",
     )
     parser.add_argument(
         "--N-content-threshold",
@@ -242,7 +353,19 @@ if __name__ == "__main__":
         "--output",
         type=Path,
         metavar="STR",
-        help="Path to output alignment.",
+        help="Path to output alignment. Use - to write to stdout.",
+    )
+    parser.add_argument(
+        "--previous-names-output",
+        type=Path,
+        metavar="STR",
+        help="Path to write the names of the sequences of the previous alignment to, one per line.",
+    )
+    parser.add_argument(
+        "--state-db",
+        type=Path,
+        metavar="STR",
+        help="Path to a state store (SQLite), the samples in the output alignment are recorded in it.",
     )
     parser.add_argument(
         "--verbose",
@@ -263,12 +386,14 @@ if __name__ == "__main__":
     #sohana added 050326
     # Expand directories to files
     expanded_new_inputs = []
-    valid_exts = {".fa", ".fasta", ".fna", ".fa.gz"}
+    if args.new_input_manifest:
+        with open(args.new_input_manifest) as f:
+            args.new_input = args.new_input + [Path(line.strip()) for line in f if line.strip()]
     for p in args.new_input:
         if p.is_dir():
-            expanded_new_inputs.extend([f for f in p.iterdir() if f.suffix in valid_exts])
+            expanded_new_inputs.extend([f for f in p.iterdir() if has_fasta_ext(f)])
         else:
-            if p.suffix in valid_exts:
+            if has_fasta_ext(p):
                 expanded_new_inputs.append(p)
     args.new_input = expanded_new_inputs
     ###############################################
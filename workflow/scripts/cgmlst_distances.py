@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+import logging
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from combine_cgmlst_profiles import MISSING, read_allele_matrix
+
+MISSING_DATA_MODES = ["ignore", "count"]
+
+
+def batch_size_for(n_reference: int, n_loci: int, memory_mb: int) -> int:
+    """
+    Number of query profiles to compare at once within a memory budget.
+
+    Parameters
+    ----------
+    n_reference : int
+        Number of reference profiles each query is compared to.
+    n_loci : int
+        Number of loci per profile.
+    memory_mb : int
+        Memory budget for the boolean comparison arrays of a single batch.
+
+    Returns
+    -------
+    int
+        Number of query profiles per batch, at least 1.
+
+    """
+    # comparison and missing masks are both one byte per query-reference-locus
+    bytes_per_query = 2 * max(n_reference, 1) * max(n_loci, 1)
+    return max(1, (memory_mb * 1024**2) // bytes_per_query)
+
+
+def compute_distances(
+    query: np.ndarray,
+    reference: np.ndarray,
+    missing_data: str = "ignore",
+    max_distance: Optional[int] = None,
+    memory_mb: int = 512,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Compute allele distances between query and reference profiles in batches.
+
+    Parameters
+    ----------
+    query : np.ndarray
+        Allele codes of query profiles (samples x loci).
+    reference : np.ndarray
+        Allele codes of reference profiles (samples x loci).
+    missing_data : str
+        How to treat loci which are missing (code 0) in one or both profiles.
+        "ignore" skips such loci for the pair, "count" counts a locus which is
+        missing in only one of both profiles as a difference.
+    max_distance : Optional[int]
+        Only return pairs with a distance up to this value.
+    memory_mb : int
+        Memory budget for a single batch.
+
+    Yields
+    ------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Query indices, reference indices and distances of a batch of pairs,
+        ordered by query and then by reference index.
+
+    """
+    if missing_data not in MISSING_DATA_MODES:
+        raise ValueError(f"Unknown missing data mode {missing_data}.")
+    if query.shape[1] != reference.shape[1]:
+        raise ValueError(
+            f"Query has {query.shape[1]} loci, reference has {reference.shape[1]}."
+        )
+    batch_size = batch_size_for(reference.shape[0], reference.shape[1], memory_mb)
+    logging.debug(f"Comparing {batch_size} query profiles per batch.")
+    reference_present = reference != MISSING
+    for start in range(0, query.shape[0], batch_size):
+        batch = query[start : start + batch_size]
+        differences = batch[:, None, :] != reference[None, :, :]
+        if missing_data == "ignore":
+            differences &= batch[:, None, :] != MISSING
+            differences &= reference_present[None, :, :]
+        distances = differences.sum(axis=2, dtype=np.uint32)
+        if max_distance is None:
+            i, j = np.indices(distances.shape)
+            i, j = i.ravel(), j.ravel()
+        else:
+            i, j = np.nonzero(distances <= max_distance)
+        yield i + start, j, distances[i, j]
+
+
+def read_previous_distances(previous_distances: Path, samples: List[str]) -> pd.DataFrame:
+    """
+    Read previously computed distances between samples which are still present.
+
+    Parameters
+    ----------
+    previous_distances : Path
+        Path to the distances of a previous run.
+    samples : List[str]
+        Samples in the current allele matrix.
+
+    Returns
+    -------
+    pd.DataFrame
+        Previous distances between current samples.
+
+    """
+    logging.info(f"Reading previous distances {previous_distances}.")
+    df = pd.read_csv(
+        previous_distances,
+        header=None,
+        sep="\t",
+        names=["sample1", "sample2", "distance"],
+        dtype={"sample1": "category", "sample2": "category", "distance": np.uint32},
+    )
+    set_samples = set(samples)
+    df = df[df["sample1"].isin(set_samples) & df["sample2"].isin(set_samples)]
+    logging.info(f"Reusing {len(df)} previous distances.")
+    return df
+
+
+def write_pairs(
+    f, query_names: np.ndarray, reference_names: np.ndarray, i, j, distances
+) -> int:
+    pd.DataFrame(
+        {"sample1": query_names[i], "sample2": reference_names[j], "distance": distances}
+    ).to_csv(f, sep="\t", header=False, index=False)
+    return len(distances)
+
+
+def main(args) -> None:
+    samples, loci, matrix = read_allele_matrix(args.input)
+    names = np.array(samples, dtype=object)
+
+    if args.previous_distances:
+        df_previous = read_previous_distances(args.previous_distances, samples)
+        set_previous = set(df_previous["sample1"]) | set(df_previous["sample2"])
+        is_new = np.array([sample not in set_previous for sample in samples])
+    else:
+        df_previous = None
+        is_new = np.ones(len(samples), dtype=bool)
+    logging.info(
+        f"Computing distances of {is_new.sum()} new samples to {len(samples)} samples."
+    )
+
+    n_pairs = 0
+    with open(args.output, "w") as f:
+        if df_previous is not None:
+            df_previous.to_csv(f, sep="\t", header=False, index=False)
+            n_pairs += len(df_previous)
+        new_index = np.flatnonzero(is_new)
+        for i, j, distances in compute_distances(
+            matrix[new_index],
+            matrix,
+            args.missing_data,
+            args.max_distance,
+            args.memory_mb,
+        ):
+            n_pairs += write_pairs(f, names[new_index], names, i, j, distances)
+            # pairs between a new and a previous sample are written in both directions
+            mask_old = ~is_new[j]
+            n_pairs += write_pairs(
+                f, names, names[new_index], j[mask_old], i[mask_old], distances[mask_old]
+            )
+    logging.info(f"Wrote {n_pairs} distances to {args.output}.")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Calculate pairwise allele distances between cgMLST profiles."
+    )
+
+    parser.add_argument(
+        "--input",
+        type=Path,
+        metavar="STR",
+        help="Path to allele matrix (cgmlst_alleles.tsv.gz).",
+        required=True,
+    )
+    parser.add_argument(
+        "--previous-distances",
+        type=Path,
+        metavar="STR",
+        help="Path to distances of a previous run. Only distances involving samples absent from this file are computed.",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        metavar="STR",
+        help="Path to output distances.",
+        required=True,
+    )
+    parser.add_argument(
+        "--max-distance",
+        type=int,
+        metavar="INT",
+        help="Only output distances up to this value.",
+    )
+    parser.add_argument(
+        "--missing-data",
+        type=str,
+        choices=MISSING_DATA_MODES,
+        help="Ignore loci missing in either profile, or count a locus missing in one profile as a difference.",
+        default="ignore",
+    )
+    parser.add_argument(
+        "--memory-mb",
+        type=int,
+        metavar="INT",
+        help="Memory budget in MB for a batch of comparisons.",
+        default=512,
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Increase verbosity.",
+    )
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+
+    main(args)
@@ -1,34 +1,37 @@
 #!/usr/bin/env python3
 
-import networkx as nx
+import argparse
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import logging
+import resource
 import sys
-
-from functools import wraps
-from time import time
-
-
-def timing(f):
-    @wraps(f)
-    def wrap(*args, **kw):
-        ts = time()
-        result = f(*args, **kw)
-        te = time()
-        logging.debug(f"func:{f.__name__} took: {te-ts:.4f} sec")
-        return result
-
-    return wrap
-
-
-def flatten_list(nested_list):
-    "Flatten a nested list into a single list"
-    return [item for sublist in nested_list for item in sublist]
+import tempfile
+
+from distance_summary import DistanceSummary
+from sample_registry import SampleRegistry
+from spanning_tree import SpanningForest
+from state_store import StateStore
+from cluster_engine import (
+    ClusterEngine,
+    construct_merged_cluster_name,
+    construct_new_cluster_name,
+    emit_and_save_critical_warning,
+    flatten_list,
+    timing,
+)
+
+# Upper estimate of the memory per row of a chunk of distances while it is parsed
+BYTES_PER_DISTANCE_ROW = 512
+# Share of the memory limit which a chunk of distances may use
+CHUNK_MEMORY_FRACTION = 0.25
+# Rows of the edges within the threshold which are added to the state store at a time
+STORE_CHUNK_SIZE = 1_000_000
 
 
 @timing
-def read_data(distances, previous_clustering):
+def read_data(distances, previous_clustering, store=None):
     """
     Read distances and previous clustering into dataframes
 
@@ -40,6 +43,9 @@ def read_data(distances, previous_clustering):
     previous_clustering : Path
         Path to previous clustering file
 
+    store : StateStore
+        State store to read the previous clustering from, if there is no file
+
     Returns
     -------
     df_distances : pd.DataFrame
@@ -51,20 +57,49 @@ def read_data(distances, previous_clustering):
     -----
     If no previous clustering is found, an empty dataframe is returned
 
+    Sample columns are read as categoricals, so every sample name is stored
+    once and rows refer to it by an integer code.
+
     """
     logging.info(f"Reading distances")
-    df_distances = pd.read_csv(
-        distances, header=None, sep="\t", names=["sample1", "sample2", "distance"]
+    df_distances = read_distances(distances)
+    df_previous_clustering = read_previous_clustering(previous_clustering, store)
+    return df_distances, df_previous_clustering
+
+
+def read_distances(distances, chunksize=None):
+    """
+    Read distances, as a dataframe or an iterator over chunks of chunksize rows
+    """
+    return pd.read_csv(
+        distances,
+        header=None,
+        sep="\t",
+        names=["sample1", "sample2", "distance"],
+        dtype={"sample1": "category", "sample2": "category"},
+        chunksize=chunksize,
     )
+
+
+def read_previous_clustering(previous_clustering, store=None):
+    """
+    Read previous clustering, an empty dataframe if there is none
+
+    Without a previous clustering file, the clusters of the latest run in the
+    state store are the previous clustering.
+    """
     if previous_clustering:
         logging.info(f"Reading previous clustering")
         df_previous_clustering = pd.read_csv(previous_clustering, dtype=str)
+    elif store is not None and store.latest_run() is not None:
+        logging.info(f"Reading previous clustering from {store.path}")
+        df_previous_clustering = store.clusters()
     else:
         logging.info(f"No previous clustering found")
         df_previous_clustering = pd.DataFrame(
             columns=["sample", "curated_cluster", "final_cluster"]
         )
-    return df_distances, df_previous_clustering
+    return df_previous_clustering
 
 
 @timing
@@ -84,88 +119,106 @@ def clean_sample_columns(df, cols, fixed_string):
     df : pd.DataFrame
         Dataframe with cleaned sample names
 
+    Notes
+    -----
+    Categorical columns are cleaned on their categories only. If cleaning makes
+    two categories identical, their codes are merged.
+
     """
     for col in cols:
-        df[col] = df[col].str.replace(fixed_string, "")
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            cleaned = df[col].cat.categories.str.replace(fixed_string, "")
+            new_codes, new_categories = pd.factorize(cleaned)
+            codes = df[col].cat.codes.to_numpy()
+            codes = np.where(codes >= 0, new_codes[codes], -1)
+            df[col] = pd.Categorical.from_codes(codes, new_categories)
+        else:
+            df[col] = df[col].str.replace(fixed_string, "")
     return df
 
 
 @timing
-def exclude_samples(df_distances, exclude_list):
+def read_exclude_list(exclude_list):
     """
-    Exclude samples from the distances dataframe
+    Read the samples to exclude into a set
 
     Parameters
     ----------
-    df_distances : pd.DataFrame
-        Dataframe with distances
     exclude_list : Path
         Path to list of samples to exclude
 
     Returns
     -------
-    df_distances : pd.DataFrame
-        Dataframe with distances
-
-    """
-    with open(exclude_list) as f:
-        nr_lines = len(f.readlines())
-    if nr_lines > 0:
-        logging.info(f"Excluding samples")
-        df_exclude = pd.read_csv(exclude_list, sep="\t")
-        exclude_samples = df_exclude["sample"].tolist()
-        df_distances = df_distances[
-            ~df_distances["sample1"].isin(exclude_samples)
-            & ~df_distances["sample2"].isin(exclude_samples)
-        ]
-    return df_distances
+    set_exclude : set
+        Set with unique sample names to exclude
 
+    Notes
+    -----
+    An empty file results in an empty set.
 
-@timing
-def emit_and_save_critical_warning(message, output_path):
     """
-    Emit a warning and save it to a file
+    try:
+        df_exclude = pd.read_csv(exclude_list, sep="\t", usecols=["sample"], dtype=str)
+    except pd.errors.EmptyDataError:
+        return set()
+    return set(df_exclude["sample"].dropna())
 
-    Parameters
-    ----------
-    message : str
-        Warning message
-    output_path : Path
-        Path to output file
-
-    Returns
-    -------
-    None
 
+def read_exclude_set(exclude_list, store=None):
+    """
+    Samples to exclude, from the exclude list or else from the exclusions in the state store
     """
-    logging.critical(message)
-    with open(output_path, "a") as f:
-        f.write(message + "\n")
+    if exclude_list:
+        return read_exclude_list(exclude_list)
+    if store is not None:
+        return set(store.exclusions()["sample"])
+    return set()
 
 
 @timing
-def get_df_nodes(df_distances, df_previous_clustering):
+def exclude_samples(df_distances, exclude_list):
     """
-    Make a dataframe with all nodes
+    Exclude samples from the distances dataframe
 
     Parameters
     ----------
     df_distances : pd.DataFrame
         Dataframe with distances
-    df_previous_clustering : pd.DataFrame
-        Dataframe with previous clustering
+    exclude_list : Path
+        Path to list of samples to exclude
 
     Returns
     -------
-    df_nodes : pd.DataFrame
-        Dataframe with nodes
+    df_distances : pd.DataFrame
+        Dataframe with distances
+
+    Notes
+    -----
+    Set membership is only tested once per unique sample (the categories of the
+    sample columns). Rows are then masked by looking up their integer codes.
+
+    """
+    return exclude_sample_set(df_distances, read_exclude_list(exclude_list))
 
+
+def exclude_sample_set(df_distances, set_exclude):
+    """
+    Exclude samples in set_exclude from the distances dataframe, see exclude_samples
     """
-    logging.info(f"Creating nodes")
-    set_samples = set(df_distances["sample1"]) | set(df_distances["sample2"])
-    df_nodes = pd.DataFrame(set_samples, columns=["sample"])
-    df_nodes = df_nodes.merge(df_previous_clustering, on="sample", how="left")
-    return df_nodes
+    if len(set_exclude) > 0:
+        logging.info(f"Excluding {len(set_exclude)} unique samples")
+        mask_excluded = np.zeros(len(df_distances), dtype=bool)
+        for col in ["sample1", "sample2"]:
+            if not isinstance(df_distances[col].dtype, pd.CategoricalDtype):
+                df_distances[col] = df_distances[col].astype("category")
+            categories = df_distances[col].cat.categories
+            # the trailing False is looked up by missing values (code -1)
+            excluded_categories = np.append(
+                [sample in set_exclude for sample in categories], False
+            ).astype(bool)
+            mask_excluded |= excluded_categories[df_distances[col].cat.codes.to_numpy()]
+        df_distances = df_distances[~mask_excluded]
+    return df_distances
 
 
 @timing
@@ -195,299 +248,326 @@ def filter_edges(df, threshold):
 
 
 @timing
-def create_graph(df_distances, df_nodes):
+def create_output(inferred_cluster_dict, df_previous_clustering, output_path):
     """
-    Create a networkx graph with distances and cluster attributes
+    Create output file with inferred clusters
 
     Parameters
     ----------
-    df_distances : pd.DataFrame
-        Dataframe with distances
-    df_nodes : pd.DataFrame
-        Dataframe with nodes
+    inferred_cluster_dict : dict
+        Dictionary with samples as keys and inferred clusters as values
+    df_previous_clustering : pd.DataFrame
+        Dataframe with previous clustering
+    output_path : Path
+        Path to output file, not written if None
 
     Returns
     -------
-    G : nx.Graph
-        Graph with distances as edges and clusters as attributes
+    df_out : pd.DataFrame
+        Dataframe with the columns of the output file
 
     """
-    # sys.exit() # add empty nodes to graph!!
-    logging.info(f"Creating graph based on distances")
-    G = nx.from_pandas_edgelist(df_distances, "sample1", "sample2")
+    logging.info(f"Creating output")
+    df_out = pd.DataFrame.from_dict(
+        inferred_cluster_dict, orient="index", columns=["inferred_cluster"]
+    )
+    df_out.reset_index(inplace=True, names=["sample", "inferred_cluster"])
 
-    # create a dictionary from df_nodes, where the key is the sample and the value is the curated_cluster
-    # this will be used to assign the cluster to the nodes
-    curated_clusters_dict = df_nodes.set_index("sample").to_dict()["curated_cluster"]
-    final_clusters_dict = df_nodes.set_index("sample").to_dict()["final_cluster"]
+    logging.info(f"Merging to include previous clustering")
+    df_out = df_out.merge(
+        df_previous_clustering[["sample", "curated_cluster"]], on="sample", how="left"
+    )
 
-    logging.info(f"Assigning clusters to nodes in graph")
-    nx.set_node_attributes(G, curated_clusters_dict, "curated_cluster")
-    nx.set_node_attributes(G, final_clusters_dict, "final_cluster")
+    # if curated_cluster is NaN, replace with inferred_cluster
+    df_out["final_cluster"] = df_out["curated_cluster"].fillna(
+        df_out["inferred_cluster"]
+    )
 
-    return G
+    df_out.sort_values(by="sample", inplace=True)
 
+    if output_path is not None:
+        write_output(df_out, output_path)
+    return df_out
 
-@timing
-def construct_merged_cluster_name(set_clusters, separator):
-    """
-    Construct a new cluster name based on the current clusters
 
-    Parameters
-    ----------
-    set_clusters : set
-        Set with clusters
+def write_output(df_out, output_path):
+    df_out.to_csv(output_path, index=False)
+    logging.info(f"Output written to {output_path}")
 
-    Returns
-    -------
-    name : str
-        New cluster name
 
-    """
-    logging.debug(f"Constructing merged cluster name")
-    nested_list_unique_clusters = [cluster.split(separator) for cluster in set_clusters]
-    flattened_list_unique_clusters = flatten_list(nested_list_unique_clusters)
-    set_unique_clusters = set(flattened_list_unique_clusters)
-    name = f"{separator.join(sorted(set_unique_clusters))}"
-    return name
+def write_edges(df_distances, edges_path):
+    "Append distances to a file of edges, in the format of the distances file"
+    df_distances[["sample1", "sample2", "distance"]].to_csv(
+        edges_path, sep="\t", header=False, index=False, mode="a"
+    )
 
 
-@timing
-def construct_new_cluster_name(current_clusters_dict, separator):
+def register_samples(df_distances, registry):
     """
-    Construct a new cluster name based on the current clusters
+    Register the samples of both sample columns
 
-    Parameters
-    ----------
-    current_clusters_dict : dict
-        Dictionary with samples as keys and clusters as values
-    separator : str
-        Separator for merged clusters
+    Only the categories (unique names) are looked up. Rows which are later
+    excluded or filtered keep these categories, so their samples are
+    registered too.
 
     Returns
     -------
-    name : str
-        New cluster name
+    dict
+        Registry ids of the categories of each sample column.
 
+    """
+    return {
+        col: registry.add(df_distances[col].cat.categories)
+        for col in ["sample1", "sample2"]
+    }
 
-    Notes
-    -----
-    Cluster names consist of a prefix (single capital letter), followed by a suffix (three digits).
-
-    The first cluster is A001, the second is A002, and so on.
-
-    If cluster A999 is reached, the next cluster will be B001, and so on.
 
-    This functions checks the current clusters, finds the most recent cluster and returns the next cluster name.
+def edge_samples(df_distances, category_ids=None):
     """
-    # get all current clusters and split merged cluster names
-    current_cluster_values = list(set(current_clusters_dict.values()))
-    current_clusters = flatten_list(
-        [cluster.split(separator) for cluster in current_cluster_values]
+    Samples of each edge, as registry ids if the ids of the categories are given
+    """
+    if category_ids is None:
+        return df_distances["sample1"], df_distances["sample2"]
+    return tuple(
+        category_ids[col][df_distances[col].cat.codes.to_numpy()]
+        for col in ["sample1", "sample2"]
     )
 
-    # return early if no previous clusters are found
-    if len(current_clusters) == 0:
-        name = "A001"
-        return name
 
-    # find most recent cluster and parse name
-    # most_recent_cluster = sorted(current_clusters)[-1]
-    # find most recent cluster by parse name and exclude Z-range Z938-Z999
-    excluded_range = [c for c in current_clusters if c.startswith("Z") and 936 <= int(c[1:]) <= 999]
-    most_recent_cluster = sorted(c for c in current_clusters if c not in excluded_range)[-1]
-    # most_recent_cluster = sorted(c for c in current_clusters if not (c.startswith("Z") and 936 <= int(c[1:]) <= 999))[-1]
-    first_char = most_recent_cluster[0]
-    number = int(most_recent_cluster[1:])
+def save_registry(registry, prefix):
+    registry.save(prefix)
+    logging.info(f"Registry of {len(registry)} samples written to {prefix}")
 
-    # increment the number and first char if needed using ascii code
-    if number == 999:
-        first_char = chr(ord(first_char) + 1)
-        number = 1
-    else:
-        number += 1
 
-    name = f"{first_char}{number:03}"
-    return name
+def make_engine(args, registry=None, spill_dir=None):
+    """
+    Make a ClusterEngine, on registry ids if a sample registry is given
+    """
+    return ClusterEngine(
+        args.threshold,
+        args.merged_cluster_separator,
+        args.warnings_path,
+        spill_dir,
+        sample_ids=registry is not None,
+    )
 
 
-@timing
-def enlist_clusters(graph, attribute):
+def inferred_clusters(engine, df_previous_clustering, registry=None):
     """
-    Enlist clusters from a graph
+    Infer clusters with the previous clustering, with sample names as keys
 
-    Parameters
-    ----------
-    graph : nx.Graph
-        Graph with clusters
-    attribute : str
-        Attribute to use for clusters
+    With a sample registry, the previous clustering is looked up once all
+    samples of the distances are registered.
+    """
+    if registry is not None:
+        df_previous_clustering = df_previous_clustering.assign(
+            sample=registry.ids(df_previous_clustering["sample"].astype(str))
+        )
+        # previous samples without distances are not clustered, so need no id
+        df_previous_clustering = df_previous_clustering[df_previous_clustering["sample"] >= 0]
+    engine.set_previous_clustering(df_previous_clustering)
+    inferred_cluster_dict = engine.infer()
+    if registry is None:
+        return inferred_cluster_dict
+    names = registry.names_of(list(inferred_cluster_dict))
+    return dict(zip(names.tolist(), inferred_cluster_dict.values()))
 
-    Returns
-    -------
-    set_clusters : set
-        Set with clusters
 
+def check_memory(memory_limit):
+    """
+    Warn if the peak memory use (RSS) of this process exceeds memory_limit (GB)
     """
-    all_clusters = nx.get_node_attributes(graph, attribute).values()
-    set_clusters = set([str(x) for x in all_clusters])
-    clean_set_clusters = set_clusters - {"nan"}
-    return clean_set_clusters
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_gb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024**2
+    if peak_rss_gb > memory_limit:
+        logging.warning(
+            f"Peak memory use {peak_rss_gb:.2f} GB exceeds memory limit {memory_limit} GB"
+        )
+        return False
+    return True
 
 
 @timing
-def infer_clusters(graph, merged_cluster_separator, warnings_path):
+def cluster_out_of_core(
+    args, spill_dir, registry=None, store=None, summary=None, forest=None, edges_path=None
+):
     """
-    Infer clusters based on connected components
+    Cluster distances read in chunks, with a bounded memory use
 
     Parameters
     ----------
-    graph : nx.Graph
-        Graph with distances and clusters
-    merged_cluster_separator : str
-        Separator for merged cluster names
-    warnings_path : Path
-        Path to warnings file
+    args : argparse.Namespace
+        Arguments of cluster.py, with memory_limit in GB.
+    spill_dir : Path
+        Directory to keep the thresholded edges in.
+    registry : SampleRegistry
+        If given, the samples are registered in it and clustered by their
+        registry id.
+    store : StateStore
+        If given, the previous clustering and exclusions are read from it
+        when there are no files.
+    summary : DistanceSummary
+        If given, it is updated with the distances of every chunk.
+    forest : SpanningForest
+        If given, it is updated with the distances of every chunk.
+    edges_path : Path
+        If given, the edges within the threshold are appended to it.
 
     Returns
     -------
-    inferred_cluster_dict : dict
-        Dictionary with samples as keys and inferred clusters as values
-
-    Notes
-    -----
-    This function is the core of the clustering algorithm.
-    It iterates over connected components (single linkage clusters) and assigns a cluster to them.
-    If a connected component has multiple clusters, it merges them.
-    If a connected component has no clusters, it creates a new cluster name.
-
-    """
-    inferred_cluster_dict = {}
-
-    logging.info(f"Starting analysis per subgraph")
-    for connected_component in nx.connected_components(graph):
-        # if a cluster contains a curated_cluster value, it will be used
-        # if multiple curatedc_clusters are found, they will be merged and a special warning will be issued
-        # if no curated_cluster is found, the final_cluster will be used
-        # if multiple final_clusters are found, they will be merged and a special warning will be issued
-        # if no final_cluster is found, a new cluster name will be created
-        list_nodes = list(connected_component)
-        subgraph = graph.subgraph(list_nodes)
-        set_curated_clusters = enlist_clusters(subgraph, "curated_cluster")
-        set_final_clusters = enlist_clusters(subgraph, "final_cluster")
-        if len(set_curated_clusters) > 1:
-            emit_and_save_critical_warning(
-                f"WARNING: Curated clusters {set_curated_clusters} have merged!",
-                warnings_path,
-            )
-            inferred_cluster = construct_merged_cluster_name(
-                set_curated_clusters, merged_cluster_separator
-            )
-        elif len(set_curated_clusters) == 1:
-            inferred_cluster = list(set_curated_clusters)[0]
-            logging.warning(
-                f"Cluster {inferred_cluster} is curated and not merged with others"
-            )
-        elif len(set_final_clusters) > 1:
-            emit_and_save_critical_warning(
-                f"WARNING: Final clusters {set_final_clusters} have merged!",
-                warnings_path,
-            )
-            inferred_cluster = construct_merged_cluster_name(
-                set_final_clusters, merged_cluster_separator
-            )
-        elif len(set_final_clusters) == 1:
-            inferred_cluster = list(set_final_clusters)[0]
-            logging.info(
-                f"Cluster {inferred_cluster} is known and not merged with others"
-            )
-        else:
-            # should check existing cluster names
-            logging.info(f"Creating new cluster name")
-            inferred_cluster = construct_new_cluster_name(
-                inferred_cluster_dict, merged_cluster_separator
-            )
-            logging.info(
-                f"New cluster name is {inferred_cluster}, for samples {list_nodes}"
-            )
-
-        logging.debug(f"Assigning cluster {inferred_cluster} to samples {list_nodes}")
-        for node in list_nodes:
-            inferred_cluster_dict[node] = inferred_cluster
-
-    return inferred_cluster_dict
-
-
-@timing
-def create_output(inferred_cluster_dict, df_previous_clustering, output_path):
-    """
-    Create output file with inferred clusters
-
-    Parameters
-    ----------
     inferred_cluster_dict : dict
         Dictionary with samples as keys and inferred clusters as values
     df_previous_clustering : pd.DataFrame
         Dataframe with previous clustering
-    output_path : Path
-        Path to output file
 
-    Returns
-    -------
-    None
+    Notes
+    -----
+    Chunks are cleaned, excluded and filtered like the whole distances file
+    and read in order, so samples get the same ids as in memory and the
+    output is identical. Besides a chunk, memory only holds the sample names
+    and the union-find arrays (a few integers per sample); the edges within
+    the threshold are appended to a file in spill_dir.
 
     """
-    logging.info(f"Creating output")
-    df_out = pd.DataFrame.from_dict(
-        inferred_cluster_dict, orient="index", columns=["inferred_cluster"]
+    chunksize = max(
+        1000,
+        int(args.memory_limit * 1024**3 * CHUNK_MEMORY_FRACTION / BYTES_PER_DISTANCE_ROW),
     )
-    df_out.reset_index(inplace=True, names=["sample", "inferred_cluster"])
-
-    logging.info(f"Merging to include previous clustering")
-    df_out = df_out.merge(
-        df_previous_clustering[["sample", "curated_cluster"]], on="sample", how="left"
+    logging.info(
+        f"Reading distances in chunks of {chunksize} rows, memory limit {args.memory_limit} GB"
     )
-
-    # if curated_cluster is NaN, replace with inferred_cluster
-    df_out["final_cluster"] = df_out["curated_cluster"].fillna(
-        df_out["inferred_cluster"]
+    df_previous_clustering = read_previous_clustering(args.previous_clustering, store)
+    set_exclude = read_exclude_set(args.exclude_list, store)
+
+    engine = make_engine(args, registry, spill_dir)
+    n_rows = 0
+    memory_exceeded = False
+    for df_chunk in read_distances(args.distances, chunksize):
+        n_rows += len(df_chunk)
+        df_chunk = clean_sample_columns(df_chunk, ["sample1", "sample2"], "_contig1")
+        category_ids = register_samples(df_chunk, registry) if registry is not None else None
+        df_chunk = exclude_sample_set(df_chunk, set_exclude)
+        if summary is not None:
+            summary.update(df_chunk)
+        if forest is not None:
+            forest.update(df_chunk)
+        df_chunk = df_chunk[df_chunk["distance"] <= args.threshold]
+        engine.add_edges(*edge_samples(df_chunk, category_ids))
+        if edges_path is not None:
+            write_edges(df_chunk, edges_path)
+        if not memory_exceeded:
+            memory_exceeded = not check_memory(args.memory_limit)
+    logging.info(
+        f"Kept {engine.n_spilled_edges} of {n_rows} possible edges for {len(engine)} samples"
     )
-
-    df_out.sort_values(by="sample", inplace=True)
-
-    df_out.to_csv(output_path, index=False)
-    logging.info(f"Output written to {output_path}")
+    inferred_cluster_dict = inferred_clusters(engine, df_previous_clustering, registry)
+    return inferred_cluster_dict, df_previous_clustering
 
 
 @timing
 def main(args):
+    if not args.state_db:
+        cluster(args)
+        return
+    with StateStore(args.state_db) as store, tempfile.TemporaryDirectory(
+        prefix="cluster_", dir=args.spill_dir
+    ) as edges_dir:
+        edges_path = Path(edges_dir) / "edges.tsv"
+        edges_path.touch()
+        # clustering only reads the store, so other runs are not locked out meanwhile
+        df_out = cluster(args, store, edges_path)
+        # the edges and clusters of the run are stored at once, or not at all
+        with store.transaction():
+            if edges_path.stat().st_size > 0:
+                for df_edges in read_distances(edges_path, STORE_CHUNK_SIZE):
+                    store.add_distances(df_edges)
+            store.add_run(df_out, args.threshold, args.run_name)
+    # written once the run is stored
+    write_output(df_out, args.output)
+
+
+def cluster(args, store=None, edges_path=None):
+    """
+    Cluster the distances and write the outputs
+
+    With a state store, the edges within the threshold are written to
+    edges_path for it, and clusters.csv is left to the caller.
+    """
+    summary = None
+    if args.neighbours or args.distance_histogram:
+        summary = DistanceSummary(args.threshold, args.max_distance)
+    forest = None
+    if args.spanning_tree:
+        forest = SpanningForest(args.threshold, args.spanning_tree_margin)
+    registry = None
+    if args.sample_registry:
+        registry = (
+            SampleRegistry.load(args.previous_sample_registry, mmap=False)
+            if args.previous_sample_registry
+            else SampleRegistry()
+        )
+        logging.info(f"Clustering samples by their id in a registry of {len(registry)} samples")
+
+    if args.memory_limit is not None:
+        with tempfile.TemporaryDirectory(prefix="cluster_", dir=args.spill_dir) as spill_dir:
+            inferred_cluster_dict, df_previous_clustering = cluster_out_of_core(
+                args, spill_dir, registry, store, summary, forest, edges_path
+            )
+        if summary is not None:
+            summary.write(args.neighbours, args.distance_histogram)
+        df_out = create_output(
+            inferred_cluster_dict, df_previous_clustering, args.output if store is None else None
+        )
+        if forest is not None:
+            forest.write_graphml(df_out, args.spanning_tree)
+        if registry is not None:
+            save_registry(registry, args.sample_registry)
+        return df_out
+
     df_distances, df_previous_clustering = read_data(
-        args.distances, args.previous_clustering
+        args.distances, args.previous_clustering, store
     )
 
     df_distances = clean_sample_columns(
         df_distances, ["sample1", "sample2"], "_contig1"
     )
+    category_ids = None
+    if registry is not None:
+        category_ids = register_samples(df_distances, registry)
 
     if args.exclude_list:
         df_distances = exclude_samples(df_distances, args.exclude_list)
+    elif store is not None:
+        df_distances = exclude_sample_set(df_distances, read_exclude_set(None, store))
 
-    df_nodes = get_df_nodes(df_distances, df_previous_clustering)
+    if summary is not None:
+        summary.update(df_distances)
+        summary.write(args.neighbours, args.distance_histogram)
+    if forest is not None:
+        forest.update(df_distances)
 
     df_distances_filtered = filter_edges(df_distances, args.threshold)
+    if edges_path is not None:
+        write_edges(df_distances_filtered, edges_path)
 
-    G = create_graph(df_distances_filtered, df_nodes)
+    engine = make_engine(args, registry)
+    engine.add_edges(*edge_samples(df_distances_filtered, category_ids))
+    inferred_cluster_dict = inferred_clusters(engine, df_previous_clustering, registry)
 
-    inferred_cluster_dict = infer_clusters(
-        G, args.merged_cluster_separator, args.warnings_path
+    df_out = create_output(
+        inferred_cluster_dict, df_previous_clustering, args.output if store is None else None
     )
-
-    create_output(inferred_cluster_dict, df_previous_clustering, args.output)
+    if forest is not None:
+        forest.write_graphml(df_out, args.spanning_tree)
+    if registry is not None:
+        save_registry(registry, args.sample_registry)
+    return df_out
 
 
-if __name__ == "__main__":
-    import argparse
-
+def parse_args(argv=None):
+    """
+    Parse the arguments of cluster.py, the warnings path defaults to next to the output
+    """
     parser = argparse.ArgumentParser(description="Cluster data")
     parser.add_argument(
         "--previous-clustering", type=Path, help="Path to previous clustering"
@@ -518,10 +598,75 @@ if __name__ == "__main__":
         "--log", type=Path, help="Path to log file", default="cluster.log"
     )
     parser.add_argument("--warnings-path", type=Path, help="Path to warnings file")
+    parser.add_argument(
+        "--sample-registry",
+        type=Path,
+        help="Prefix of the sample registry to write, the samples of the distances are registered and clustered by their integer id",
+    )
+    parser.add_argument(
+        "--previous-sample-registry",
+        type=Path,
+        help="Prefix of the sample registry of the previous run which --sample-registry starts from, if it exists",
+    )
+    parser.add_argument(
+        "--neighbours",
+        type=Path,
+        help="Path to write the nearest neighbour and number of neighbours within the threshold per sample",
+    )
+    parser.add_argument(
+        "--distance-histogram",
+        type=Path,
+        help="Path to write the number of pairs per distance",
+    )
+    parser.add_argument(
+        "--max-distance",
+        type=int,
+        help="Largest distance in the distance histogram, larger distances are counted together",
+    )
+    parser.add_argument(
+        "--spanning-tree",
+        type=Path,
+        help="Path to write the minimum spanning tree of each cluster to (GraphML)",
+    )
+    parser.add_argument(
+        "--spanning-tree-margin",
+        type=float,
+        default=0,
+        help="Also add the shortest edge of each sample to another cluster within threshold + margin to the spanning trees",
+    )
+    parser.add_argument(
+        "--state-db",
+        type=Path,
+        help="Path to a state store (SQLite), the edges and clusters of the run are added to it",
+    )
+    parser.add_argument(
+        "--run-name", type=str, help="Name of the run in the state store"
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=float,
+        help="Memory limit in GB, distances are then read in chunks sized to it and edges kept on disk. The limit is not enforced, a warning is logged if the peak memory use exceeds it",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        type=Path,
+        help="Directory for edges kept on disk with --memory-limit, defaults to the system temporary directory",
+    )
     parser.add_argument(
         "-v", "--verbose", action="count", default=0, help="Verbosity level"
     )
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    if args.warnings_path is None:
+        if args.output == sys.stdout:
+            args.warnings_path = Path("WARNINGS.txt")
+        else:
+            args.warnings_path = args.output.with_suffix(".WARNINGS.txt")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
 
     logging.basicConfig(
         filename=args.log,
@@ -535,11 +680,5 @@ if __name__ == "__main__":
         logging.warning("Threshold not set, using default value of 10")
         args.threshold = 10
 
-    if args.warnings_path is None:
-        if args.output == sys.stdout:
-            args.warnings_path = Path("WARNINGS.txt")
-        else:
-            args.warnings_path = args.output.with_suffix(".WARNINGS.txt")
-
     logging.info(f"Starting clustering")
     main(args)
@@ -0,0 +1,796 @@
+#!/usr/bin/env python3
+
+import logging
+from functools import wraps
+from pathlib import Path
+from time import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+STATE_VERSION = 2
+# rows of edges which are indexed at a time, bounds the memory of indexing spilled edges
+EDGE_INDEX_CHUNK_SIZE = 1 << 20
+
+
+def timing(f):
+    @wraps(f)
+    def wrap(*args, **kw):
+        ts = time()
+        result = f(*args, **kw)
+        te = time()
+        logging.debug(f"func:{f.__name__} took: {te-ts:.4f} sec")
+        return result
+
+    return wrap
+
+
+def flatten_list(nested_list):
+    "Flatten a nested list into a single list"
+    return [item for sublist in nested_list for item in sublist]
+
+
+def emit_and_save_critical_warning(message, output_path):
+    """
+    Emit a warning and save it to a file
+
+    Parameters
+    ----------
+    message : str
+        Warning message
+    output_path : Path
+        Path to output file, if None the warning is only logged
+
+    Returns
+    -------
+    None
+
+    """
+    logging.critical(message)
+    if output_path is not None:
+        with open(output_path, "a") as f:
+            f.write(message + "\n")
+
+
+def construct_merged_cluster_name(set_clusters, separator):
+    """
+    Construct a new cluster name based on the current clusters
+
+    Parameters
+    ----------
+    set_clusters : set
+        Set with clusters
+
+    Returns
+    -------
+    name : str
+        New cluster name
+
+    """
+    logging.debug(f"Constructing merged cluster name")
+    nested_list_unique_clusters = [cluster.split(separator) for cluster in set_clusters]
+    flattened_list_unique_clusters = flatten_list(nested_list_unique_clusters)
+    set_unique_clusters = set(flattened_list_unique_clusters)
+    name = f"{separator.join(sorted(set_unique_clusters))}"
+    return name
+
+
+def construct_new_cluster_name(current_clusters_dict, separator):
+    """
+    Construct a new cluster name based on the current clusters
+
+    Parameters
+    ----------
+    current_clusters_dict : dict
+        Dictionary with samples as keys and clusters as values
+    separator : str
+        Separator for merged clusters
+
+    Returns
+    -------
+    name : str
+        New cluster name
+
+
+    Notes
+    -----
+    Cluster names consist of a prefix (single capital letter), followed by a suffix (three digits).
+
+    The first cluster is A001, the second is A002, and so on.
+
+    If cluster A999 is reached, the next cluster will be B001, and so on.
+
+    This functions checks the current clusters, finds the most recent cluster and returns the next cluster name.
+    """
+    # get all current clusters and split merged cluster names
+    current_cluster_values = list(set(current_clusters_dict.values()))
+    current_clusters = flatten_list(
+        [cluster.split(separator) for cluster in current_cluster_values]
+    )
+
+    # return early if no previous clusters are found
+    if len(current_clusters) == 0:
+        name = "A001"
+        return name
+
+    # find most recent cluster and parse name
+    # most_recent_cluster = sorted(current_clusters)[-1]
+    # find most recent cluster by parse name and exclude Z-range Z938-Z999
+    excluded_range = [c for c in current_clusters if c.startswith("Z") and 936 <= int(c[1:]) <= 999]
+    most_recent_cluster = sorted(c for c in current_clusters if c not in excluded_range)[-1]
+    # most_recent_cluster = sorted(c for c in current_clusters if not (c.startswith("Z") and 936 <= int(c[1:]) <= 999))[-1]
+    first_char = most_recent_cluster[0]
+    number = int(most_recent_cluster[1:])
+
+    # increment the number and first char if needed using ascii code
+    if number == 999:
+        first_char = chr(ord(first_char) + 1)
+        number = 1
+    else:
+        number += 1
+
+    name = f"{first_char}{number:03}"
+    return name
+
+
+def clean_set_clusters(values):
+    """
+    Set of cluster names, without missing values
+    """
+    return set([str(x) for x in values]) - {"nan", "None"}
+
+
+class MergeEvent(NamedTuple):
+    clusters: Tuple[str, ...]
+    cluster: str
+    curated: bool
+
+
+class BatchResult(NamedTuple):
+    changes: Dict[str, Tuple[Optional[str], str]]
+    merges: List[MergeEvent]
+
+
+class SplitEvent(NamedTuple):
+    cluster: str
+    clusters: Tuple[str, ...]
+    removed: Tuple[str, ...]
+
+
+class RemovalResult(NamedTuple):
+    changes: Dict[str, Tuple[Optional[str], Optional[str]]]
+    merges: List[MergeEvent]
+    splits: List[SplitEvent]
+
+
+class ClusterEngine:
+    """
+    Single linkage clustering with stable cluster names.
+
+    Samples are integer ids in order of first appearance in the edges, and
+    clusters are the connected components of a union-find forest over these
+    ids. The edges are kept, so removing samples only recomputes the
+    components they were part of. Edges are indexed by their first sample,
+    so a removal only reads the edges of these components. Components are visited in order of their
+    first appearing sample, which is the order networkx.connected_components
+    yields them in for a graph built from the same edges.
+
+    Clusters of a previous clustering are kept: a component takes the curated
+    cluster of its samples if there is one, otherwise their final cluster.
+    Components with several clusters get a merged name, components without a
+    cluster get a new name.
+
+    Parameters
+    ----------
+    threshold : float
+        Maximum distance of an edge.
+    merged_cluster_separator : str
+        Separator for merged cluster names.
+    warnings_path : Path
+        File which merge warnings are appended to, if set.
+    spill_dir : Path
+        Directory to keep the edges in on disk, instead of in memory. Only
+        the union-find arrays and sample names then grow in memory.
+    sample_ids : bool
+        Samples are integer ids (of a SampleRegistry) instead of names. They
+        index the union-find arrays directly, components are still visited
+        in order of their first appearing sample. Such a state is not saved.
+
+    """
+
+    def __init__(
+        self,
+        threshold=10,
+        merged_cluster_separator="|",
+        warnings_path=None,
+        spill_dir=None,
+        sample_ids=False,
+    ):
+        self.threshold = threshold
+        self.merged_cluster_separator = merged_cluster_separator
+        self.warnings_path = warnings_path
+        self.spill_path = Path(spill_dir) / "edges.int64" if spill_dir else None
+        self.n_spilled_edges = 0
+        self.sample_ids = sample_ids
+        # with sample_ids, samples is the range of ids seen so far
+        self.samples: List[str] = range(0) if sample_ids else []
+        self.index: Dict[str, int] = {}
+        self.parent = np.zeros(0, dtype=np.int64)
+        self.size = np.zeros(0, dtype=np.int64)
+        self.removed = np.zeros(0, dtype=bool)
+        # rank of the first appearance of each sample in the edges, -1 if it has none
+        self.first_seen = np.zeros(0, dtype=np.int64)
+        self.n_seen = 0
+        # edges in rows below the floor of one of their samples were removed with it
+        self.edge_floor = np.zeros(0, dtype=np.int64)
+        self.edges = np.zeros((0, 2), dtype=np.int64)
+        self.inferred: List[Optional[str]] = []
+        # sample -> (curated_cluster, final_cluster) of the previous clustering
+        self.previous: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+
+    def __len__(self):
+        return self.n_seen
+
+    @property
+    def edges(self):
+        "Thresholded adjacency, as pairs of distinct sample ids"
+        if self.spill_path is None:
+            return self._edges
+        if self.n_spilled_edges == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        return np.memmap(
+            self.spill_path, dtype=np.int64, mode="r", shape=(self.n_spilled_edges, 2)
+        )
+
+    @edges.setter
+    def edges(self, edges):
+        self.edge_floor[:] = 0
+        self._edge_index = None
+        if self.spill_path is None:
+            self._edges = edges
+            return
+        # write a new file, the current one may be mapped by edges itself
+        tmp_path = self.spill_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(np.ascontiguousarray(edges, dtype=np.int64).tobytes())
+        tmp_path.replace(self.spill_path)
+        self.n_spilled_edges = len(edges)
+
+    def _append_edges(self, edges):
+        if self.spill_path is None:
+            self._edges = np.concatenate([self._edges, edges])
+            return
+        with open(self.spill_path, "ab") as f:
+            f.write(np.ascontiguousarray(edges, dtype=np.int64).tobytes())
+        self.n_spilled_edges += len(edges)
+
+    def set_previous_clustering(self, df_previous_clustering):
+        """
+        Set the curated and final clusters of a previous clustering
+
+        Parameters
+        ----------
+        df_previous_clustering : pd.DataFrame
+            Dataframe with sample, curated_cluster and final_cluster columns
+
+        """
+        df = df_previous_clustering[["sample", "curated_cluster", "final_cluster"]]
+        df = df.astype(object).where(df.notna(), None)
+        self.previous = {
+            sample: (curated, final)
+            for sample, curated, final in df.itertuples(index=False)
+        }
+
+    def _grow(self, n):
+        if n > len(self.parent):
+            capacity = max(n, 2 * len(self.parent), 1024)
+            self.parent = np.concatenate(
+                [self.parent, np.arange(len(self.parent), capacity, dtype=np.int64)]
+            )
+            self.size = np.concatenate(
+                [self.size, np.ones(capacity - len(self.size), dtype=np.int64)]
+            )
+            self.removed = np.concatenate(
+                [self.removed, np.zeros(capacity - len(self.removed), dtype=bool)]
+            )
+            self.edge_floor = np.concatenate(
+                [self.edge_floor, np.zeros(capacity - len(self.edge_floor), dtype=np.int64)]
+            )
+            self.first_seen = np.concatenate(
+                [self.first_seen, np.full(capacity - len(self.first_seen), -1, dtype=np.int64)]
+            )
+
+    def _build_edge_index(self):
+        """
+        Index the rows of the edges by their first sample (a counting sort)
+
+        The edges are read in chunks, and the index of spilled edges is kept
+        on disk next to them.
+        """
+        edges = self.edges
+        n_edges, n_samples = len(edges), len(self.samples)
+        counts = np.zeros(n_samples, dtype=np.int64)
+        for start in range(0, n_edges, EDGE_INDEX_CHUNK_SIZE):
+            counts += np.bincount(
+                edges[start : start + EDGE_INDEX_CHUNK_SIZE, 0], minlength=n_samples
+            )
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        if self.spill_path is None:
+            rows = np.empty(n_edges, dtype=np.int64)
+        else:
+            rows = np.memmap(
+                self.spill_path.with_name("edge_index.int64"),
+                dtype=np.int64,
+                mode="w+",
+                shape=(max(n_edges, 1),),
+            )
+        cursor = offsets[:-1].copy()
+        for start in range(0, n_edges, EDGE_INDEX_CHUNK_SIZE):
+            first = np.asarray(edges[start : start + EDGE_INDEX_CHUNK_SIZE, 0])
+            order = np.argsort(first, kind="stable")
+            sorted_first = first[order]
+            # rank of each row among the rows of the same sample in this chunk
+            group_start = np.flatnonzero(np.r_[True, sorted_first[1:] != sorted_first[:-1]])
+            group_size = np.diff(np.r_[group_start, len(order)])
+            rank = np.arange(len(order)) - np.repeat(group_start, group_size)
+            rows[cursor[sorted_first] + rank] = start + order
+            cursor += np.bincount(first, minlength=n_samples)
+        self._edge_index = (rows, offsets, n_edges)
+
+    def _edge_rows(self, sample_ids):
+        """
+        Rows of the edges whose first sample is one of sample_ids
+
+        Edges appended after the index was built are scanned, the index is
+        rebuilt once they outnumber the indexed edges.
+        """
+        n_edges = len(self.edges)
+        if self._edge_index is None or n_edges - self._edge_index[2] > self._edge_index[2]:
+            self._build_edge_index()
+        rows, offsets, n_indexed = self._edge_index
+        n_indexed_samples = len(offsets) - 1
+        list_rows = [
+            np.asarray(rows[offsets[i] : offsets[i + 1]])
+            for i in sample_ids
+            if i < n_indexed_samples
+        ]
+        if n_edges > n_indexed:
+            tail = np.asarray(self.edges[n_indexed:, 0])
+            list_rows.append(n_indexed + np.flatnonzero(np.isin(tail, sample_ids)))
+        return np.sort(np.concatenate(list_rows)) if list_rows else np.zeros(0, dtype=np.int64)
+
+    def _ids(self, names):
+        """
+        Ids of sample names, new samples get ids in order of first appearance
+        """
+        codes, uniques = pd.factorize(names)
+        unique_ids = np.empty(len(uniques), dtype=np.int64)
+        n_before = len(self.samples)
+        for i, name in enumerate(uniques):
+            sample_id = self.index.get(name)
+            if sample_id is None:
+                sample_id = len(self.samples)
+                self.index[name] = sample_id
+                self.samples.append(name)
+                self.inferred.append(None)
+            unique_ids[i] = sample_id
+        self._grow(len(self.samples))
+        self.first_seen[n_before : len(self.samples)] = np.arange(n_before, len(self.samples))
+        self.n_seen = len(self.samples)
+        # samples which were removed are clustered again when they are added
+        self.removed[unique_ids] = False
+        return unique_ids[codes]
+
+    def _seen_ids(self, ids):
+        """
+        Sample ids (with sample_ids), new samples are ranked in order of first appearance
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return ids
+        n_ids = max(len(self.samples), int(ids.max()) + 1)
+        self._grow(n_ids)
+        self.inferred.extend([None] * (n_ids - len(self.samples)))
+        self.samples = range(n_ids)
+        unique_ids, first_index = np.unique(ids, return_index=True)
+        is_new = self.first_seen[unique_ids] < 0
+        new_ids = unique_ids[is_new][np.argsort(first_index[is_new], kind="stable")]
+        self.first_seen[new_ids] = self.n_seen + np.arange(len(new_ids))
+        self.n_seen += len(new_ids)
+        self.removed[unique_ids] = False
+        return ids
+
+    def _lookup(self, sample):
+        "Id of a sample, None if it is not known"
+        if not self.sample_ids:
+            return self.index.get(sample)
+        if 0 <= sample < len(self.samples) and self.first_seen[sample] >= 0:
+            return sample
+        return None
+
+    def find(self, sample_id):
+        parent = self.parent
+        while parent[sample_id] != sample_id:
+            parent[sample_id] = parent[parent[sample_id]]
+            sample_id = parent[sample_id]
+        return sample_id
+
+    def _union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        return root_a
+
+    @timing
+    def add_edges(self, sample1, sample2):
+        """
+        Add edges (pairs of samples within the threshold) to the forest
+
+        Parameters
+        ----------
+        sample1, sample2 : Iterable[str]
+            Samples of each edge.
+
+        Returns
+        -------
+        np.ndarray
+            Ids of the samples of all edges.
+
+        """
+        # interleave, so ids follow the order in which samples first appear in the edge list
+        if self.sample_ids:
+            ids = self._seen_ids(np.column_stack([sample1, sample2]).ravel())
+        else:
+            sample1 = np.asarray(sample1, dtype=object)
+            sample2 = np.asarray(sample2, dtype=object)
+            ids = self._ids(np.column_stack([sample1, sample2]).ravel())
+        ids = ids.reshape(-1, 2)
+        new_edges = ids[ids[:, 0] != ids[:, 1]]
+        self._append_edges(new_edges)
+        for a, b in new_edges:
+            self._union(a, b)
+        return ids.ravel()
+
+    def roots(self):
+        return np.array([self.find(i) for i in range(len(self.samples))], dtype=np.int64)
+
+    def components(self, sample_ids=None):
+        """
+        Components (lists of sample ids) in order of their first appearing sample
+
+        Parameters
+        ----------
+        sample_ids : Iterable[int]
+            Only return components containing these samples.
+
+        """
+        roots = self.roots()
+        first_seen = self.first_seen[: len(roots)]
+        ids = np.flatnonzero(~self.removed[: len(roots)] & (first_seen >= 0))
+        order = ids[np.lexsort((first_seen[ids], roots[ids]))]
+        boundaries = np.flatnonzero(np.diff(roots[order])) + 1
+        groups = np.split(order, boundaries) if len(order) else []
+        if sample_ids is not None:
+            set_roots = set(roots[np.asarray(list(sample_ids), dtype=np.int64)])
+            groups = [group for group in groups if roots[group[0]] in set_roots]
+        # samples are in order of first appearance within a group, so group[0] is its first sample
+        return sorted(
+            (group.tolist() for group in groups), key=lambda group: first_seen[group[0]]
+        )
+
+    def _known_cluster(self, sample_id):
+        if self.inferred[sample_id] is not None:
+            return self.inferred[sample_id]
+        return self.previous.get(self.samples[sample_id], (None, None))[1]
+
+    def _assign(self, components, clusters_in_use):
+        """
+        Assign a cluster to each component
+
+        Parameters
+        ----------
+        components : list
+            Components to assign, in order.
+        clusters_in_use : dict
+            Clusters which new names should not collide with, updated in place.
+
+        Returns
+        -------
+        BatchResult
+            Changed assignments and merge events.
+
+        """
+        changes = {}
+        merges = []
+        for list_nodes in components:
+            names = [self.samples[i] for i in list_nodes]
+            set_curated_clusters = clean_set_clusters(
+                self.previous.get(name, (None, None))[0] for name in names
+            )
+            set_final_clusters = clean_set_clusters(
+                self._known_cluster(i) for i in list_nodes
+            )
+            if len(set_curated_clusters) > 1:
+                emit_and_save_critical_warning(
+                    f"WARNING: Curated clusters {set_curated_clusters} have merged!",
+                    self.warnings_path,
+                )
+                inferred_cluster = construct_merged_cluster_name(
+                    set_curated_clusters, self.merged_cluster_separator
+                )
+                merges.append(
+                    MergeEvent(tuple(sorted(set_curated_clusters)), inferred_cluster, True)
+                )
+            elif len(set_curated_clusters) == 1:
+                inferred_cluster = list(set_curated_clusters)[0]
+                logging.warning(
+                    f"Cluster {inferred_cluster} is curated and not merged with others"
+                )
+            elif len(set_final_clusters) > 1:
+                emit_and_save_critical_warning(
+                    f"WARNING: Final clusters {set_final_clusters} have merged!",
+                    self.warnings_path,
+                )
+                inferred_cluster = construct_merged_cluster_name(
+                    set_final_clusters, self.merged_cluster_separator
+                )
+                merges.append(
+                    MergeEvent(tuple(sorted(set_final_clusters)), inferred_cluster, False)
+                )
+            elif len(set_final_clusters) == 1:
+                inferred_cluster = list(set_final_clusters)[0]
+                logging.info(
+                    f"Cluster {inferred_cluster} is known and not merged with others"
+                )
+            else:
+                logging.info(f"Creating new cluster name")
+                inferred_cluster = construct_new_cluster_name(
+                    clusters_in_use, self.merged_cluster_separator
+                )
+                logging.info(
+                    f"New cluster name is {inferred_cluster}, for samples {names}"
+                )
+
+            logging.debug(f"Assigning cluster {inferred_cluster} to samples {names}")
+            for i, name in zip(list_nodes, names):
+                if self.inferred[i] != inferred_cluster:
+                    changes[name] = (self.inferred[i], inferred_cluster)
+                self.inferred[i] = inferred_cluster
+                clusters_in_use[name] = inferred_cluster
+        return BatchResult(changes, merges)
+
+    @timing
+    def infer(self):
+        """
+        Infer clusters of all samples from scratch
+
+        Returns
+        -------
+        inferred_cluster_dict : dict
+            Dictionary with samples as keys and inferred clusters as values
+
+        Notes
+        -----
+        New cluster names follow the clusters of the components visited before,
+        as in a clustering from scratch with the previous clustering.
+
+        """
+        logging.info(f"Starting analysis per subgraph")
+        self.inferred = [None] * len(self.samples)
+        self._assign(self.components(), {})
+        return self.assignments()
+
+    @timing
+    def add_batch(self, sample1, sample2, distances=None):
+        """
+        Add a batch of edges and update the clusters of the affected samples
+
+        Parameters
+        ----------
+        sample1, sample2 : Iterable[str]
+            Samples of each edge, new samples are added.
+        distances : Iterable[float]
+            Distances of each edge, edges above the threshold are skipped. If
+            None, all edges are added.
+
+        Returns
+        -------
+        BatchResult
+            Samples whose cluster changed (old cluster is None for new samples)
+            and the merge events.
+
+        Notes
+        -----
+        Only components touched by the batch are reassigned. Their current
+        clusters count as final clusters, and new cluster names follow all
+        clusters currently in use.
+
+        """
+        sample1 = np.asarray(sample1, dtype=object)
+        sample2 = np.asarray(sample2, dtype=object)
+        if distances is not None:
+            mask = np.asarray(distances) <= self.threshold
+            sample1, sample2 = sample1[mask], sample2[mask]
+        ids = self.add_edges(sample1, sample2)
+        components = self.components(np.unique(ids)) if len(ids) else []
+        clusters_in_use = {
+            name: cluster
+            for name, cluster in zip(self.samples, self.inferred)
+            if cluster is not None
+        }
+        return self._assign(components, clusters_in_use)
+
+    @timing
+    def remove_samples(self, samples):
+        """
+        Remove samples and recompute the components they were part of
+
+        Parameters
+        ----------
+        samples : Iterable[str]
+            Samples to remove, unknown samples are ignored.
+
+        Returns
+        -------
+        RemovalResult
+            Samples whose cluster changed (new cluster is None for removed
+            samples), merge events and split events.
+
+        Notes
+        -----
+        Connectivity is recomputed from the stored edges of the affected
+        components only, which are looked up in the edge index. The first
+        removal builds this index in one pass over the edges. The remaining pieces are assigned as in a clustering
+        from scratch: by the curated and final clusters of the previous
+        clustering, so a piece of a merged cluster gets back the names of its
+        own samples. Pieces without a previous cluster get a new name, which
+        follows all clusters still in use.
+
+        """
+        removed_ids = [
+            sample_id
+            for sample_id in map(self._lookup, dict.fromkeys(samples))
+            if sample_id is not None and not self.removed[sample_id]
+        ]
+        if len(removed_ids) == 0:
+            return RemovalResult({}, [], [])
+        affected = self.components(removed_ids)
+        old_clusters = {i: self.inferred[i] for component in affected for i in component}
+        members = np.array(list(old_clusters), dtype=np.int64)
+
+        logging.info(
+            f"Removing {len(removed_ids)} samples, recomputing {len(affected)} clusters"
+        )
+        self.removed[removed_ids] = True
+        # the edges stay on disk, they are skipped until the sample is added again
+        self.edge_floor[removed_ids] = len(self.edges)
+        self.parent[members] = members
+        self.size[members] = 1
+        for i in members:
+            self.inferred[i] = None
+        # edges never cross components, so the first sample in the affected components is enough
+        rows = self._edge_rows(members)
+        edges = np.asarray(self.edges[rows])
+        live = (rows >= self.edge_floor[edges[:, 0]]) & (rows >= self.edge_floor[edges[:, 1]])
+        for a, b in edges[live]:
+            self._union(a, b)
+
+        remaining = members[~self.removed[members]]
+        pieces = self.components(remaining) if len(remaining) else []
+        merges = self._assign(pieces, self.assignments()).merges
+
+        changes = {}
+        for i, old_cluster in old_clusters.items():
+            if self.inferred[i] != old_cluster:
+                changes[self.samples[i]] = (old_cluster, self.inferred[i])
+        splits = []
+        for component in affected:
+            piece_clusters = sorted(
+                set(self.inferred[i] for i in component if not self.removed[i])
+            )
+            if len(piece_clusters) > 1:
+                cluster = old_clusters[component[0]]
+                logging.warning(f"Cluster {cluster} has split into {piece_clusters}")
+                splits.append(
+                    SplitEvent(
+                        cluster,
+                        tuple(piece_clusters),
+                        tuple(self.samples[i] for i in component if self.removed[i]),
+                    )
+                )
+        return RemovalResult(changes, merges, splits)
+
+    def assignments(self):
+        """
+        Dictionary with samples as keys and inferred clusters as values
+        """
+        return {
+            name: cluster
+            for name, cluster in zip(self.samples, self.inferred)
+            if cluster is not None
+        }
+
+    @timing
+    def save(self, path):
+        """
+        Save the state as a compressed numpy archive (.npz)
+
+        Sample and cluster names are stored as fixed width strings, clusters
+        by their index in a vocabulary of all cluster names (-1 if missing).
+        """
+        if self.sample_ids:
+            raise ValueError("The state of an engine on sample ids is not saved")
+        previous_samples = list(self.previous)
+        curated = [self.previous[sample][0] for sample in previous_samples]
+        final = [self.previous[sample][1] for sample in previous_samples]
+        vocabulary = sorted(clean_set_clusters(self.inferred + curated + final))
+        code = {cluster: i for i, cluster in enumerate(vocabulary)}
+
+        def encode(values):
+            return np.array([code.get(value, -1) for value in values], dtype=np.int64)
+
+        n = len(self.samples)
+        edges = np.asarray(self.edges)
+        rows = np.arange(len(edges))
+        # edges of removed samples are dropped here instead of on removal
+        live = (rows >= self.edge_floor[edges[:, 0]]) & (rows >= self.edge_floor[edges[:, 1]])
+        np.savez_compressed(
+            path,
+            version=np.array(STATE_VERSION),
+            threshold=np.array(self.threshold, dtype=float),
+            merged_cluster_separator=np.array(self.merged_cluster_separator),
+            samples=np.array(self.samples, dtype=str),
+            parent=self.parent[:n],
+            size=self.size[:n],
+            removed=self.removed[:n],
+            edges=edges[live],
+            inferred=encode(self.inferred),
+            vocabulary=np.array(vocabulary, dtype=str),
+            previous_samples=np.array(previous_samples, dtype=str),
+            previous_curated=encode(curated),
+            previous_final=encode(final),
+        )
+
+    @classmethod
+    @timing
+    def load(cls, path, warnings_path=None):
+        """
+        Load a state saved with save
+        """
+        with np.load(path, allow_pickle=False) as state:
+            if int(state["version"]) != STATE_VERSION:
+                raise ValueError(
+                    f"Unsupported state version {int(state['version'])} in {path}"
+                )
+            engine = cls(
+                float(state["threshold"]),
+                str(state["merged_cluster_separator"]),
+                warnings_path,
+            )
+            vocabulary = state["vocabulary"].tolist()
+
+            def decode(codes):
+                return [vocabulary[c] if c >= 0 else None for c in codes.tolist()]
+
+            engine.samples = state["samples"].tolist()
+            engine.index = {name: i for i, name in enumerate(engine.samples)}
+            engine.parent = state["parent"].astype(np.int64)
+            engine.size = state["size"].astype(np.int64)
+            engine.removed = state["removed"].astype(bool)
+            engine.edge_floor = np.zeros(len(engine.parent), dtype=np.int64)
+            engine.first_seen = np.arange(len(engine.parent), dtype=np.int64)
+            engine.n_seen = len(engine.samples)
+            engine.edges = state["edges"].astype(np.int64).reshape(-1, 2)
+            engine.inferred = decode(state["inferred"])
+            engine.previous = dict(
+                zip(
+                    state["previous_samples"].tolist(),
+                    zip(decode(state["previous_curated"]), decode(state["previous_final"])),
+                )
+            )
+        return engine
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from cluster import (
+    clean_sample_columns,
+    create_output,
+    exclude_samples,
+    filter_edges,
+    read_data,
+    read_exclude_list,
+)
+from cluster_engine import ClusterEngine, timing
+
+FIXED_STRING = "_contig1"
+
+
+class ClusterService:
+    """
+    Clustering state of a run, which is updated one sample at a time
+
+    Parameters
+    ----------
+    engine : ClusterEngine
+        Clustering state.
+    output : Path
+        Path to write clusters.csv to at a checkpoint.
+    state_path : Path
+        Path to write the engine state to at a checkpoint.
+    exclude : set
+        Samples which are not clustered.
+
+    Notes
+    -----
+    Samples should be added in the order of the alignment, with their
+    distances to samples added before. Each sample gets a distance of 0 to
+    itself, as in the distances of snp-dists. The engine then sees samples in
+    the same order as the batch path does.
+
+    Names of new clusters are provisional until a checkpoint. A checkpoint
+    infers all clusters from scratch, which gives the clusters of the batch
+    path.
+
+    """
+
+    def __init__(self, engine, output, state_path, exclude=()):
+        self.engine = engine
+        self.output = output
+        self.state_path = state_path
+        self.exclude = set(exclude)
+        self.lock = threading.Lock()
+        self.dirty = False
+
+    @classmethod
+    @timing
+    def from_run(cls, args):
+        """
+        Load the state of a checkpoint, or cluster the distances of a run
+        """
+        exclude = read_exclude_list(args.exclude_list) if args.exclude_list else set()
+        if args.state and Path(args.state).exists():
+            logging.info(f"Loading state from {args.state}")
+            engine = ClusterEngine.load(args.state, args.warnings_path)
+            return cls(engine, args.output, args.state, exclude)
+
+        engine = ClusterEngine(
+            args.threshold, args.merged_cluster_separator, args.warnings_path
+        )
+        if args.distances:
+            df_distances, df_previous_clustering = read_data(
+                args.distances, args.previous_clustering
+            )
+            df_distances = clean_sample_columns(
+                df_distances, ["sample1", "sample2"], FIXED_STRING
+            )
+            if args.exclude_list:
+                df_distances = exclude_samples(df_distances, args.exclude_list)
+            df_distances = filter_edges(df_distances, args.threshold)
+            engine.set_previous_clustering(df_previous_clustering)
+            engine.add_edges(df_distances["sample1"], df_distances["sample2"])
+        elif args.previous_clustering:
+            engine.set_previous_clustering(
+                pd.read_csv(args.previous_clustering, dtype=str)
+            )
+        engine.infer()
+        return cls(engine, args.output, args.state, exclude)
+
+    def is_registered(self, sample):
+        "Whether a sample was clustered and not removed"
+        sample_id = self.engine.index.get(sample)
+        return sample_id is not None and not self.engine.removed[sample_id]
+
+    def add(self, sample, distances):
+        """
+        Add a sample with its distances to other samples
+
+        Samples can only be added once, and only with distances to samples
+        which were added before (distances to excluded samples are ignored).
+
+        Parameters
+        ----------
+        sample : str
+            Sample to add.
+        distances : dict
+            Distances of the sample to other samples.
+
+        Returns
+        -------
+        dict
+            Changed assignments as [old, new] per sample and merge events.
+
+        Raises
+        ------
+        ValueError
+            If the sample is excluded or was already added, or if a distance
+            is to a sample which was not added.
+
+        """
+        sample = sample.replace(FIXED_STRING, "")
+        if sample in self.exclude:
+            raise ValueError(f"Sample {sample} is excluded")
+        others = [other.replace(FIXED_STRING, "") for other in distances]
+        pairs = [
+            (other, distance)
+            for other, distance in zip(others, distances.values())
+            if other not in self.exclude and other != sample
+        ]
+        sample1 = [sample] * (len(pairs) + 1)
+        sample2 = [sample] + [other for other, _ in pairs]
+        values = [0] + [distance for _, distance in pairs]
+        with self.lock:
+            if self.is_registered(sample):
+                raise ValueError(f"Sample {sample} was already added")
+            unknown = sorted({other for other, _ in pairs if not self.is_registered(other)})
+            if unknown:
+                raise ValueError(
+                    f"Distances of {sample} to {len(unknown)} unknown samples, e.g. {unknown[0]}"
+                )
+            result = self.engine.add_batch(sample1, sample2, values)
+            self.dirty = True
+        logging.info(f"Added sample {sample}, {len(result.changes)} assignments changed")
+        return {
+            "changes": {name: list(change) for name, change in result.changes.items()},
+            "merges": [merge._asdict() for merge in result.merges],
+        }
+
+    def remove(self, samples):
+        """
+        Remove samples, for example when they are excluded after curation
+
+        Parameters
+        ----------
+        samples : list
+            Samples to remove, these are excluded from then on.
+
+        Returns
+        -------
+        dict
+            Changed assignments as [old, new] per sample, merge and split
+            events.
+
+        """
+        samples = [sample.replace(FIXED_STRING, "") for sample in samples]
+        with self.lock:
+            self.exclude.update(samples)
+            result = self.engine.remove_samples(samples)
+            self.dirty = True
+        logging.info(
+            f"Removed {len(samples)} samples, {len(result.splits)} clusters have split"
+        )
+        return {
+            "changes": {name: list(change) for name, change in result.changes.items()},
+            "merges": [merge._asdict() for merge in result.merges],
+            "splits": [split._asdict() for split in result.splits],
+        }
+
+    def query(self, samples=None):
+        """
+        Current clusters of samples, or of all samples if None
+        """
+        with self.lock:
+            assignments = self.engine.assignments()
+        if samples is None:
+            return {"clusters": assignments}
+        return {"clusters": {sample: assignments.get(sample) for sample in samples}}
+
+    @timing
+    def checkpoint(self):
+        """
+        Infer all clusters from scratch and write clusters.csv and the state
+
+        Returns
+        -------
+        dict
+            Assignments which changed by inferring from scratch.
+
+        """
+        with self.lock:
+            before = self.engine.assignments()
+            # merges were reported to the warnings file when samples were added
+            warnings_path, self.engine.warnings_path = self.engine.warnings_path, None
+            try:
+                after = self.engine.infer()
+            finally:
+                self.engine.warnings_path = warnings_path
+            df_previous_clustering = pd.DataFrame(
+                [
+                    (sample, curated)
+                    for sample, (curated, _) in self.engine.previous.items()
+                ],
+                columns=["sample", "curated_cluster"],
+            )
+            if self.output:
+                write_atomic(
+                    self.output,
+                    lambda path: create_output(after, df_previous_clustering, path),
+                )
+            if self.state_path:
+                write_atomic(self.state_path, self.engine.save)
+            self.dirty = False
+        changes = {
+            sample: [before.get(sample), cluster]
+            for sample, cluster in after.items()
+            if before.get(sample) != cluster
+        }
+        logging.info(f"Checkpoint written, {len(changes)} assignments changed")
+        return {"changes": changes}
+
+    def handle(self, request):
+        op = request.get("op")
+        if op == "add":
+            return self.add(request["sample"], request.get("distances", {}))
+        if op == "remove":
+            return self.remove(request["samples"])
+        if op == "query":
+            return self.query(request.get("samples"))
+        if op == "checkpoint":
+            return self.checkpoint()
+        raise ValueError(f"Unknown op {op}")
+
+
+def write_atomic(path, write):
+    "Write a file next to path and move it in place, so readers never see a partial file"
+    path = Path(path)
+    # keep the suffix, numpy adds .npz to paths without it
+    tmp_path = path.with_name(f".{path.stem}.tmp{path.suffix}")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles newline delimited JSON requests, one JSON response per request
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if request.get("op") == "shutdown":
+                    response = {"ok": True}
+                    threading.Thread(target=self.server.shutdown).start()
+                else:
+                    response = {"ok": True, **self.server.service.handle(request)}
+            except Exception as e:
+                logging.exception("Request failed")
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+
+
+class ClusterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        self.service = service
+        super().__init__(str(socket_path), RequestHandler)
+
+
+def checkpoint_periodically(service, interval, stopped):
+    while not stopped.wait(interval):
+        if service.dirty:
+            service.checkpoint()
+
+
+def send_request(socket_path, request):
+    """
+    Send a request to a running server and return its response
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall((json.dumps(request) + "\n").encode())
+        response = sock.makefile("r").readline()
+    return json.loads(response)
+
+
+def serve(service, socket_path, checkpoint_interval):
+    socket_path = Path(socket_path)
+    if socket_path.exists():
+        socket_path.unlink()
+    stopped = threading.Event()
+    checkpointer = threading.Thread(
+        target=checkpoint_periodically,
+        args=(service, checkpoint_interval, stopped),
+        daemon=True,
+    )
+    checkpointer.start()
+    with ClusterServer(socket_path, service) as server:
+        logging.info(f"Listening on {socket_path}")
+        try:
+            server.serve_forever()
+        finally:
+            stopped.set()
+            if service.dirty:
+                service.checkpoint()
+            socket_path.unlink(missing_ok=True)
+
+
+def parse_args(argv=None):
+    """
+    Parse the arguments of cluster_server.py, the warnings path defaults to next to the output
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve clustering of a run over a Unix socket, adding one sample at a time"
+    )
+    parser.add_argument("--socket", type=Path, help="Path to Unix socket", required=True)
+    parser.add_argument(
+        "--state", type=Path, help="Path to engine state (.npz), loaded if it exists"
+    )
+    parser.add_argument(
+        "--previous-clustering", type=Path, help="Path to previous clustering"
+    )
+    parser.add_argument("--distances", type=Path, help="Path to distances of the run")
+    parser.add_argument(
+        "--output", type=Path, help="Path to clusters.csv written at checkpoints"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="Threshold to consider two isolates part of the same cluster",
+    )
+    parser.add_argument(
+        "--merged-cluster-separator",
+        type=str,
+        help="Separator for merged clusters",
+        default="|",
+    )
+    parser.add_argument(
+        "--exclude-list",
+        type=Path,
+        help="Path to list of samples to exclude from clustering",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        default=300,
+        help="Seconds between checkpoints, if samples were added",
+    )
+    parser.add_argument(
+        "--log", type=Path, help="Path to log file", default="cluster_server.log"
+    )
+    parser.add_argument("--warnings-path", type=Path, help="Path to warnings file")
+    parser.add_argument(
+        "-v", "--verbose", action="count", default=0, help="Verbosity level"
+    )
+    args = parser.parse_args(argv)
+
+    if args.warnings_path is None and args.output is not None:
+        args.warnings_path = args.output.with_suffix(".WARNINGS.txt")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    logging.basicConfig(
+        filename=args.log,
+        filemode="a",
+        format="%(asctime)s %(filename)s %(levelname)s %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        level=logging.DEBUG if args.verbose > 0 else logging.INFO,
+    )
+
+    service = ClusterService.from_run(args)
+    try:
+        serve(service, args.socket, args.checkpoint_interval)
+    except KeyboardInterrupt:
+        sys.exit(0)
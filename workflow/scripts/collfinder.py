@@ -5,10 +5,9 @@ import os
 import ssl
 import sys
 import logging
-from irods.column import Criterion
+from irods.column import Criterion, In
 from irods.session import iRODSSession
 from irods.models import Collection, CollectionMeta
-from irods.exception import CollectionDoesNotExist
 
 def irodsConnect(irodsfile="", use_ssl = False):
     '''
@@ -32,6 +31,89 @@ def irodsConnect(irodsfile="", use_ssl = False):
         session = iRODSSession(irods_env_file=envFile)
     return session
 
+# Maximum number of collection names in a single 'in' condition of a GenQuery
+IN_BATCH_SIZE = 50
+
+def parse_avu(meta, option):
+    '''
+    Split an attr=value option, return None if it is malformed
+    '''
+    try:
+        attr, value = meta.split('=', 1)
+    except ValueError:
+        logging.warning('Invalid %s format (should be key=value): %s', option, meta)
+        return None
+    return attr, value
+
+def get_collection_metadata(irods_session, collection):
+    '''
+    Return the AVUs of a collection as a dict, in a single query
+    '''
+    query = irods_session.query(CollectionMeta.name, CollectionMeta.value).filter(
+        Criterion('=', Collection.name, collection))
+    return { q[CollectionMeta.name]: q[CollectionMeta.value] for q in query }
+
+def find_collections_with_avu(irods_session, attr, value):
+    '''
+    Return the names of all collections with AVU attr=value, in a single query
+    '''
+    query = irods_session.query(Collection.name).filter(
+        Criterion('=', CollectionMeta.name, attr)).filter(
+        Criterion('=', CollectionMeta.value, value))
+    return { q[Collection.name] for q in query }
+
+def get_avu_values(irods_session, collections, attr):
+    '''
+    Return the values of attr per collection, in one query per IN_BATCH_SIZE collections
+    '''
+    collections = sorted(collections)
+    values = {}
+    for i in range(0, len(collections), IN_BATCH_SIZE):
+        query = irods_session.query(Collection.name, CollectionMeta.value).filter(
+            In(Collection.name, collections[i:i + IN_BATCH_SIZE])).filter(
+            Criterion('=', CollectionMeta.name, attr))
+        for q in query:
+            values.setdefault(q[Collection.name], []).append(q[CollectionMeta.value])
+    return values
+
+def find_previous_collection(irods_session, input_meta, match_attr, run_number_attr,
+                             extra_metadata=(), extra_metadata_not=()):
+    '''
+    Find the collection with the latest run number which matches the input metadata
+
+    Every AVU which should (not) match is a single query on the iCAT and the results are
+    combined as sets. Only the run numbers of the remaining candidates are fetched, in batches.
+    Run numbers are compared as numbers, which GenQuery cannot order by, so the latest run
+    is selected here.
+    '''
+    required_avus = [ (attr, input_meta[attr]) for attr in match_attr ]
+    required_avus += [ avu for avu in (parse_avu(meta, 'extra_metadata') for meta in extra_metadata) if avu ]
+    excluded_avus = [ avu for avu in (parse_avu(meta, 'extra_metadata_not') for meta in extra_metadata_not) if avu ]
+
+    candidates = None
+    for attr, value in required_avus:
+        collections = find_collections_with_avu(irods_session, attr, value)
+        candidates = collections if candidates is None else candidates & collections
+        if not candidates:
+            return None
+    for attr, value in excluded_avus:
+        candidates -= find_collections_with_avu(irods_session, attr, value)
+    logging.info('Found %d candidate collections', len(candidates))
+
+    run_number_found = -1
+    previous_collection = None
+    for c, values in sorted(get_avu_values(irods_session, candidates, run_number_attr).items()):
+        for value in values:
+            try:
+                current_run_number = int(float(value))
+            except Exception as e:
+                logging.warning('Failed to convert run number for collection %s: %s', c, str(e))
+                continue
+            if current_run_number > run_number_found: #if current input collection timestamp is later than previous found timestamp
+                previous_collection = c
+                run_number_found = current_run_number
+    return previous_collection
+
 def collfinder():
     parser = argparse.ArgumentParser(description='Find report collection based on metadata parameters')
     parser.add_argument('-i', '--input_collection', help='Input collection', required=True)
@@ -56,13 +138,11 @@ def collfinder():
         irods_session = irodsConnect(use_ssl=args.use_ssl)
         logging.info(f"Connected to iRODS. Input collection: {args.input_collection}")
 
-        # Get input collection and its metadata
-        try:
-            input_collection = irods_session.collections.get(args.input_collection)
-        except CollectionDoesNotExist:
-            logging.error('Input collection not found: %s', args.input_collection)
+        # Get metadata of input collection
+        input_meta = get_collection_metadata(irods_session, args.input_collection)
+        if not input_meta:
+            logging.error('Input collection not found or without metadata: %s', args.input_collection)
             return False
-        input_meta = { x.name: x.value for x in input_collection.metadata.items()}
         logging.info(f"Fetched metadata for input collection: {args.input_collection}")
 
         # Verify if all match attributes are on input collection
@@ -82,81 +162,14 @@ def collfinder():
             logging.error('Failed to convert run number attribute %s to int: %s', args.run_number_attr, str(e))
             return False
 
-        # Difficult to match to multiple AVUs in one query. Start with first match attribute
-        attr = args.match_attr[0]
-        value = input_meta[attr]
         try:
-            query = irods_session.query(Collection.name).filter(
-                Criterion('=', CollectionMeta.name, attr)).filter(
-                Criterion('=', CollectionMeta.value, value))
-            result_set = { q[Collection.name]: None for q in query }
+            previous_collection = find_previous_collection(
+                irods_session, input_meta, args.match_attr, args.run_number_attr,
+                args.extra_metadata, args.extra_metadata_not)
         except Exception as e:
             logging.error('Error querying collections: %s', str(e))
             return False
 
-        # Store metadata for result set
-        for c in result_set:
-            try:
-                result_set[c] = { m.name: m.value for m in irods_session.collections.get(c).metadata.items() }
-            except Exception as e:
-                logging.warning('Could not fetch metadata for collection %s: %s', c, str(e))
-                result_set[c] = None
-
-        for attr in args.match_attr[1:]:
-            for c in result_set:
-                if result_set[c]:
-                    if attr not in result_set[c]:
-                        result_set[c] = None
-                        continue
-                    if result_set[c][attr] != input_meta[attr]:
-                        result_set[c] = None
-
-        for meta in args.extra_metadata:
-            try:
-                attr, value = meta.split('=', 1)
-            except ValueError:
-                logging.warning('Invalid extra_metadata format (should be key=value): %s', meta)
-                continue
-            for c in result_set:
-                if result_set[c]:
-                    if attr not in result_set[c]:
-                        result_set[c] = None
-                        continue
-                    if result_set[c][attr] != value:
-                        result_set[c] = None
-
-        for meta in args.extra_metadata_not:
-            try:
-                attr, value = meta.split('=', 1)
-            except ValueError:
-                logging.warning('Invalid extra_metadata_not format (should be key=value): %s', meta)
-                continue
-            for c in result_set:
-                if not result_set[c]:
-                    # print(f'input_collection: {c}, result: {result_set[c]}')
-                    # print(result_set[c])
-                    continue
-                if result_set[c].get(attr) == value:
-                    # print(f'input_collection: {c}, value: {value}')
-                    result_set[c] = None
-                    continue
-
-        # Find the previous run number
-        run_number_found = -1
-        previous_collection = None
-        for c in result_set:
-            if result_set[c]:
-                if args.run_number_attr in result_set[c]:
-                    try:
-                        current_run_number = int(float(result_set[c][args.run_number_attr]))
-                    except Exception as e:
-                        logging.warning('Failed to convert run number for collection %s: %s', c, str(e))
-                        continue
-                    # if current_run_number < run_number and current_run_number > run_number_found:
-                    if current_run_number > run_number_found: #if current input collection timestamp is later than previous found timestamp
-                        previous_collection = c
-                        run_number_found = current_run_number
-
         if previous_collection is not None:
             logging.info(f"Previous collection found: {previous_collection}")
             print(previous_collection)
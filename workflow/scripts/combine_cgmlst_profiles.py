@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+import gzip
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Allele calls which do not represent an allele (chewBBACA classifications and
+# commonly used placeholders). These are stored as MISSING.
+MISSING_CALLS = {
+    "",
+    "-",
+    "0",
+    "ALM",
+    "ASM",
+    "EXC",
+    "LNF",
+    "LOTSC",
+    "NIPH",
+    "NIPHEM",
+    "PAMA",
+    "PLNF",
+    "PLOT3",
+    "PLOT5",
+}
+MISSING = 0
+MISSING_EXPORT = "-"
+# rows of the allele matrix parsed at once
+READ_CHUNK_SIZE = 1000
+
+
+class AlleleCodebook:
+    """
+    Per-locus mapping of hashed allele calls to small integer codes.
+
+    Allele calls (allele numbers or hashes of allele sequences) are hashed to
+    64 bit integers, which are mapped to consecutive codes per locus. Code 0 is
+    reserved for missing data. Codes are only ever appended, so a code keeps
+    its meaning across runs as long as the codebook is carried along.
+    """
+
+    def __init__(self, loci: List[str]):
+        self.loci = list(loci)
+        self.codes: List[Dict[int, int]] = [{} for _ in self.loci]
+
+    @staticmethod
+    def hash_allele(allele: str) -> int:
+        return int.from_bytes(
+            hashlib.blake2b(allele.encode(), digest_size=8).digest(), "big"
+        )
+
+    @staticmethod
+    def normalise_call(call: str) -> Optional[str]:
+        """
+        Return the allele of a call, or None if the call is missing.
+
+        Inferred alleles (INF-123) are the same allele as 123.
+        """
+        call = str(call).strip()
+        if call.startswith("INF-"):
+            call = call[4:]
+        if call in MISSING_CALLS or call.lower() == "nan":
+            return None
+        return call
+
+    def encode(self, locus_index: int, call: str) -> int:
+        allele = self.normalise_call(call)
+        if allele is None:
+            return MISSING
+        locus_codes = self.codes[locus_index]
+        allele_hash = self.hash_allele(allele)
+        code = locus_codes.get(allele_hash)
+        if code is None:
+            code = len(locus_codes) + 1
+            locus_codes[allele_hash] = code
+        return code
+
+    @property
+    def max_code(self) -> int:
+        return max([len(locus_codes) for locus_codes in self.codes], default=0)
+
+    def to_tsv(self, path: Path) -> None:
+        logging.info(f"Writing allele codebook to {path}.")
+        with gzip.open(path, "wt") as f:
+            f.write("locus\thash\tcode\n")
+            for locus, locus_codes in zip(self.loci, self.codes):
+                for allele_hash, code in locus_codes.items():
+                    f.write(f"{locus}\t{allele_hash:016x}\t{code}\n")
+
+    @classmethod
+    def from_tsv(cls, path: Path, loci: List[str]) -> "AlleleCodebook":
+        logging.info(f"Reading allele codebook from {path}.")
+        codebook = cls(loci)
+        locus_index = {locus: i for i, locus in enumerate(loci)}
+        df = pd.read_csv(path, sep="\t", dtype={"locus": str, "hash": str})
+        for locus, allele_hash, code in df.itertuples(index=False):
+            codebook.codes[locus_index[locus]][int(allele_hash, 16)] = int(code)
+        return codebook
+
+
+def smallest_dtype(max_code: int) -> np.dtype:
+    """
+    Return the smallest unsigned integer type which can hold max_code.
+    """
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if max_code <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def read_allele_matrix(path: Path) -> Tuple[List[str], List[str], np.ndarray]:
+    """
+    Read an encoded allele matrix (cgmlst_alleles.tsv.gz).
+
+    Parameters
+    ----------
+    path : Path
+        Path to the allele matrix, with samples as rows and loci as columns.
+
+    Returns
+    -------
+    Tuple[List[str], List[str], np.ndarray]
+        Sample names, loci and the matrix of allele codes.
+
+    """
+    logging.info(f"Reading allele matrix {path}.")
+    header = pd.read_csv(path, sep="\t", index_col=0, nrows=0)
+    loci = header.columns.tolist()
+    # the codes are parsed per column as uint32 and narrowed per chunk of rows,
+    # so a full int64 matrix is never built
+    dtype = {locus: np.uint32 for locus in loci}
+    dtype[header.index.name] = str
+    samples = []
+    chunks = []
+    reader = pd.read_csv(
+        path, sep="\t", index_col=0, dtype=dtype, chunksize=READ_CHUNK_SIZE
+    )
+    for df in reader:
+        chunk = df.to_numpy()
+        samples.extend(df.index.astype(str))
+        chunks.append(chunk.astype(smallest_dtype(int(chunk.max(initial=0)))))
+    dtype = smallest_dtype(max([int(chunk.max(initial=0)) for chunk in chunks], default=0))
+    matrix = np.concatenate([np.zeros((0, len(loci)), dtype=dtype)] + chunks, dtype=dtype)
+    logging.info(f"Found {matrix.shape[0]} samples and {matrix.shape[1]} loci.")
+    return samples, loci, matrix
+
+
+def write_allele_matrix(
+    path: Path,
+    samples: List[str],
+    loci: List[str],
+    matrix: np.ndarray,
+    missing: Optional[str] = None,
+) -> None:
+    """
+    Write an allele matrix as TSV, compressed if the path ends in .gz.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the output file.
+    samples : List[str]
+        Sample names (rows).
+    loci : List[str]
+        Loci (columns).
+    matrix : np.ndarray
+        Matrix of allele codes.
+    missing : Optional[str]
+        If set, write missing codes as this string instead of 0.
+
+    """
+    logging.info(f"Writing allele matrix of {len(samples)} samples to {path}.")
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "wt") as f:
+        f.write("\t".join(["FILE"] + loci) + "\n")
+        for sample, row in zip(samples, matrix):
+            values = row.astype(str)
+            if missing is not None:
+                values[row == MISSING] = missing
+            f.write(sample + "\t" + "\t".join(values) + "\n")
+
+
+def read_profile(filepath: Path) -> pd.DataFrame:
+    """
+    Read a per-sample allele profile.
+
+    Parameters
+    ----------
+    filepath : Path
+        Path to a tab separated allele profile, with sample names in the first
+        column and one column per locus (e.g. results_alleles.tsv of chewBBACA).
+
+    Returns
+    -------
+    pd.DataFrame
+        Allele calls as strings, indexed by sample.
+
+    """
+    logging.debug(f"Reading allele profile {filepath}.")
+    df = pd.read_csv(filepath, sep="\t", index_col=0, dtype=str, keep_default_na=False)
+    df.index = [Path(str(sample)).stem for sample in df.index]
+    return df
+
+
+def encode_profiles(
+    new_input: List[Path],
+    codebook: AlleleCodebook,
+    list_already_present: List[str],
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Encode new allele profiles with the codebook.
+
+    Parameters
+    ----------
+    new_input : List[Path]
+        List of paths to allele profiles.
+    codebook : AlleleCodebook
+        Codebook which is extended with unseen alleles.
+    list_already_present : List[str]
+        List of samples already present in the previous allele matrix.
+
+    Returns
+    -------
+    Tuple[List[str], np.ndarray]
+        List of new samples and their encoded profiles.
+
+    Raises
+    ------
+    ValueError
+        If a profile does not contain the same loci as the codebook.
+
+    """
+    set_already_present = set(list_already_present)
+    list_new_names = []
+    list_new_rows = []
+    for file in new_input:
+        df = read_profile(file)
+        missing_loci = set(codebook.loci) - set(df.columns)
+        if missing_loci:
+            raise ValueError(
+                f"Allele profile {file} lacks {len(missing_loci)} loci of the scheme, e.g. {sorted(missing_loci)[0]}."
+            )
+        df = df[codebook.loci]
+        for sample, calls in zip(df.index, df.itertuples(index=False)):
+            if sample in set_already_present:
+                logging.warning(f"Sample {sample} already in allele matrix. Skipping.")
+                continue
+            row = np.fromiter(
+                (codebook.encode(i, call) for i, call in enumerate(calls)),
+                dtype=np.uint32,
+                count=len(codebook.loci),
+            )
+            n_missing = int((row == MISSING).sum())
+            logging.info(f"Sample {sample}: {n_missing} missing loci.")
+            list_new_names.append(sample)
+            list_new_rows.append(row)
+            set_already_present.add(sample)
+    logging.info(f"Selected {len(list_new_names)} profiles to add to allele matrix.")
+    new_matrix = np.zeros((len(list_new_rows), len(codebook.loci)), dtype=np.uint32)
+    if list_new_rows:
+        new_matrix = np.vstack(list_new_rows)
+    return list_new_names, new_matrix
+
+
+def main(args) -> None:
+    if args.previous_alleles:
+        samples, loci, matrix = read_allele_matrix(args.previous_alleles)
+        codebook = AlleleCodebook.from_tsv(args.previous_codebook, loci)
+    else:
+        loci = read_profile(args.new_input[0]).columns.tolist()
+        samples = []
+        matrix = np.zeros((0, len(loci)), dtype=np.uint8)
+        codebook = AlleleCodebook(loci)
+    list_new_names, new_matrix = encode_profiles(args.new_input, codebook, samples)
+    dtype = smallest_dtype(codebook.max_code)
+    matrix = np.vstack([matrix.astype(dtype), new_matrix.astype(dtype)])
+    samples = samples + list_new_names
+    logging.info(
+        f"Allele matrix of {matrix.shape[0]} samples and {matrix.shape[1]} loci uses {matrix.nbytes} bytes ({dtype})."
+    )
+
+    write_allele_matrix(args.output, samples, loci, matrix)
+    codebook.to_tsv(args.output_codebook)
+    if args.output_profiles:
+        write_allele_matrix(
+            args.output_profiles, samples, loci, matrix, missing=MISSING_EXPORT
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Check and add cgMLST allele profiles to an allele matrix."
+    )
+
+    parser.add_argument(
+        "--previous-alleles",
+        type=Path,
+        metavar="STR",
+        help="Path to previous allele matrix (cgmlst_alleles.tsv.gz).",
+    )
+    parser.add_argument(
+        "--previous-codebook",
+        type=Path,
+        metavar="STR",
+        help="Path to allele codebook of the previous allele matrix.",
+    )
+    parser.add_argument(
+        "--new-input",
+        type=Path,
+        metavar="STR",
+        help="Path to new allele profiles.",
+        nargs="+",
+        default=[],
+    )
+    parser.add_argument(
+        "--new-input-manifest",
+        type=Path,
+        metavar="STR",
+        help="Path to a file listing new allele profiles, one path per line.",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        metavar="STR",
+        help="Path to output allele matrix (cgmlst_alleles.tsv.gz).",
+        required=True,
+    )
+    parser.add_argument(
+        "--output-codebook",
+        type=Path,
+        metavar="STR",
+        help="Path to output allele codebook.",
+        required=True,
+    )
+    parser.add_argument(
+        "--output-profiles",
+        type=Path,
+        metavar="STR",
+        help="Path to export profiles in the cgmlst format read by distle.",
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Increase verbosity.",
+    )
+
+    args = parser.parse_args()
+
+    if args.previous_alleles and not args.previous_codebook:
+        parser.error("--previous-alleles requires --previous-codebook")
+    if args.new_input_manifest:
+        with open(args.new_input_manifest) as f:
+            args.new_input = args.new_input + [Path(line.strip()) for line in f if line.strip()]
+    if not args.new_input:
+        parser.error("no input profiles, use --new-input or --new-input-manifest")
+
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+
+    main(args)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+
+class DistanceSummary:
+    """
+    Nearest neighbour of each sample and a histogram of distances, updated chunk by chunk
+
+    Parameters
+    ----------
+    threshold : float
+        Cluster threshold, neighbours within it are counted per sample.
+    max_distance : int
+        Largest distance in the histogram, larger distances are counted in
+        one bin. If None, the histogram covers all distances.
+
+    Notes
+    -----
+    The distances list every pair in both directions (with a distance of 0
+    of each sample to itself), so the statistics of a sample are taken from
+    the rows in which it is sample1, and the histogram counts each pair once
+    from the rows in which sample1 < sample2.
+
+    Ties for the nearest neighbour are broken by name, so the summary does
+    not depend on how the distances are split in chunks.
+
+    """
+
+    def __init__(self, threshold, max_distance=None):
+        self.threshold = threshold
+        self.max_distance = max_distance
+        self.nearest = pd.DataFrame(
+            {"sample": [], "nearest_distance": np.array([], dtype=np.float64), "nearest_neighbour": []},
+        )
+        self.n_within_threshold = pd.Series(dtype=np.int64)
+        self.counts = np.zeros(0 if max_distance is None else max_distance + 2, dtype=np.int64)
+
+    def update(self, df_distances):
+        """
+        Add a chunk of distances, with categorical sample columns
+        """
+        categories1 = df_distances["sample1"].cat.categories
+        categories2 = df_distances["sample2"].cat.categories
+        # sorted, so comparing positions compares names
+        categories = categories1.union(categories2).sort_values()
+        i = categories.get_indexer(categories1)[df_distances["sample1"].cat.codes.to_numpy()]
+        j = categories.get_indexer(categories2)[df_distances["sample2"].cat.codes.to_numpy()]
+        distances = df_distances["distance"].to_numpy()
+        other = i != j
+
+        n_within = np.bincount(
+            i[other & (distances <= self.threshold)], minlength=len(categories)
+        )
+        # categories of excluded samples are kept, so only samples with rows are summarised
+        present = np.bincount(i, minlength=len(categories)) > 0
+        self.n_within_threshold = self.n_within_threshold.add(
+            pd.Series(n_within[present], index=categories[present]), fill_value=0
+        ).astype(np.int64)
+
+        i, j, distances = i[other], j[other], distances[other]
+        # the nearest neighbour is the first neighbour by name at the shortest distance,
+        # grouped by hashing instead of sorting all rows
+        min_distance = pd.Series(distances).groupby(i).min()
+        lookup = np.zeros(len(categories), dtype=distances.dtype)
+        lookup[min_distance.index.to_numpy()] = min_distance.to_numpy()
+        at_min = distances == lookup[i]
+        nearest = pd.Series(j[at_min]).groupby(i[at_min]).min()
+        df_nearest = pd.DataFrame(
+            {
+                "sample": categories[nearest.index.to_numpy()],
+                "nearest_distance": lookup[nearest.index.to_numpy()],
+                "nearest_neighbour": categories[nearest.to_numpy()],
+            }
+        )
+        self.nearest = (
+            pd.concat([df for df in [self.nearest, df_nearest] if len(df) > 0] or [self.nearest])
+            .sort_values(["sample", "nearest_distance", "nearest_neighbour"], kind="stable")
+            .drop_duplicates("sample")
+        )
+
+        pair_distances = distances[i < j].astype(np.int64)
+        if self.max_distance is not None:
+            pair_distances = np.minimum(pair_distances, self.max_distance + 1)
+        counts = np.bincount(pair_distances, minlength=len(self.counts))
+        counts[: len(self.counts)] += self.counts
+        self.counts = counts
+
+    def neighbours(self):
+        """
+        Nearest neighbour, its distance and the number of neighbours within the threshold per sample
+        """
+        df = pd.DataFrame(
+            {"sample": self.n_within_threshold.index, "n_within_threshold": self.n_within_threshold.to_numpy()}
+        )
+        df = df.merge(self.nearest, on="sample", how="left")
+        # samples without other samples have no nearest neighbour, keep integer distances integer
+        if (df["nearest_distance"].dropna() % 1 == 0).all():
+            df["nearest_distance"] = df["nearest_distance"].astype("Int64")
+        return df[["sample", "nearest_neighbour", "nearest_distance", "n_within_threshold"]]
+
+    def histogram(self):
+        """
+        Number of pairs per distance, the last bin holds the pairs above max_distance
+        """
+        distance = [str(d) for d in range(len(self.counts))]
+        if self.max_distance is not None:
+            distance[-1] = f">{self.max_distance}"
+        return pd.DataFrame({"distance": distance, "n_pairs": self.counts})
+
+    def write(self, neighbours_path=None, histogram_path=None):
+        if neighbours_path:
+            self.neighbours().to_csv(neighbours_path, sep="\t", index=False)
+            logging.info(f"Nearest neighbours written to {neighbours_path}")
+        if histogram_path:
+            self.histogram().to_csv(histogram_path, sep="\t", index=False)
+            logging.info(f"Distance histogram written to {histogram_path}")
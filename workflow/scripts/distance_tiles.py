@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import logging
+import shutil
+from pathlib import Path
+from typing import IO, Iterable, List, Optional, Set, Tuple
+
+COPY_BUFFER_SIZE = 16 * 1024**2
+
+
+def list_tiles(chunks: List[Tuple[str, int, bool]]) -> List[Tuple[str, str]]:
+    """
+    List the tiles of the distance matrix which hold pairs with a new sample.
+
+    Parameters
+    ----------
+    chunks : List[Tuple[str, int, bool]]
+        Chunks as returned by split_alignment.read_chunks. Chunks of new
+        sequences follow the chunks of previous sequences.
+
+    Returns
+    -------
+    List[Tuple[str, str]]
+        Pairs of chunks (chunk_a, chunk_b) with chunk_a <= chunk_b and chunk_b
+        new. Pairs of two previous chunks are in the previous distances.
+
+    """
+    return [
+        (chunk_a, chunk_b)
+        for i, (chunk_a, _, _) in enumerate(chunks)
+        for chunk_b, _, is_new in chunks[i:]
+        if is_new
+    ]
+
+
+def read_names(fasta: IO[str]) -> Set[str]:
+    return {
+        line[1:].split(maxsplit=1)[0]
+        for line in fasta
+        if line.startswith(">") and line[1:].strip()
+    }
+
+
+def select_cross_pairs(distances: IO[str], names_b: Set[str], output: IO[str]) -> int:
+    """
+    Write the distances between a sample in chunk B and a sample outside it.
+
+    The distances of an off-diagonal tile are calculated on chunk A followed
+    by chunk B, so they also hold the pairs within both chunks, which belong
+    to the diagonal tiles or to the previous distances.
+
+    Returns
+    -------
+    int
+        Number of distances written.
+
+    """
+    n_written = 0
+    for line in distances:
+        sample1, sample2, _ = line.split("\t", 2)
+        if (sample1 in names_b) != (sample2 in names_b):
+            output.write(line)
+            n_written += 1
+    return n_written
+
+
+def gather_tiles(
+    output: Path, tiles: Iterable[Path], previous_distances: Optional[Path] = None
+) -> None:
+    """
+    Concatenate the previous distances and the distance tiles.
+
+    Every pair is in exactly one of the inputs: pairs of previous samples in
+    the previous distances, pairs within a chunk (and the distance of a
+    sample to itself) in its diagonal tile and pairs across chunks in their
+    off-diagonal tile.
+    """
+    inputs = ([previous_distances] if previous_distances else []) + list(tiles)
+    with open(output, "wb") as f_out:
+        for path in inputs:
+            with open(path, "rb") as f_in:
+                shutil.copyfileobj(f_in, f_out, COPY_BUFFER_SIZE)
+    logging.info(f"Gathered {len(inputs)} distance files in {output}.")
+
+
+def main(args) -> None:
+    with open(args.chunk) as f:
+        names_b = read_names(f)
+    with open(args.input) as distances, open(args.output, "w") as output:
+        n_written = select_cross_pairs(distances, names_b, output)
+    logging.info(f"Selected {n_written} distances across chunks from {args.input}.")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Select the distances across two chunks from the distances of an off-diagonal tile."
+    )
+
+    parser.add_argument(
+        "--input",
+        type=Path,
+        metavar="STR",
+        help="Path to the distances of the tile.",
+        required=True,
+    )
+    parser.add_argument(
+        "--chunk",
+        type=Path,
+        metavar="STR",
+        help="Path to chunk B of the tile, distances with exactly one sample in it are selected.",
+        required=True,
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        metavar="STR",
+        help="Path to output distances.",
+        required=True,
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Increase verbosity.",
+    )
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+
+    main(args)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+import argparse
+import base64
+import hashlib
+import logging
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+
+CONFIG_DIR = Path(__file__).resolve().parents[2] / 'config'
+
+# Curated files replace the file of the previous run, the original is kept with this suffix
+REPLACED_SUFFIX = '.old'
+# Copies of the previous (curated) files which are stored with the output of a run
+OUTPUT_COPIES = {
+    'clusters.csv': 'clusters_previous.csv',
+}
+CURATED_OUTPUT_COPIES = {
+    'clusters.csv': 'clusters_previous_curated.csv',
+    'list_excluded_samples.tsv': 'list_excluded_samples_previous_curated.tsv',
+}
+# Files which are derived from a replaced file and should not be used with the curated file
+INVALIDATED_BY_CURATION = {
+    'list_excluded_samples.tsv': ['list_excluded_samples.ledger.tsv.gz'],
+}
+
+
+def file_checksum(path, reference):
+    '''
+    Checksum of a local file in the format of an iRODS checksum (reference)
+
+    iRODS stores SHA-256 checksums as "sha2:<base64>" and MD5 checksums as hex digests
+    '''
+    sha256 = reference.startswith('sha2:')
+    digest = hashlib.sha256() if sha256 else hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024**2), b''):
+            digest.update(block)
+    if sha256:
+        return 'sha2:' + base64.b64encode(digest.digest()).decode()
+    return digest.hexdigest()
+
+
+class LocalBackend:
+    '''
+    Storage backend which reads collections from local directories
+    '''
+
+    def list_files(self, collection):
+        '''
+        Return the checksum per file name in a collection
+        '''
+        return {
+            path.name: file_checksum(path, 'sha2:')
+            for path in Path(collection).iterdir() if path.is_file()
+        }
+
+    def download(self, collection, name, local_path):
+        shutil.copyfile(Path(collection) / name, local_path)
+
+
+class IrodsBackend:
+    '''
+    Storage backend which reads collections from iRODS, using a single session
+    '''
+
+    def __init__(self, irods_session):
+        self.irods_session = irods_session
+
+    def list_files(self, collection):
+        '''
+        Return the checksum per data object in a collection, in a single query
+        '''
+        from irods.column import Criterion
+        from irods.models import Collection, DataObject
+
+        query = self.irods_session.query(DataObject.name, DataObject.checksum).filter(
+            Criterion('=', Collection.name, collection))
+        files = {}
+        for q in query:
+            # replicas without a checksum do not overwrite one which has it
+            files[q[DataObject.name]] = files.get(q[DataObject.name]) or q[DataObject.checksum]
+        return files
+
+    def download(self, collection, name, local_path):
+        self.irods_session.data_objects.get(f'{collection}/{name}', str(local_path), force=True)
+
+
+def fetch_collection(backend, collection, required, optional, local_dir, threads=4):
+    '''
+    Fetch files of a collection in parallel, skipping files which are already present
+
+    Parameters
+    ----------
+    backend : LocalBackend | IrodsBackend
+        Storage backend to fetch from.
+    collection : str
+        Collection to fetch from.
+    required : list
+        Files which must be present in the collection.
+    optional : list
+        Files which are fetched if present in the collection.
+    local_dir : Path
+        Directory to fetch files to.
+    threads : int
+        Number of parallel transfers.
+
+    Returns
+    -------
+    list
+        Names of the files which are present in local_dir.
+
+    Raises
+    ------
+    FileNotFoundError
+        If a required file is not in the collection.
+    '''
+    remote_files = backend.list_files(collection)
+    missing = [name for name in required if name not in remote_files]
+    if missing:
+        raise FileNotFoundError(f'Collection {collection} lacks required files: {", ".join(missing)}')
+    names = [name for name in list(required) + list(optional) if name in remote_files]
+
+    local_dir.mkdir(parents=True, exist_ok=True)
+    to_download = []
+    for name in names:
+        local_path = local_dir / name
+        checksum = remote_files[name]
+        if checksum and local_path.exists() and file_checksum(local_path, checksum) == checksum:
+            logging.info('Skipping %s, already present with matching checksum', local_path)
+        else:
+            to_download.append(name)
+
+    def download(name):
+        # download next to the target, so an interrupted transfer does not leave a partial file
+        partial_path = local_dir / (name + '.part')
+        backend.download(collection, name, partial_path)
+        partial_path.replace(local_dir / name)
+        logging.info('Fetched %s/%s', collection, name)
+
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+        list(executor.map(download, to_download))
+    return names
+
+
+def apply_curation(previous_dir, curated_dir, curated_files, output_dir):
+    '''
+    Replace files of the previous run by curated files and keep copies with the output
+
+    The replaced files are kept with suffix .old in the previous run directory.
+    '''
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name, copy_name in OUTPUT_COPIES.items():
+        if (previous_dir / name).exists():
+            shutil.copyfile(previous_dir / name, output_dir / copy_name)
+    for name in curated_files:
+        logging.info('Using curated %s', name)
+        if name in CURATED_OUTPUT_COPIES:
+            shutil.copyfile(curated_dir / name, output_dir / CURATED_OUTPUT_COPIES[name])
+        for replaced in [name] + INVALIDATED_BY_CURATION.get(name, []):
+            if (previous_dir / replaced).exists():
+                (previous_dir / replaced).replace(previous_dir / (replaced + REPLACED_SUFFIX))
+        shutil.copyfile(curated_dir / name, previous_dir / name)
+
+
+def clustering_type_of(clustering_preset, presets_path):
+    with open(presets_path) as f:
+        return yaml.safe_load(f)[clustering_preset]['clustering_type']
+
+
+def fetch_recluster_run(backend, manifest, args):
+    '''
+    Fetch the outputs of an earlier run of the same runsheet, which a rerun can reuse
+
+    The outputs are only reused if the inputs are unchanged, which the pipeline checks.
+    An earlier run without recorded checksums is skipped, as its outputs can not be reused.
+    '''
+    logging.info('Fetching outputs of earlier run %s', args.recluster_from)
+    try:
+        fetch_collection(
+            backend, args.recluster_from,
+            manifest['recluster']['required'], manifest['recluster'].get('optional', []),
+            args.recluster_dir, args.threads)
+    except FileNotFoundError as e:
+        logging.warning('Not reusing earlier run: %s', e)
+
+
+def fetch_previous_run(backend, args):
+    with open(args.manifest) as f:
+        manifest = yaml.safe_load(f)
+    if getattr(args, 'recluster_from', None):
+        fetch_recluster_run(backend, manifest, args)
+    if not args.previous_run:
+        return
+    clustering_type = clustering_type_of(args.clustering_preset, args.presets)
+    logging.info('Fetching %s files of previous run %s', clustering_type, args.previous_run)
+    fetch_collection(
+        backend, args.previous_run,
+        manifest[clustering_type]['required'], manifest[clustering_type].get('optional', []),
+        args.output_dir, args.threads)
+
+    curated_files = []
+    if args.curated_collection:
+        logging.info('Fetching curated files of %s', args.curated_collection)
+        curated_files = fetch_collection(
+            backend, args.curated_collection,
+            manifest['curated']['required'], manifest['curated'].get('optional', []),
+            args.curated_dir, args.threads)
+    apply_curation(args.output_dir, args.curated_dir, curated_files, args.output_copies_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch the files of a previous clustering run which are needed for a run')
+    parser.add_argument('-p', '--previous-run', help='Previous clustering run collection')
+    parser.add_argument('-c', '--curated-collection', help='Downstream collection with curated files of the previous run')
+    parser.add_argument('-t', '--clustering-preset', help='Clustering preset, determines which files are fetched', required=True)
+    parser.add_argument('-o', '--output-dir', help='Local directory for the previous run', type=Path)
+    parser.add_argument('-C', '--curated-dir', help='Local directory for the curated files', type=Path)
+    parser.add_argument('-r', '--recluster-from', help='Earlier run of the same runsheet, its outputs are reused if the inputs are unchanged')
+    parser.add_argument('-R', '--recluster-dir', help='Local directory for the earlier run', type=Path)
+    parser.add_argument('-O', '--output-copies-dir', help='Directory to store copies of the previous (curated) files with the output', type=Path, required=True)
+    parser.add_argument('-m', '--manifest', help='Files to fetch per clustering type', type=Path, default=CONFIG_DIR / 'previous_run_manifest.yaml')
+    parser.add_argument('--presets', help='Path to presets', type=Path, default=CONFIG_DIR / 'presets.yaml')
+    parser.add_argument('-b', '--backend', help='Storage backend, local reads collections as local directories', choices=['irods', 'local'], default='irods')
+    parser.add_argument('-j', '--threads', help='Number of parallel transfers', type=int, default=4)
+    parser.add_argument('-S', '--use_ssl', help="Use SSL for irods connection", action="store_true")
+    parser.add_argument('-l', '--log_file', help='Log file path', default='fetch_previous_run.log')
+
+    args = parser.parse_args()
+    if args.previous_run and args.output_dir is None:
+        parser.error('--output-dir is required with --previous-run')
+    if args.recluster_from and args.recluster_dir is None:
+        args.recluster_dir = Path(Path(args.recluster_from).name).resolve()
+    if args.curated_collection and args.curated_dir is None:
+        args.curated_dir = Path(Path(args.curated_collection).name).resolve()
+
+    # Set up logging
+    logging.basicConfig(
+        filename=args.log_file,
+        filemode='a',
+        format='%(asctime)s %(levelname)s: %(message)s',
+        level=logging.INFO
+    )
+
+    try:
+        if args.backend == 'irods':
+            from collfinder import irodsConnect
+
+            with irodsConnect(use_ssl=args.use_ssl) as irods_session:
+                fetch_previous_run(IrodsBackend(irods_session), args)
+        else:
+            fetch_previous_run(LocalBackend(), args)
+    except Exception:
+        logging.exception("Failed to fetch previous run")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(2)
@@ -2,12 +2,11 @@ import argparse
 from pathlib import Path
 import os
 import sys
-import ssl
 import logging
 from irods.column import Criterion
-from irods.session import iRODSSession
-from irods.models import Collection, CollectionMeta, DataObject
-from irods.exception import CollectionDoesNotExist
+from irods.models import Collection, CollectionMeta
+
+from collfinder import irodsConnect
 
 
 def parse_args():
@@ -22,27 +21,25 @@ def parse_args():
     return parser.parse_args()
 
 
-def irodsConnect(irodsfile="", use_ssl = False):
+def find_downstream_collection(irods_session, previous_run):
     '''
-    Connect to irods iCAT and return iRODSSession object
+    Find the collection with curated files of a previous clustering run, or None
     '''
-    if irodsfile:
-        envFile = irodsfile
-    else:
-        try:
-            envFile = os.environ['IRODS_ENVIRONMENT_FILE']
-        except KeyError:
-            envFile = os.path.expanduser('~/.irods/irods_environment.json')
-
-    if use_ssl:
-        context = ssl._create_unverified_context(purpose=ssl.Purpose.SERVER_AUTH,
-                                             cafile=None, capath=None, cadata=None)
-        ssl_settings = {'irods_ssl_ca_certificate_file': '/etc/irods/ssl/irods.crt',
-                        'ssl_context': context }
-        session = iRODSSession(irods_env_file=envFile, **ssl_settings)
-    else:
-        session = iRODSSession(irods_env_file=envFile)
-    return session
+    #find dataset_id previous clustering run
+    query = irods_session.query(CollectionMeta.value).filter(
+        Criterion('=', Collection.name, previous_run)).filter(
+        Criterion('=', CollectionMeta.name, 'sys::dataset_id'))
+    dataset_id = [q[CollectionMeta.value] for q in query][0]
+    logging.info(f"Previous clustering run collection dataset_id: {dataset_id}")
+
+    # find collection name curated clusters.csv
+    query = irods_session.query(Collection.name).filter(
+        Criterion('=', CollectionMeta.name, 'user::pipeline::input_collection_id')).filter(
+        Criterion('=', CollectionMeta.value, dataset_id))
+    downstream_coll_name_list = [ q[Collection.name] for q in query ]
+    if len(downstream_coll_name_list) > 0:
+        return downstream_coll_name_list[0]
+    return None
 
         
 def find_downstream_curated_files():
@@ -71,45 +68,20 @@ def find_downstream_curated_files():
         irods_session = irodsConnect(use_ssl=args.use_ssl)
         logging.info(f"Connected to iRODS. Previous run collection: {previous_run}")
 
-        #find dataset_id previous clustering run
         try:
-            query = irods_session.query(CollectionMeta.value).filter(
-                Criterion('=', Collection.name, previous_run)).filter(
-                Criterion('=', CollectionMeta.name, 'sys::dataset_id'))
-            dataset_id = [q[CollectionMeta.value] for q in query][0]
-            logging.info(f"Previous clustering run collection dataset_id: {dataset_id}")
-        except Exception as e:
-            logging.error('Error finding dataset_id previous clustering collection: %s', str(e))
-            return False
-        
-        # find collection name curated clusters.csv
-        try:
-            query = irods_session.query(Collection.name).filter(
-                Criterion('=', CollectionMeta.name, 'user::pipeline::input_collection_id')).filter(
-                Criterion('=', CollectionMeta.value, dataset_id))
-            
-            downstream_coll_name_list = [ q[Collection.name] for q in query ]
-            
-            if len(downstream_coll_name_list) > 0:
-                
-                downstream_coll_name = downstream_coll_name_list[0]
-            
-                logging.info(f"Previous clustering run collection with curated files: {downstream_coll_name}")
-                
-
-                # This print inserts the string in the run_pipeline.sh script
-                print(downstream_coll_name)
-                
-            else:
-                logging.info("No collection with curated files found.")
-            
-            return True
-        
+            downstream_coll_name = find_downstream_collection(irods_session, previous_run)
         except Exception as e:
             logging.error('Error finding curated clustering collection: %s', str(e))
             return False
-        
-    
+
+        if downstream_coll_name is not None:
+            logging.info(f"Previous clustering run collection with curated files: {downstream_coll_name}")
+            # This print inserts the string in the run_pipeline.sh script
+            print(downstream_coll_name)
+        else:
+            logging.info("No collection with curated files found.")
+        return True
+
     except Exception as e:
         logging.exception("Unexpected error occurred")
         return False
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+
+# Files of the previous run which the alignment (or allele matrix) and distances are built on
+PREVIOUS_FILES = {
+    "alignment": ["aln.fa.gz", "distances.tsv"],
+    "mlst": ["cgmlst_alleles.tsv.gz", "cgmlst_allele_codes.tsv.gz", "distances.tsv"],
+}
+# Outputs which a rerun with the same inputs can reuse instead of recomputing them
+REUSABLE_OUTPUTS = {
+    "alignment": ["aln.fa.gz", "distances.tsv"],
+    "mlst": ["cgmlst_alleles.tsv.gz", "cgmlst_allele_codes.tsv.gz", "distances.tsv"],
+}
+# Parameters which change the alignment (or allele matrix) and distances
+PARAMETERS = ["clustering_type", "max_distance", "N_content_threshold", "cgmlst_missing_data"]
+
+
+def file_checksum(path):
+    """
+    SHA-256 hex digest of a file, None if it does not exist
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024**2), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def input_checksums(sample_inputs, previous_clustering, config, threads=4):
+    """
+    Checksums of everything the alignment (or allele matrix) and distances depend on
+
+    Parameters
+    ----------
+    sample_inputs : dict
+        Input file (assembly or cgMLST profile) per sample, in order of the run.
+    previous_clustering : str
+        Directory of the previous run, "None" if there is none.
+    config : dict
+        Pipeline config.
+    threads : int
+        Number of files to hash in parallel.
+
+    Returns
+    -------
+    dict
+        Checksums per sample (as a list, the order of samples matters),
+        per file of the previous run and the relevant parameters.
+
+    """
+    clustering_type = config["clustering_type"]
+    previous_files = []
+    if previous_clustering != "None":
+        previous_files = [
+            Path(previous_clustering) / name for name in PREVIOUS_FILES[clustering_type]
+        ]
+    samples = list(sample_inputs)
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+        checksums = list(
+            executor.map(
+                file_checksum, [sample_inputs[s] for s in samples] + previous_files
+            )
+        )
+    return {
+        "samples": [[sample, checksum] for sample, checksum in zip(samples, checksums)],
+        "previous": {
+            path.name: checksum
+            for path, checksum in zip(previous_files, checksums[len(samples):])
+        },
+        "parameters": {key: config[key] for key in PARAMETERS if key in config},
+    }
+
+
+def output_checksums(run_dir, clustering_type):
+    return {
+        name: file_checksum(Path(run_dir) / name)
+        for name in REUSABLE_OUTPUTS[clustering_type]
+    }
+
+
+def output_sizes(run_dir, clustering_type):
+    return {
+        name: (Path(run_dir) / name).stat().st_size
+        for name in REUSABLE_OUTPUTS[clustering_type]
+    }
+
+
+def write_checksums(path, inputs, outputs, sizes=None):
+    checksums = {"inputs": inputs, "outputs": outputs}
+    if sizes is not None:
+        checksums["sizes"] = sizes
+    with open(path, "w") as f:
+        yaml.safe_dump(checksums, f)
+
+
+def read_checksums(path):
+    """
+    Checksums recorded by a run, None if the run did not record them
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def can_reuse_outputs(recorded, inputs, clustering_type):
+    """
+    Whether a run with recorded checksums had the same inputs and kept its outputs
+    """
+    if recorded is None:
+        return False
+    if recorded.get("inputs") != inputs:
+        return False
+    outputs = recorded.get("outputs", {})
+    return all(outputs.get(name) for name in REUSABLE_OUTPUTS[clustering_type])
+
+
+def link_output(run_dir, name, recorded, output_path):
+    """
+    Link an output of an earlier run, with a hard link if possible
+
+    The output is not hashed again, the rerun was decided on the recorded
+    input checksums (see juno_clustering.py). Only its size is checked, if
+    the run recorded sizes.
+
+    Raises
+    ------
+    ValueError
+        If the file does not have its recorded size.
+    """
+    source = Path(run_dir).resolve() / name
+    size = recorded.get("sizes", {}).get(name)
+    if size is not None and source.stat().st_size != size:
+        raise ValueError(f"{source} does not have the size recorded by its run")
+    try:
+        os.link(source, output_path)
+    except OSError:
+        # across file systems
+        os.symlink(source, output_path)
+    logging.info(f"Reused {source}")
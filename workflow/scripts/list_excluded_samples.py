@@ -1,23 +1,118 @@
 import argparse
+import hashlib
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 import datetime
 import logging
 import re
 
+from state_store import StateStore
 
-def read_input_data(input_files):
-    data = {}
-    for file in input_files:
-        with open(file) as f:
-            data[file.stem] = json.load(f)
-    df = pd.DataFrame.from_dict(data, orient="index").reset_index(names="sample")
+
+LEDGER_KEY = ["sample", "reason"]
+LEDGER_COLUMNS = ["sample", "reason", "date"]
+QC_METRICS = ["mean_coverage", "rrs_rrl_snp_counts"]
+QC_CACHE_KEY = ["path", "size", "mtime_ns"]
+QC_CACHE_COLUMNS = ["sample"] + QC_CACHE_KEY + ["checksum"] + QC_METRICS
+
+
+def read_qc_cache(file):
+    """
+    Read the QC metrics parsed in previous runs.
+
+    Caches written before the file size and modification time were recorded
+    are read with empty values for them, so their files are checksummed once.
+    """
+    if file is None or not file.exists():
+        return pd.DataFrame(columns=QC_CACHE_COLUMNS)
+    df = pd.read_csv(file, sep="\t", dtype={"sample": str, "path": str, "checksum": str})
+    df = df.reindex(columns=QC_CACHE_COLUMNS)
+    logging.info(f"Read QC metrics of {len(df)} files from {file}")
+    return df
+
+
+def cache_key(path, size, mtime_ns):
+    return (str(path), int(size), int(mtime_ns))
+
+
+def read_qc_metrics(file, dict_stat, dict_checksum):
+    """
+    Read the QC metrics of a single seq_exp JSON.
+
+    If the path, size and modification time of the file are in the cache the
+    file is not opened. Otherwise it is read to compute its checksum, and only
+    parsed as JSON if the combination of sample and checksum is not in the cache.
+    """
+    sample = file.stem
+    stat = file.stat()
+    key = cache_key(file, stat.st_size, stat.st_mtime_ns)
+    record = dict_stat.get(key)
+    if record is not None and record["sample"] == sample:
+        return {**record, "cached": "stat"}
+
+    content = file.read_bytes()
+    checksum = hashlib.md5(content).hexdigest()
+    metrics = dict_checksum.get((sample, checksum))
+    cached = "checksum"
+    if metrics is None:
+        data = json.loads(content)
+        metrics = {metric: data.get(metric) for metric in QC_METRICS}
+        cached = None
+    return {
+        "sample": sample,
+        "path": key[0],
+        "size": key[1],
+        "mtime_ns": key[2],
+        "checksum": checksum,
+        **metrics,
+        "cached": cached,
+    }
+
+
+def read_input_data(input_files, df_cache=None, threads=1):
+    if df_cache is None:
+        df_cache = read_qc_cache(None)
+    records = df_cache[QC_CACHE_COLUMNS].to_dict(orient="records")
+    dict_stat = {
+        cache_key(r["path"], r["size"], r["mtime_ns"]): r
+        for r in records
+        if pd.notna(r["path"]) and pd.notna(r["size"]) and pd.notna(r["mtime_ns"])
+    }
+    dict_checksum = {
+        (r["sample"], r["checksum"]): {metric: r[metric] for metric in QC_METRICS}
+        for r in records
+    }
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        records = list(
+            executor.map(
+                lambda file: read_qc_metrics(file, dict_stat, dict_checksum), input_files
+            )
+        )
+    nr_unchanged = sum(r["cached"] == "stat" for r in records)
+    nr_checksummed = sum(r["cached"] == "checksum" for r in records)
+    logging.info(
+        f"Parsed {len(records) - nr_unchanged - nr_checksummed} JSON files, "
+        f"{nr_unchanged} unchanged and {nr_checksummed} with a cached checksum"
+    )
+    df = pd.DataFrame.from_records(records, columns=QC_CACHE_COLUMNS)
     df["mean_coverage"] = df["mean_coverage"].astype(float)
     df["rrs_rrl_snp_counts"] = df["rrs_rrl_snp_counts"].astype(float)
     return df
 
 
+def update_qc_cache(df_cache, df):
+    """
+    Carry forward the QC metrics of previous runs, replacing changed files.
+    """
+    df_previous = df_cache[~df_cache["sample"].isin(df["sample"])]
+    if len(df_previous) == 0:
+        return df[QC_CACHE_COLUMNS].sort_values("sample").reset_index(drop=True)
+    df_updated = pd.concat([df_previous[QC_CACHE_COLUMNS], df[QC_CACHE_COLUMNS]])
+    return df_updated.sort_values("sample").reset_index(drop=True)
+
+
 def exclude_on_coverage(df, threshold):
     df_copy = df.copy()
     return df_copy[df_copy["mean_coverage"] < threshold]
@@ -32,16 +127,60 @@ def exclude_on_contamination(df, contamination_threshold):
     return df_copy[df_copy["rrs_rrl_snp_counts"] > contamination_threshold]
 
 def read_previous_exclude_list(file):
-    with open(file) as f:
-        lines = f.readlines()
-    if len(lines) == 0:
-        return pd.DataFrame(columns=["sample", "reason", "date"])
-    else:
-        df = pd.read_csv(file, sep="\t")
-        return df
+    """
+    Read an exclusion list or ledger, deduplicated on sample and reason.
+
+    Accepts both the TSV export (which may contain duplicates if written by
+    older versions) and the gzipped ledger. Reasons are read as categoricals
+    so every row only carries the sample name and date as strings.
+    """
+    try:
+        df = pd.read_csv(
+            file, sep="\t", dtype={"sample": str, "reason": "category", "date": str}
+        )
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame(columns=LEDGER_COLUMNS)
+    return merge_exclusions(df, pd.DataFrame(columns=LEDGER_COLUMNS))
+
+
+def merge_exclusions(df_previous, df_new):
+    """
+    Merge new exclusions into the ledger.
+
+    Every combination of sample and reason is kept once, with the date it was
+    first excluded. Dates are formatted as %Y-%m-%d %H:%M:%S, so sorting them
+    as strings sorts them chronologically. The result is sorted on the key.
+    """
+    df = pd.concat(
+        [df_previous[LEDGER_COLUMNS].astype(str), df_new[LEDGER_COLUMNS].astype(str)]
+    )
+    df = df.sort_values(LEDGER_COLUMNS, kind="stable")
+    df = df.drop_duplicates(subset=LEDGER_KEY, keep="first")
+    df["reason"] = df["reason"].astype("category")
+    return df.reset_index(drop=True)
+
+
+def read_exclusion_ledger(ledger, previous_exclude_list):
+    """
+    Read the exclusion ledger of the previous run.
+
+    Falls back to the TSV export if the previous run did not write a ledger,
+    or if the ledger was moved aside because a curated list should be used.
+    """
+    if ledger is not None and ledger.exists():
+        logging.info(f"Reading exclusion ledger {ledger}")
+        return read_previous_exclude_list(ledger)
+    logging.info(f"Reading previous exclusion list {previous_exclude_list}")
+    return read_previous_exclude_list(previous_exclude_list)
+
 
 def main(args):
-    df = read_input_data(args.input)
+    df_cache = read_qc_cache(args.previous_qc_cache)
+    df = read_input_data(args.input, df_cache, args.threads)
+    if args.qc_cache_output is not None:
+        update_qc_cache(df_cache, df).to_csv(
+            args.qc_cache_output, sep="\t", index=False, compression="gzip"
+        )
     df_coverage_excluded = exclude_on_coverage(df, args.coverage_threshold)
     df_coverage_excluded["reason"] = "low_coverage"
     df_pattern_excluded = exclude_on_pattern(df, args.inclusion_pattern)
@@ -71,23 +210,47 @@ def main(args):
     # df_excluded["sample"] = df_excluded["sample"].apply(format_sample)
     # print(df_excluded)
 
-    df_previous_excluded = read_previous_exclude_list(args.previous_exclude_list)
-    df_final = pd.concat([df_previous_excluded, df_excluded])
+    df_previous_excluded = read_exclusion_ledger(
+        args.previous_ledger, args.previous_exclude_list
+    )
+    if args.state_db is not None:
+        # the exclusions are read and extended in one transaction
+        with StateStore(args.state_db) as store, store.transaction():
+            df_previous_excluded = merge_exclusions(df_previous_excluded, store.exclusions())
+            df_final = merge_exclusions(df_previous_excluded, df_excluded)
+            store.add_exclusions(df_final)
+    else:
+        df_final = merge_exclusions(df_previous_excluded, df_excluded)
+    if args.ledger_output is not None:
+        df_final.to_csv(args.ledger_output, sep="\t", index=False, compression="gzip")
     df_final.to_csv(args.output, sep="\t", index=False)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("--input", type=Path, required=True, nargs="+")
+    parser.add_argument("--input", type=Path, nargs="+", default=[])
+    parser.add_argument("--input-manifest", type=Path, required=False)
     parser.add_argument("--previous-exclude-list", type=Path, required=True)
+    parser.add_argument("--previous-ledger", type=Path, required=False)
     parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--ledger-output", type=Path, required=False)
     parser.add_argument("--inclusion-pattern", type=str, required=True)
     parser.add_argument("--coverage-threshold", type=float, required=True)
     parser.add_argument("--contamination-threshold", type=float, required=True)
+    parser.add_argument("--previous-qc-cache", type=Path, required=False)
+    parser.add_argument("--qc-cache-output", type=Path, required=False)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--state-db", type=Path, required=False)
     # parser.add_argument("--sample-date-map", type=str, required=False)
 
     args = parser.parse_args()
+
+    if args.input_manifest:
+        with open(args.input_manifest) as f:
+            args.input = args.input + [Path(line.strip()) for line in f if line.strip()]
+    if not args.input:
+        parser.error("no input files, use --input or --input-manifest")
     
     logging.info('parsed arguments')
     
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+import logging
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Snakemake benchmark columns and their names in the report
+BENCHMARK_COLUMNS = {
+    "s": "wall_s",
+    "cpu_time": "cpu_s",
+    "max_rss": "max_rss_mb",
+    "io_in": "io_in_mb",
+    "io_out": "io_out_mb",
+}
+REPORT_COLUMNS = ["rule", "jobs"] + list(BENCHMARK_COLUMNS.values())
+COMPARED_COLUMNS = ["wall_s", "cpu_s", "max_rss_mb"]
+
+
+def read_benchmarks(benchmark_dir: Path) -> pd.DataFrame:
+    """
+    Read all benchmarks of a run.
+
+    Parameters
+    ----------
+    benchmark_dir : Path
+        Directory with a benchmark per rule ({rule}.tsv), or a directory of
+        benchmarks per job for rules with wildcards ({rule}/{job}.tsv).
+
+    Returns
+    -------
+    pd.DataFrame
+        Benchmark per job, with rule and job names.
+
+    """
+    list_df = []
+    for benchmark in sorted(benchmark_dir.glob("**/*.tsv")):
+        relative = benchmark.relative_to(benchmark_dir)
+        rule = relative.parts[0] if len(relative.parts) > 1 else benchmark.stem
+        df = pd.read_csv(benchmark, sep="\t", na_values=["NA", "-"])
+        df = df[list(BENCHMARK_COLUMNS)].rename(columns=BENCHMARK_COLUMNS)
+        df.insert(0, "rule", rule)
+        df.insert(1, "job", benchmark.stem)
+        list_df.append(df)
+    if not list_df:
+        return pd.DataFrame(columns=["rule", "job"] + list(BENCHMARK_COLUMNS.values()))
+    return pd.concat(list_df, ignore_index=True)
+
+
+def summarise_benchmarks(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarise benchmarks per rule.
+
+    Wall time, CPU time and I/O are summed over the jobs of a rule, memory is
+    the peak of any job.
+    """
+    return (
+        df.groupby("rule")
+        .agg(
+            jobs=("job", "nunique"),
+            wall_s=("wall_s", "sum"),
+            cpu_s=("cpu_s", "sum"),
+            max_rss_mb=("max_rss_mb", "max"),
+            io_in_mb=("io_in_mb", "sum"),
+            io_out_mb=("io_out_mb", "sum"),
+        )
+        .round(2)
+        .reset_index()[REPORT_COLUMNS]
+    )
+
+
+def compare_reports(
+    df_report: pd.DataFrame,
+    df_previous: Optional[pd.DataFrame],
+    regression_factor: float,
+    min_wall_s: float,
+) -> pd.DataFrame:
+    """
+    Compare a performance report with the report of a previous run.
+
+    Parameters
+    ----------
+    df_report : pd.DataFrame
+        Report of this run.
+    df_previous : Optional[pd.DataFrame]
+        Report of the previous run, if available.
+    regression_factor : float
+        A rule regressed if its wall time, CPU time or peak memory grew by
+        more than this factor.
+    min_wall_s : float
+        Rules which took less wall time than this are not flagged.
+
+    Returns
+    -------
+    pd.DataFrame
+        Report with previous values, ratios and a regression column.
+
+    """
+    if df_previous is None:
+        df_previous = pd.DataFrame(columns=REPORT_COLUMNS)
+    df = df_report.merge(
+        df_previous[["rule"] + COMPARED_COLUMNS].add_prefix("previous_"),
+        left_on="rule",
+        right_on="previous_rule",
+        how="left",
+    ).drop(columns="previous_rule")
+    regression = np.zeros(len(df), dtype=bool)
+    for column in COMPARED_COLUMNS:
+        ratio = df[column] / df[f"previous_{column}"].astype(float).replace(0, np.nan)
+        df[f"{column}_ratio"] = ratio.round(2)
+        regression |= (ratio > regression_factor).to_numpy()
+    df["regression"] = regression & (df["wall_s"] >= min_wall_s).to_numpy()
+    for row in df[df["regression"]].itertuples(index=False):
+        logging.warning(
+            f"Rule {row.rule} regressed compared to the previous run: "
+            f"wall time {row.previous_wall_s}s -> {row.wall_s}s, "
+            f"peak memory {row.previous_max_rss_mb}MB -> {row.max_rss_mb}MB."
+        )
+    return df
+
+
+def main(args) -> None:
+    df_report = summarise_benchmarks(read_benchmarks(args.benchmark_dir))
+    logging.info(f"Summarised benchmarks of {len(df_report)} rules.")
+    df_previous = None
+    if args.previous_report and args.previous_report.exists():
+        logging.info(f"Comparing with previous report {args.previous_report}.")
+        df_previous = pd.read_csv(args.previous_report, sep="\t")
+    else:
+        logging.info("No previous report to compare with.")
+    df_report = compare_reports(
+        df_report, df_previous, args.regression_factor, args.min_wall_s
+    )
+    df_report.to_csv(args.output, sep="\t", index=False)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Summarise Snakemake benchmarks of a run and compare them with a previous run."
+    )
+
+    parser.add_argument(
+        "--benchmark-dir",
+        type=Path,
+        metavar="STR",
+        help="Directory with benchmarks of this run.",
+        required=True,
+    )
+    parser.add_argument(
+        "--previous-report",
+        type=Path,
+        metavar="STR",
+        help="Path to performance report of a previous run.",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        metavar="STR",
+        help="Path to output performance report.",
+        required=True,
+    )
+    parser.add_argument(
+        "--regression-factor",
+        type=float,
+        metavar="FLOAT",
+        help="Flag rules whose wall time, CPU time or peak memory grew by more than this factor.",
+        default=1.5,
+    )
+    parser.add_argument(
+        "--min-wall-s",
+        type=float,
+        metavar="FLOAT",
+        help="Do not flag rules which took less wall time than this.",
+        default=60,
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Increase verbosity.",
+    )
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+
+    main(args)
@@ -1,41 +1,148 @@
 import argparse
 import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+COPY_BUFFER_SIZE = 16 * 1024**2
+MANIFEST_COLUMNS = ['type', 'old_path', 'new_path']
+
+
+def new_fasta_header(header: bytes, new_id: str) -> bytes:
+    '''
+    the header with its id replaced by new_id, keeping the description
+    '''
+    if not header.startswith(b'>'):
+        raise ValueError("FASTA file does not start with a header")
+
+    parts = header[1:].strip().split(maxsplit=1)
+    rest = b' ' + parts[1] if len(parts) > 1 else b''
+
+    return b'>' + new_id.encode() + rest + b'\n'
+
+
+def copy_body(fin, fout) -> None:
+    '''
+    copy the rest of fin to fout, in the kernel (sendfile) where possible
+    '''
+    offset = fin.tell()
+    size = os.fstat(fin.fileno()).st_size
+    try:
+        while offset < size:
+            sent = os.sendfile(fout.fileno(), fin.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    except (AttributeError, OSError):
+        # no sendfile (or not for these files), copy in large blocks instead
+        fin.seek(offset)
+        shutil.copyfileobj(fin, fout, COPY_BUFFER_SIZE)
+
 
 def rewrite_fasta_header(src: Path, dst: Path) -> None:
     '''
     change the fasta header to contain the renamed filename
+
+    The new header is written to dst and the sequence is copied after it. The header
+    is not overwritten in place, as the new id is longer than the old one (it adds the
+    collection name) and padding it would change the file and its checksum. Only a file
+    which already has the new header is renamed without copying.
     '''
     new_id = dst.stem
-    
-    with src.open() as fin, dst.open("w") as fout:
+
+    with src.open('rb') as fin:
         header = fin.readline()
+        new_header = new_fasta_header(header, new_id)
+
+        if new_header != header:
+            with dst.open('wb') as fout:
+                fout.write(new_header)
+                fout.flush()
+                copy_body(fin, fout)
 
-        if not header.startswith(">"):
-            raise ValueError("FASTA file does not start with a header")
+    if new_header == header:
+        src.rename(dst)
+    else:
+        #remove the src file
+        src.unlink()
 
-        parts = header[1:].strip().split(maxsplit=1)
-        rest = f" {parts[1]}" if len(parts) > 1 else ""
+    logging.info(f'Replaced header in file: {dst}')
+
+
+def rename_file(path: Path, input_coll: str):
+    '''
+    Rename a fasta or json file by adding the collection name to its name
+
+    Returns (type, old path, new path), or None if the file is not renamed
+    '''
+    if not path.is_file():
+        return None
+
+    new_folder = path.parent
+
+    # only move and rename fasta and json files from old folder, so exclude the newly created ones
+    if path.parts[1] != 'mtb_typing' and path.suffix in ['.fasta', '.json']:
+        # determine collection name
+        name_extension = input_coll.split('/')[-1]
+        # append collection name to file name
+        new_name = f'{path.stem}_{name_extension}{path.suffix}'
+        new_path = new_folder / new_name
+
+        # rewrite fasta header to correspond with file name and move file
+        if path.suffix == '.fasta':
+            rewrite_fasta_header(path, new_path)
+        # move and rename json file
+        if path.suffix == '.json':
+            path.rename(new_path)
+
+        logging.info(f'Moved {path} to {new_path}')
+        return path.suffix[1:], path, new_path
+    return None
+
+
+def write_manifest(manifest: Path, renamed) -> None:
+    '''
+    write the renamed files as a tab separated file with a type, old_path and new_path column
+    '''
+    with open(manifest, 'w') as f:
+        f.write('\t'.join(MANIFEST_COLUMNS) + '\n')
+        for file_type, old_path, new_path in sorted(renamed):
+            f.write(f'{file_type}\t{old_path}\t{new_path}\n')
+    logging.info(f'Wrote {len(renamed)} renamed files to {manifest}')
+
+
+def rename_input_dir(input_dir: Path, input_coll: str, threads: int = 8, manifest: Path = None):
+    '''
+    Rename the fasta and json files of an input directory concurrently
+
+    Returns a list of (type, old path, new path) of the renamed files
+    '''
+    # define new folders
+    fasta_folder = input_dir / "mtb_typing" / "consensus"
+    json_folder = input_dir / "mtb_typing" / "seq_exp_json"
+
+    # list the files before renaming, so renamed files are not renamed again
+    fasta_paths = list(fasta_folder.glob("*"))
+    json_paths = list(json_folder.glob("*"))
+
+    # move and rename files, the files are independent so they are renamed in parallel
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+        results = executor.map(lambda path: rename_file(path, input_coll), fasta_paths + json_paths)
+        renamed = [result for result in results if result is not None]
+
+    if manifest is not None:
+        write_manifest(manifest, renamed)
+    return renamed
 
-        fout.write(f">{new_id}{rest}\n")
-        
-        logging.info(f'Replaced header in file: {dst}')
-        
-        # copy the remainder
-        fout.writelines(fin)
-    
-    #remove the src file
-    src.unlink()
-    
 
 def rename_files():
     '''
     Rename files in an input directory to make the names unique by adding the collection name as a prefix
     Depends the source of the data. If in iRODS a runsheet is used with multiple input collections the
-    data will be on a  
+    data will be on a
     '''
-    
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-i", "--input-dir", required=True, type=Path,
@@ -43,10 +150,16 @@ def rename_files():
     parser.add_argument(
         "-ic", "--input-coll", required=True, type=str,
         help="Input Collection name")
+    parser.add_argument(
+        "-t", "--threads", type=int, default=8,
+        help="Number of files to rename in parallel")
+    parser.add_argument(
+        "-m", "--manifest", type=Path,
+        help="Path to write the old and new path of each renamed file to, a record of which input became which sample. Not written by default")
     parser.add_argument('-l', '--log_file', help='Log file path', default='rename_files.log')
-  
+
     args = parser.parse_args()
-    
+
     # Set up logging
     logging.basicConfig(
         filename=args.log_file,
@@ -55,48 +168,12 @@ def rename_files():
         level=logging.INFO
     )
 
-    input_dir = args.input_dir
-    input_coll = args.input_coll
-    
-    # Find files in the directory  
-    input_dir = Path(input_dir)
-    
-    # define new folders
-    fasta_folder = input_dir / "mtb_typing" / "consensus"
-    json_folder = input_dir / "mtb_typing" / "seq_exp_json"
-    audit_trail = input_dir / "audit_trail"
-    
-    fasta_paths = list(fasta_folder.glob("*"))
-    json_paths = list(json_folder.glob("*"))
-    
-    # move and rename files
-    for path in fasta_paths + json_paths:
-        
-        if not path.is_file():
-            continue
-        
-        new_folder = path.parent
-        
-        # only move and rename fasta and json files from old folder, so exclude the newly created ones
-        if path.parts[1] != 'mtb_typing' and path.suffix in ['.fasta', '.json']:
-            # determine collection name
-            name_extension = input_coll.split('/')[-1]
-            # append collection name to file name
-            new_name = f'{path.stem}_{name_extension}{path.suffix}'
-            new_path = new_folder / new_name
-            
-            # rewrite fasta header to correspond with file name and move file
-            if path.suffix == '.fasta':
-                rewrite_fasta_header(path, new_path)
-            # move and rename json file
-            if path.suffix == '.json':
-                path.rename(new_path)
-            
-            logging.info(f'Moved {path} to {new_path}')
-       
+    # Find files in the directory
+    input_dir = Path(args.input_dir)
 
-if __name__ == "__main__":
-    
-    rename_files()
+    rename_input_dir(input_dir, args.input_coll, args.threads, args.manifest)
 
 
+if __name__ == "__main__":
+
+    rename_files()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+from collfinder import find_previous_collection, get_collection_metadata, irodsConnect
+from find_downstream_curated_files import find_downstream_collection
+
+
+def cache_key(args):
+    '''
+    Key of a previous run lookup, the input collection and all criteria
+    '''
+    return json.dumps([args.input_collection, sorted(args.match_attr), args.run_number_attr,
+                       sorted(args.extra_metadata), sorted(args.extra_metadata_not)])
+
+def read_cache(cache_path):
+    if cache_path is None or not cache_path.exists():
+        return {}
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except ValueError:
+        logging.warning('Ignoring unreadable cache %s', cache_path)
+        return {}
+
+def write_cache(cache_path, cache):
+    if cache_path is None:
+        return
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+
+def resolve_provenance(irods_session, args, cache):
+    '''
+    Find the previous clustering run and its downstream collection with curated files
+
+    The previous run of a runsheet does not change when the runsheet is rerun, so it is
+    taken from the cache if possible. Curated files can be added between reruns, so the
+    downstream collection is always looked up.
+
+    If args.rerun_attr is set, the latest earlier run of the same runsheet is looked up as
+    well: a collection with rerun_attr=input collection. This is never cached, as a rerun
+    adds one.
+
+    Returns a dict with previous_run, curated_collection and earlier_run (None if not found)
+    '''
+    key = cache_key(args)
+    if key in cache:
+        previous_run = cache[key]
+        logging.info('Previous collection from cache: %s', previous_run)
+    else:
+        input_meta = get_collection_metadata(irods_session, args.input_collection)
+        if not input_meta:
+            raise ValueError(f'Input collection not found or without metadata: {args.input_collection}')
+        for attr in args.match_attr + [args.run_number_attr]:
+            if attr not in input_meta:
+                raise ValueError(f'Attribute {attr} missing on collection {args.input_collection}')
+        previous_run = find_previous_collection(
+            irods_session, input_meta, args.match_attr, args.run_number_attr,
+            args.extra_metadata, args.extra_metadata_not)
+        cache[key] = previous_run
+        logging.info('Previous collection found: %s', previous_run)
+
+    curated_collection = None
+    if previous_run is not None:
+        curated_collection = find_downstream_collection(irods_session, previous_run)
+        logging.info('Collection with curated files: %s', curated_collection)
+
+    earlier_run = None
+    if getattr(args, 'rerun_attr', None):
+        earlier_run = find_previous_collection(
+            irods_session, {}, [], args.run_number_attr,
+            args.extra_metadata + [f'{args.rerun_attr}={args.input_collection}'],
+            args.rerun_not)
+        logging.info('Earlier run of the same runsheet: %s', earlier_run)
+    return {'previous_run': previous_run, 'curated_collection': curated_collection,
+            'earlier_run': earlier_run}
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the previous clustering run and its curated files, output as JSON')
+    parser.add_argument('-i', '--input_collection', help='Input collection', required=True)
+    parser.add_argument('-S', '--use_ssl', help="Use SSL for irods connection", action="store_true")
+    parser.add_argument('-m', '--match_attr', help='Metadata AVUs on input to match to report collection', action='append', required=True)
+    parser.add_argument('-r', '--run_number_attr', help='Sequential numbering attribute on report collection', required=True)
+    parser.add_argument('-x', '--extra_metadata', help='Extra metadata to match', action='append', default=[])
+    parser.add_argument('-X', '--extra_metadata_not', help='Extra metadata to not match', action='append', default=[])
+    parser.add_argument('-R', '--rerun_attr', help='Attribute with the input collection on clustering runs, to find an earlier run of the same runsheet')
+    parser.add_argument('-Y', '--rerun_not', help='Metadata an earlier run should not match', action='append', default=[])
+    parser.add_argument('-c', '--cache', help='Path to cache of previous run lookups', type=Path)
+    parser.add_argument('-l', '--log_file', help='Log file path', default='resolve_provenance.log')
+
+    args = parser.parse_args()
+
+    # Set up logging
+    logging.basicConfig(
+        filename=args.log_file,
+        filemode='a',
+        format='%(asctime)s %(levelname)s: %(message)s',
+        level=logging.INFO
+    )
+
+    cache = read_cache(args.cache)
+    try:
+        irods_session = irodsConnect(use_ssl=args.use_ssl)
+        with irods_session:
+            provenance = resolve_provenance(irods_session, args, cache)
+    except Exception:
+        logging.exception("Unexpected error occurred")
+        return False
+    write_cache(args.cache, cache)
+
+    # This print is parsed by the run_pipeline.sh script
+    print(json.dumps(provenance))
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(2)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+import logging
+import math
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+import yaml
+
+# Features describing the size of a run, in order of preference when fitting
+FEATURES = ["n_samples", "n_new_samples", "input_mb", "previous_mb"]
+BENCHMARK_DIR = "benchmark"
+RUN_FEATURES_FILE = "run_features.yaml"
+
+
+def read_previous_samples(previous_clustering: str) -> Set[str]:
+    """
+    Read the samples in clusters.csv of a previous run.
+    """
+    clusters = Path(previous_clustering) / "clusters.csv"
+    if previous_clustering == "None" or not clusters.exists():
+        return set()
+    try:
+        df = pd.read_csv(clusters, usecols=["sample"], dtype=str)
+    except pd.errors.EmptyDataError:
+        return set()
+    return set(df["sample"])
+
+
+def run_features(
+    sample_inputs: Dict[str, str], previous_clustering: str, previous_data: str
+) -> Dict[str, float]:
+    """
+    Describe the size of a run by features which are known before it starts.
+
+    Computed once per run by juno_clustering.py and passed in the config, so
+    the inputs are not listed again every time the Snakefile is parsed.
+
+    Parameters
+    ----------
+    sample_inputs : Dict[str, str]
+        Path to the input of each sample on the sample sheet.
+    previous_clustering : str
+        Path to previous run, or "None".
+    previous_data : str
+        File in the previous run which is extended (e.g. aln.fa.gz).
+
+    Returns
+    -------
+    Dict[str, float]
+        Values of FEATURES. Samples which were clustered in the previous run
+        are not new, and only the inputs of new samples count to input_mb.
+
+    """
+    previous_samples = read_previous_samples(previous_clustering)
+    new_inputs = [path for sample, path in sample_inputs.items() if sample not in previous_samples]
+    input_bytes = sum(Path(path).stat().st_size for path in new_inputs if Path(path).exists())
+    previous_path = Path(previous_clustering) / previous_data
+    previous_bytes = 0
+    if previous_clustering != "None" and previous_path.exists():
+        previous_bytes = previous_path.stat().st_size
+    return {
+        "n_samples": float(len(previous_samples | set(sample_inputs))),
+        "n_new_samples": float(len(new_inputs)),
+        "input_mb": round(input_bytes / 1024**2, 3),
+        "previous_mb": round(previous_bytes / 1024**2, 3),
+    }
+
+
+class ResourceModel:
+    """
+    Linear models of peak memory and CPU load per rule.
+
+    Each model is a dict of an intercept and a coefficient per feature. Rules
+    without a model, and runs without features, fall back to the values in
+    pipeline_parameters.yaml, which are also used as upper bounds for the
+    estimates.
+    """
+
+    def __init__(
+        self,
+        rules: Optional[Dict[str, Dict[str, Dict[str, float]]]] = None,
+        mem_headroom: float = 1.2,
+        min_mem_gb: int = 1,
+    ):
+        self.rules = rules or {}
+        self.mem_headroom = mem_headroom
+        self.min_mem_gb = min_mem_gb
+
+    @classmethod
+    def from_yaml(cls, path: Path) -> "ResourceModel":
+        if not Path(path).exists():
+            logging.warning(f"Resource model {path} not found, using fixed resources.")
+            return cls()
+        with open(path) as f:
+            dict_model = yaml.safe_load(f) or {}
+        return cls(
+            dict_model.get("rules"),
+            dict_model.get("mem_headroom", 1.2),
+            dict_model.get("min_mem_gb", 1),
+        )
+
+    def to_yaml(self, path: Path) -> None:
+        logging.info(f"Writing resource model to {path}.")
+        with open(path, "w") as f:
+            yaml.safe_dump(
+                {
+                    "mem_headroom": self.mem_headroom,
+                    "min_mem_gb": self.min_mem_gb,
+                    "rules": self.rules,
+                },
+                f,
+                sort_keys=False,
+            )
+
+    def predict(
+        self, rule: str, resource: str, features: Optional[Dict[str, float]]
+    ) -> Optional[float]:
+        coefficients = self.rules.get(rule, {}).get(resource)
+        if coefficients is None or features is None:
+            return None
+        return coefficients.get("intercept", 0.0) + sum(
+            value * features.get(feature, 0.0)
+            for feature, value in coefficients.items()
+            if feature != "intercept"
+        )
+
+    def mem_gb(
+        self, rule: str, features: Optional[Dict[str, float]], max_mem_gb: int, attempt: int = 1
+    ) -> int:
+        """
+        Estimate memory of a rule, or max_mem_gb if the rule is retried.
+        """
+        estimate = self.predict(rule, "mem_gb", features)
+        if estimate is None or attempt > 1:
+            return max_mem_gb
+        estimate = math.ceil(estimate * self.mem_headroom)
+        return min(max(estimate, self.min_mem_gb), max_mem_gb)
+
+    def threads(self, rule: str, features: Optional[Dict[str, float]], max_threads: int) -> int:
+        estimate = self.predict(rule, "threads", features)
+        if estimate is None:
+            return max_threads
+        return min(max(math.ceil(estimate), 1), max_threads)
+
+
+def read_benchmarks(run_dir: Path) -> pd.DataFrame:
+    """
+    Read the benchmarks and run features of a previous run.
+
+    Parameters
+    ----------
+    run_dir : Path
+        Output directory of a previous run.
+
+    Returns
+    -------
+    pd.DataFrame
+        Peak memory (GB) and CPU load per rule, with the features of the run.
+        Empty if the run has no recorded features.
+
+    """
+    features_path = run_dir / BENCHMARK_DIR / RUN_FEATURES_FILE
+    if not features_path.exists():
+        logging.warning(f"No run features in {run_dir}, skipping.")
+        return pd.DataFrame()
+    with open(features_path) as f:
+        features = yaml.safe_load(f)
+    if not features:
+        logging.warning(f"Run features of {run_dir} were not computed, skipping.")
+        return pd.DataFrame()
+    list_records = []
+    for benchmark in sorted((run_dir / BENCHMARK_DIR).glob("*.tsv")):
+        df = pd.read_csv(benchmark, sep="\t", na_values=["NA", "-"])
+        df = df.dropna(subset=["s", "max_rss", "cpu_time"])
+        if df.empty:
+            continue
+        list_records.append(
+            {
+                "rule": benchmark.stem,
+                "mem_gb": df["max_rss"].max() / 1024,
+                "threads": (df["cpu_time"] / df["s"].clip(lower=1)).max(),
+                **{feature: features.get(feature, 0.0) for feature in FEATURES},
+            }
+        )
+    return pd.DataFrame(list_records)
+
+
+def fit_resource(df: pd.DataFrame, resource: str) -> Dict[str, float]:
+    """
+    Fit a linear model of a resource which covers every observed run.
+
+    Uses as many features as the number of runs allows. The intercept is
+    raised by the largest residual, so no observed run is underestimated.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Benchmarks of one rule across runs.
+    resource : str
+        Column to model (mem_gb or threads).
+
+    Returns
+    -------
+    Dict[str, float]
+        Intercept and coefficient per used feature.
+
+    """
+    y = df[resource].to_numpy(dtype=float)
+    features = [f for f in FEATURES if df[f].nunique() > 1][: max(len(df) - 2, 0)]
+    X = np.column_stack([np.ones(len(df))] + [df[f].to_numpy(dtype=float) for f in features])
+    coefficients, *_ = np.linalg.lstsq(X, y, rcond=None)
+    coefficients[0] += max((y - X @ coefficients).max(), 0.0)
+    return {
+        name: round(float(value), 6) + 0.0
+        for name, value in zip(["intercept"] + features, coefficients)
+    }
+
+
+def calibrate(run_dirs: List[Path], model: ResourceModel) -> ResourceModel:
+    df = pd.concat([read_benchmarks(run_dir) for run_dir in run_dirs], ignore_index=True)
+    if df.empty:
+        logging.warning("No benchmarks found, keeping the current model.")
+        return model
+    for rule, df_rule in df.groupby("rule"):
+        model.rules[rule] = {
+            "mem_gb": fit_resource(df_rule, "mem_gb"),
+            "threads": fit_resource(df_rule, "threads"),
+            "n_runs": len(df_rule),
+        }
+        logging.info(f"Fitted {rule} on {len(df_rule)} runs: {model.rules[rule]}.")
+    return model
+
+
+def main(args) -> None:
+    model = ResourceModel.from_yaml(args.model)
+    model = calibrate(args.runs, model)
+    model.to_yaml(args.output or args.model)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Fit the resource model of the pipeline to benchmarks of previous runs."
+    )
+
+    parser.add_argument(
+        "--runs",
+        type=Path,
+        metavar="STR",
+        help="Output directories of previous runs.",
+        nargs="+",
+        required=True,
+    )
+    parser.add_argument(
+        "--model",
+        type=Path,
+        metavar="STR",
+        help="Path to resource model to update.",
+        default=Path(__file__).parents[2] / "config" / "resource_model.yaml",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        metavar="STR",
+        help="Path to write the fitted model to, defaults to --model.",
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Increase verbosity.",
+    )
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+
+    main(args)
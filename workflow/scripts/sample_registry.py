@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+FIXED_STRING = "_contig1"
+
+
+class SampleRegistry:
+    """
+    Stable integer ids of sample names, carried from run to run
+
+    Ids are dense (0..n-1) and only ever appended, so arrays indexed by id
+    stay valid in later runs. The registry is stored as two .npy files which
+    are loaded as memory maps:
+
+    - <prefix>.npy: sample names (UTF-8, fixed width) by id
+    - <prefix>_index.npy: (name, id) records sorted by name, for lookup of
+      ids by binary search
+
+    Parameters
+    ----------
+    names : np.ndarray
+        Sample names by id, as bytes.
+
+    """
+
+    def __init__(self, names=None):
+        self.names = np.array([], dtype="S1") if names is None else names
+        self.index = self._make_index(self.names)
+
+    @staticmethod
+    def _make_index(names):
+        index = np.empty(len(names), dtype=[("name", names.dtype), ("id", np.int64)])
+        index["name"] = names
+        index["id"] = np.arange(len(names))
+        index.sort(order="name", kind="stable")
+        return index
+
+    @staticmethod
+    def paths(prefix):
+        prefix = Path(prefix)
+        return (
+            prefix.with_name(prefix.name + ".npy"),
+            prefix.with_name(prefix.name + "_index.npy"),
+        )
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        """
+        Load a registry, an empty registry if it does not exist
+        """
+        names_path, index_path = cls.paths(prefix)
+        if not names_path.exists():
+            logging.info(f"No sample registry at {names_path}, starting a new one")
+            return cls()
+        mmap_mode = "r" if mmap else None
+        registry = cls.__new__(cls)
+        registry.names = np.load(names_path, mmap_mode=mmap_mode)
+        registry.index = np.load(index_path, mmap_mode=mmap_mode)
+        if len(registry.names) != len(registry.index):
+            raise ValueError(f"Sample registry {names_path} does not match its index")
+        return registry
+
+    def save(self, prefix):
+        for path, array in zip(self.paths(prefix), [self.names, self.index]):
+            # write next to the target and move it in place, the current file may be mapped
+            tmp_path = path.with_name(f".{path.name}")
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return self.ids([name])[0] >= 0
+
+    def ids(self, names):
+        """
+        Ids of sample names, -1 for names which are not registered
+        """
+        encoded = np.char.encode(np.asarray(names, dtype=str), "utf-8")
+        ids = np.full(len(encoded), -1, dtype=np.int64)
+        if len(self.index) == 0 or len(encoded) == 0:
+            return ids
+        sorted_names = self.index["name"]
+        positions = np.searchsorted(sorted_names, encoded)
+        positions_clipped = np.minimum(positions, len(sorted_names) - 1)
+        found = sorted_names[positions_clipped] == encoded
+        ids[found] = self.index["id"][positions_clipped[found]]
+        return ids
+
+    def names_of(self, ids):
+        """
+        Sample names of ids
+        """
+        return np.char.decode(self.names[np.asarray(ids, dtype=np.int64)], "utf-8")
+
+    def add(self, names):
+        """
+        Register names which are not registered yet, in order of first appearance
+
+        Returns
+        -------
+        np.ndarray
+            Ids of all names.
+
+        """
+        names = np.asarray(names, dtype=object)
+        unique_names = pd.unique(names)
+        ids = self.ids(unique_names)
+        new_names = np.char.encode(np.asarray(unique_names[ids < 0], dtype=str), "utf-8")
+        if len(new_names) > 0:
+            logging.info(f"Registering {len(new_names)} new samples")
+            width = max(self.names.dtype.itemsize, new_names.dtype.itemsize)
+            self.names = np.concatenate(
+                [np.asarray(self.names, dtype=f"S{width}"), new_names.astype(f"S{width}")]
+            )
+            self.index = self._make_index(self.names)
+        return self.ids(names)
+
+
+def main(args):
+    registry = (
+        SampleRegistry.load(args.previous_registry, mmap=False)
+        if args.previous_registry
+        else SampleRegistry()
+    )
+    registry.add(samples_in_distances(args.distances))
+    registry.save(args.output)
+    logging.info(f"Registry of {len(registry)} samples written to {args.output}")
+
+
+def samples_in_distances(distances, chunksize=1_000_000):
+    """
+    Cleaned sample names in a distances file, in order of first appearance
+    """
+    samples = {}
+    for df_chunk in pd.read_csv(
+        distances,
+        header=None,
+        sep="\t",
+        usecols=[0, 1],
+        names=["sample1", "sample2"],
+        dtype="category",
+        chunksize=chunksize,
+    ):
+        interleaved = np.column_stack(
+            [df_chunk["sample1"].to_numpy(dtype=object), df_chunk["sample2"].to_numpy(dtype=object)]
+        ).ravel()
+        samples.update(dict.fromkeys(pd.unique(interleaved)))
+    return [sample.replace(FIXED_STRING, "") for sample in samples]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Register the samples of a run in the sample registry of the previous run"
+    )
+    parser.add_argument(
+        "--previous-registry",
+        type=Path,
+        metavar="STR",
+        help="Prefix of the registry of the previous run.",
+    )
+    parser.add_argument(
+        "--distances",
+        type=Path,
+        metavar="STR",
+        help="Distances of the run, all samples in it are registered.",
+        required=True,
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        metavar="STR",
+        help="Prefix of the registry to write.",
+        required=True,
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Increase verbosity.",
+    )
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+
+    main(args)
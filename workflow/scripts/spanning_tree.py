@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import logging
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import pandas as pd
+
+NODE_ATTRIBUTES = ["inferred_cluster", "curated_cluster", "final_cluster"]
+EDGE_COLUMNS = ["sample1", "sample2", "distance"]
+
+
+def canonical_edges(df_edges):
+    "Edges with sample1 < sample2, without self edges and with the shortest of duplicate edges"
+    sample1 = df_edges["sample1"].to_numpy(dtype=object)
+    sample2 = df_edges["sample2"].to_numpy(dtype=object)
+    swap = sample1 > sample2
+    df = pd.DataFrame(
+        {
+            "sample1": np.where(swap, sample2, sample1),
+            "sample2": np.where(swap, sample1, sample2),
+            "distance": df_edges["distance"].to_numpy(),
+        }
+    )
+    df = df[df["sample1"] != df["sample2"]]
+    return df.sort_values("distance", kind="stable").drop_duplicates(["sample1", "sample2"])
+
+
+def minimum_spanning_forest(df_edges):
+    """
+    Minimum spanning forest of edges (Kruskal), ties are broken by sample names
+    """
+    df_edges = canonical_edges(df_edges).sort_values(["distance", "sample1", "sample2"])
+    codes, names = pd.factorize(
+        np.column_stack([df_edges["sample1"], df_edges["sample2"]]).ravel()
+    )
+    codes = codes.reshape(-1, 2)
+    parent = np.arange(len(names))
+
+    def find(sample_id):
+        while parent[sample_id] != sample_id:
+            parent[sample_id] = parent[parent[sample_id]]
+            sample_id = parent[sample_id]
+        return sample_id
+
+    keep = np.zeros(len(codes), dtype=bool)
+    for i, (a, b) in enumerate(codes):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_b] = root_a
+            keep[i] = True
+    return df_edges[keep].reset_index(drop=True)
+
+
+class SpanningForest:
+    """
+    Minimum spanning tree of each cluster, updated chunk by chunk
+
+    Parameters
+    ----------
+    threshold : float
+        Cluster threshold, the trees span the edges within it.
+    margin : float
+        If above 0, each sample also keeps its shortest edge with a distance
+        above the threshold and at most threshold + margin, to show clusters
+        which nearly merged.
+
+    Notes
+    -----
+    The minimum spanning forest of all edges is the minimum spanning forest
+    of the forest so far and the new edges. Edges are buffered until there
+    are more of them than samples, so memory and the number of times the
+    forest is rebuilt stay proportional to the number of samples. The trees
+    connect the same samples as the clusters, with at most one edge less
+    than samples per cluster.
+
+    """
+
+    def __init__(self, threshold, margin=0):
+        self.threshold = threshold
+        self.margin = margin
+        self.tree = pd.DataFrame(columns=EDGE_COLUMNS)
+        self.buffer = []
+        self.n_buffered = 0
+        self.near = pd.DataFrame(columns=EDGE_COLUMNS)
+
+    def update(self, df_distances):
+        """
+        Add a chunk of distances
+        """
+        distances = df_distances["distance"]
+        df_within = df_distances.loc[distances <= self.threshold, EDGE_COLUMNS]
+        self.buffer.append(canonical_edges(df_within))
+        self.n_buffered += len(self.buffer[-1])
+        if self.n_buffered > max(len(self.tree), 1000):
+            self._rebuild()
+        if self.margin > 0:
+            near = (distances > self.threshold) & (distances <= self.threshold + self.margin)
+            df_near = canonical_edges(df_distances.loc[near, EDGE_COLUMNS])
+            # the shortest edge of each sample, from either side
+            df_near = pd.concat(
+                [
+                    df_near,
+                    df_near.rename(columns={"sample1": "sample2", "sample2": "sample1"}),
+                ]
+            )
+            self.near = (
+                pd.concat([df for df in [self.near, df_near] if len(df) > 0] or [self.near])
+                .sort_values(["sample1", "distance", "sample2"])
+                .drop_duplicates("sample1")
+            )
+
+    def _rebuild(self):
+        self.tree = minimum_spanning_forest(
+            pd.concat([df for df in [self.tree] + self.buffer if len(df) > 0] or [self.tree])
+        )
+        self.buffer = []
+        self.n_buffered = 0
+
+    def edges(self, df_clusters=None):
+        """
+        Edges of the trees, and the near threshold edges between different inferred clusters
+        """
+        self._rebuild()
+        df_tree = self.tree.assign(near_threshold=False)
+        if self.margin == 0 or len(self.near) == 0:
+            return df_tree
+        df_near = canonical_edges(self.near)
+        if df_clusters is not None:
+            inferred = df_clusters.set_index("sample")["inferred_cluster"]
+            df_near = df_near[
+                df_near["sample1"].map(inferred).to_numpy()
+                != df_near["sample2"].map(inferred).to_numpy()
+            ]
+        return pd.concat([df_tree, df_near.assign(near_threshold=True)], ignore_index=True)
+
+    def write_graphml(self, df_clusters, path):
+        """
+        Write the trees as GraphML, with the clusters of each sample as node attributes
+
+        Parameters
+        ----------
+        df_clusters : pd.DataFrame
+            Clusters in the columns of clusters.csv, every sample is a node.
+        path : Path
+            Path to write to.
+
+        """
+        df_nodes = df_clusters.sort_values(["final_cluster", "sample"])
+        set_nodes = set(df_nodes["sample"])
+        df_edges = self.edges(df_clusters)
+        df_edges = df_edges[df_edges["sample1"].isin(set_nodes) & df_edges["sample2"].isin(set_nodes)]
+        final_cluster = df_clusters.set_index("sample")["final_cluster"]
+        df_edges = df_edges.assign(
+            final_cluster=df_edges["sample1"].map(final_cluster)
+        ).sort_values(["near_threshold", "final_cluster", "sample1", "sample2"])
+
+        with open(path, "w") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+            for attribute in NODE_ATTRIBUTES:
+                f.write(
+                    f'  <key id="{attribute}" for="node" attr.name="{attribute}" attr.type="string"/>\n'
+                )
+            f.write('  <key id="distance" for="edge" attr.name="distance" attr.type="double"/>\n')
+            f.write(
+                '  <key id="near_threshold" for="edge" attr.name="near_threshold" attr.type="boolean"/>\n'
+            )
+            f.write('  <graph id="clusters" edgedefault="undirected">\n')
+            for row in df_nodes[["sample"] + NODE_ATTRIBUTES].itertuples(index=False):
+                f.write(f"    <node id={quoteattr(str(row[0]))}>")
+                for attribute, value in zip(NODE_ATTRIBUTES, row[1:]):
+                    if pd.notna(value):
+                        f.write(f'<data key="{attribute}">{escape(str(value))}</data>')
+                f.write("</node>\n")
+            for sample1, sample2, distance, near_threshold in df_edges[
+                EDGE_COLUMNS + ["near_threshold"]
+            ].itertuples(index=False):
+                f.write(
+                    f"    <edge source={quoteattr(str(sample1))} target={quoteattr(str(sample2))}>"
+                    f'<data key="distance">{distance}</data>'
+                    f'<data key="near_threshold">{str(near_threshold).lower()}</data></edge>\n'
+                )
+            f.write("  </graph>\n</graphml>\n")
+        logging.info(
+            f"Spanning trees of {len(df_nodes)} samples with {len(df_edges)} edges written to {path}"
+        )
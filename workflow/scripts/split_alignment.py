@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import logging
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Tuple
+
+
+CHUNKS_FILE = "chunks.tsv"
+# distances held in memory per flush while splitting the previous distances
+DISTANCES_BUFFER_SIZE = 1_000_000
+
+
+def chunk_name(index: int) -> str:
+    return f"{index:04d}"
+
+
+def chunk_path(output_dir: Path, chunk: str) -> Path:
+    return output_dir / f"chunk_{chunk}.fa"
+
+
+def chunk_distances_path(output_dir: Path, chunk: str) -> Path:
+    return output_dir / f"chunk_{chunk}.tsv"
+
+
+def split_alignment(
+    alignment: IO[str],
+    output_dir: Path,
+    tile_size: int,
+    previous_names: Optional[List[str]] = None,
+) -> List[Tuple[str, int, bool]]:
+    """
+    Split an alignment into chunks of consecutive sequences.
+
+    Parameters
+    ----------
+    alignment : IO[str]
+        Text stream of the alignment.
+    output_dir : Path
+        Directory to write chunk_0000.fa, chunk_0001.fa, ... and chunks.tsv to.
+    tile_size : int
+        Number of sequences per chunk. The pairwise distance matrix is split
+        into tiles of tile_size x tile_size samples.
+    previous_names : Optional[List[str]]
+        Names of the sequences of the previous alignment, which are the first
+        sequences of the alignment. The first new sequence starts a new chunk,
+        so every chunk holds either previous or new sequences.
+
+    Returns
+    -------
+    List[Tuple[str, int, bool]]
+        Name, number of sequences and whether the sequences are new, per chunk.
+
+    Raises
+    ------
+    ValueError
+        If the alignment does not start with the sequences of the previous alignment.
+
+    """
+    previous_names = previous_names or []
+    n_previous = len(previous_names)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    n_sequences = 0
+    chunks: List[List] = []
+    chunk: Optional[IO[str]] = None
+    for line in alignment:
+        if line.startswith(">"):
+            is_new = n_sequences >= n_previous
+            if not is_new:
+                sequence = line[1:].split(maxsplit=1)[0] if line[1:].strip() else ""
+                if sequence != previous_names[n_sequences]:
+                    raise ValueError(
+                        f"Sequence {n_sequences + 1} of the alignment is {sequence}, "
+                        f"expected {previous_names[n_sequences]} of the previous alignment."
+                    )
+            n_in_part = n_sequences - n_previous if is_new else n_sequences
+            if n_in_part % tile_size == 0:
+                if chunk is not None:
+                    chunk.close()
+                name = chunk_name(len(chunks))
+                chunk = open(chunk_path(output_dir, name), "w")
+                chunks.append([name, 0, is_new])
+            # sequences per chunk
+            chunks[-1][1] += 1
+            n_sequences += 1
+        if chunk is None:
+            raise ValueError("Alignment does not start with a fasta header.")
+        chunk.write(line)
+    if chunk is not None:
+        chunk.close()
+    if n_sequences < n_previous:
+        raise ValueError(
+            f"Alignment has {n_sequences} sequences, the previous alignment had {n_previous}."
+        )
+    chunks = [tuple(chunk_record) for chunk_record in chunks]
+    with open(output_dir / CHUNKS_FILE, "w") as f:
+        f.write("chunk\tn_sequences\tnew\n")
+        for name, n_chunk_sequences, is_new in chunks:
+            f.write(f"{name}\t{n_chunk_sequences}\t{int(is_new)}\n")
+    n_new = sum(is_new for _, _, is_new in chunks)
+    logging.info(
+        f"Split {n_sequences} sequences into {len(chunks)} chunks, "
+        f"{n_new} of which hold the {n_sequences - n_previous} new sequences."
+    )
+    return chunks
+
+
+def split_previous_distances(
+    distances: IO[str], output_dir: Path, previous_names: List[str], tile_size: int
+) -> None:
+    """
+    Write the previous distances within each chunk of previous sequences.
+
+    The chunks of previous sequences hold previous_names in runs of
+    tile_size, as written by split_alignment. The distances within such a
+    chunk are the precomputed distances of the leading samples of its
+    off-diagonal tiles, so they are not calculated again.
+
+    Parameters
+    ----------
+    distances : IO[str]
+        Text stream of the previous distances, in distle full output mode.
+    output_dir : Path
+        Directory with the chunks, chunk_0000.tsv, ... are written to it.
+    previous_names : List[str]
+        Names of the sequences of the previous alignment.
+    tile_size : int
+        Number of sequences per chunk.
+
+    """
+    chunk_of: Dict[str, str] = {
+        name: chunk_name(i // tile_size) for i, name in enumerate(previous_names)
+    }
+    buffers: Dict[str, List[str]] = {chunk: [] for chunk in set(chunk_of.values())}
+    for chunk in buffers:
+        chunk_distances_path(output_dir, chunk).write_text("")
+    n_buffered = 0
+    n_written = 0
+    for line in distances:
+        sample1, sample2, _ = line.split("\t", 2)
+        chunk = chunk_of.get(sample1)
+        if chunk is None or chunk_of.get(sample2) != chunk:
+            continue
+        buffers[chunk].append(line)
+        n_buffered += 1
+        if n_buffered == DISTANCES_BUFFER_SIZE:
+            n_written += flush_buffers(buffers, output_dir)
+            n_buffered = 0
+    n_written += flush_buffers(buffers, output_dir)
+    logging.info(
+        f"Wrote {n_written} previous distances within {len(buffers)} chunks of previous sequences."
+    )
+
+
+def flush_buffers(buffers: Dict[str, List[str]], output_dir: Path) -> int:
+    n_written = 0
+    for chunk, lines in buffers.items():
+        if lines:
+            with open(chunk_distances_path(output_dir, chunk), "a") as f:
+                f.writelines(lines)
+            n_written += len(lines)
+            lines.clear()
+    return n_written
+
+
+def read_chunks(output_dir: Path) -> List[Tuple[str, int, bool]]:
+    """
+    Read the chunks written by split_alignment from chunks.tsv.
+    """
+    chunks = []
+    with open(output_dir / CHUNKS_FILE) as f:
+        next(f)
+        for line in f:
+            name, n_sequences, is_new = line.rstrip("\n").split("\t")
+            chunks.append((name, int(n_sequences), is_new == "1"))
+    return chunks
+
+
+def main(args) -> None:
+    previous_names = []
+    if args.previous_names:
+        with open(args.previous_names) as f:
+            previous_names = [line.strip() for line in f if line.strip()]
+    with open(args.input) as alignment:
+        split_alignment(alignment, args.output_dir, args.tile_size, previous_names)
+    if args.previous_distances:
+        with open(args.previous_distances) as distances:
+            split_previous_distances(
+                distances, args.output_dir, previous_names, args.tile_size
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Split an alignment into chunks for tiled distance calculation."
+    )
+
+    parser.add_argument(
+        "--input",
+        type=Path,
+        metavar="STR",
+        help="Path to alignment.",
+        required=True,
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        metavar="STR",
+        help="Directory to write chunks to.",
+        required=True,
+    )
+    parser.add_argument(
+        "--previous-names",
+        type=Path,
+        metavar="STR",
+        help="Path to the names of the sequences of the previous alignment, one per line.",
+    )
+    parser.add_argument(
+        "--previous-distances",
+        type=Path,
+        metavar="STR",
+        help="Path to the previous distances, the distances within each chunk of previous sequences are written next to the chunks.",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        metavar="INT",
+        help="Number of sequences per chunk.",
+        required=True,
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Increase verbosity.",
+    )
+
+    args = parser.parse_args()
+
+    if args.tile_size < 1:
+        parser.error("--tile-size should be at least 1")
+    if args.previous_distances and not args.previous_names:
+        parser.error("--previous-distances requires --previous-names")
+
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+
+    main(args)
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+import datetime
+import logging
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    sample TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    in_alignment INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS distances (
+    sample1 TEXT NOT NULL,
+    sample2 TEXT NOT NULL,
+    distance REAL NOT NULL,
+    PRIMARY KEY (sample1, sample2)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS distances_sample2 ON distances (sample2);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    name TEXT,
+    date TEXT NOT NULL,
+    threshold REAL
+);
+CREATE TABLE IF NOT EXISTS clusters (
+    sample TEXT NOT NULL,
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    inferred_cluster TEXT,
+    curated_cluster TEXT,
+    final_cluster TEXT,
+    removed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (sample, run_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS clusters_run_id ON clusters (run_id);
+CREATE INDEX IF NOT EXISTS clusters_final_cluster ON clusters (final_cluster);
+CREATE TABLE IF NOT EXISTS exclusions (
+    sample TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (sample, reason)
+) WITHOUT ROWID;
+"""
+CLUSTER_COLUMNS = ["sample", "inferred_cluster", "curated_cluster", "final_cluster"]
+EXCLUSION_COLUMNS = ["sample", "reason", "date"]
+
+
+def now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def as_records(df, columns):
+    "Rows of columns as tuples, with None for missing values"
+    df = df[columns].astype(object)
+    return list(df.where(df.notna(), None).itertuples(index=False, name=None))
+
+
+class StateStore:
+    """
+    Clustering history of all runs in a single SQLite database
+
+    The database holds the samples (and whether they are in the alignment),
+    the distances within the cluster threshold, the cluster assignments of
+    every run and the exclusions. Scripts update it in a transaction, so
+    scripts which run at the same time wait for each other and a failed
+    script leaves the database as it was.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the database, created if it does not exist.
+    timeout : float
+        Seconds to wait for a transaction of another process.
+
+    Notes
+    -----
+    Updates only write rows which are new or changed: distances are stored
+    once per pair (sample1 < sample2), and a run only stores the assignments
+    which differ from the run before it. The clusters of a run are the latest
+    assignment of each sample up to that run; a sample which is no longer
+    clustered gets a row with removed = 1.
+
+    """
+
+    def __init__(self, path, timeout=600):
+        self.path = Path(path)
+        # transactions are started explicitly, see transaction()
+        self.connection = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise ValueError(
+                f"State store {self.path} has schema version {version}, expected at most {SCHEMA_VERSION}"
+            )
+        if version < SCHEMA_VERSION:
+            # executescript() would commit, so the statements are executed one by one
+            with self.transaction() as connection:
+                for statement in SCHEMA.split(";"):
+                    connection.execute(statement)
+                self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Commit the statements in the block at once, or none of them on an exception
+        """
+        if self.connection.in_transaction:
+            # nested, the outer transaction commits
+            yield self.connection
+            return
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def add_samples(self, samples, in_alignment=False):
+        """
+        Register samples, marking them as in the alignment if in_alignment
+        """
+        date = now()
+        samples = pd.unique(np.asarray(samples, dtype=object))
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO samples (sample, date, in_alignment) VALUES (?, ?, ?) "
+                "ON CONFLICT (sample) DO UPDATE SET in_alignment = 1 "
+                "WHERE excluded.in_alignment = 1 AND in_alignment = 0",
+                ((sample, date, int(in_alignment)) for sample in samples),
+            )
+
+    def samples(self, in_alignment=None):
+        query = "SELECT sample FROM samples"
+        if in_alignment is not None:
+            query += f" WHERE in_alignment = {int(in_alignment)}"
+        return [row[0] for row in self.connection.execute(query + " ORDER BY sample")]
+
+    def add_distances(self, df_distances):
+        """
+        Store distances (sample1, sample2, distance), a changed distance replaces the stored one
+
+        Distances of a sample to itself are not stored.
+        """
+        sample1 = df_distances["sample1"].to_numpy(dtype=object).astype(str)
+        sample2 = df_distances["sample2"].to_numpy(dtype=object).astype(str)
+        keep = sample1 != sample2
+        first = np.where(sample1 < sample2, sample1, sample2)[keep]
+        second = np.where(sample1 < sample2, sample2, sample1)[keep]
+        distances = df_distances["distance"].to_numpy(dtype=float)[keep]
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO distances (sample1, sample2, distance) VALUES (?, ?, ?) "
+                "ON CONFLICT (sample1, sample2) DO UPDATE SET distance = excluded.distance "
+                "WHERE distance != excluded.distance",
+                zip(first.tolist(), second.tolist(), distances.tolist()),
+            )
+
+    def distances(self, sample):
+        """
+        Stored distances of a sample to other samples
+        """
+        return dict(
+            self.connection.execute(
+                "SELECT sample2, distance FROM distances WHERE sample1 = ? "
+                "UNION ALL SELECT sample1, distance FROM distances WHERE sample2 = ?",
+                (sample, sample),
+            ).fetchall()
+        )
+
+    def latest_run(self):
+        "Id of the latest run, None if no run was recorded"
+        return self.connection.execute("SELECT MAX(run_id) FROM runs").fetchone()[0]
+
+    def clusters(self, run_id=None):
+        """
+        Clusters of a run (by default the latest), in the columns of clusters.csv
+
+        Missing values are NaN, as when clusters.csv is read with pandas.
+        """
+        if run_id is None:
+            run_id = self.latest_run()
+        rows = []
+        if run_id is not None:
+            rows = self.connection.execute(
+                f"SELECT {', '.join(CLUSTER_COLUMNS)} FROM clusters AS c "
+                "WHERE run_id = (SELECT MAX(run_id) FROM clusters "
+                "WHERE sample = c.sample AND run_id <= ?) "
+                "AND removed = 0 ORDER BY sample",
+                (run_id,),
+            ).fetchall()
+        df = pd.DataFrame(rows, columns=CLUSTER_COLUMNS, dtype=object)
+        return df.where(df.notna(), np.nan)
+
+    def cluster_members(self, cluster, run_id=None):
+        """
+        Samples of a final cluster in a run (by default the latest)
+        """
+        df = self.clusters(run_id)
+        return df.loc[df["final_cluster"] == cluster, "sample"].tolist()
+
+    def add_run(self, df_clusters, threshold=None, name=None):
+        """
+        Record the clusters of a run
+
+        Parameters
+        ----------
+        df_clusters : pd.DataFrame
+            Clusters in the columns of clusters.csv.
+        threshold : float
+            Cluster threshold of the run.
+        name : str
+            Name of the run, for example its output directory.
+
+        Returns
+        -------
+        int
+            Id of the run.
+
+        """
+        with self.transaction() as connection:
+            df_before = self.clusters()
+            run_id = connection.execute(
+                "INSERT INTO runs (name, date, threshold) VALUES (?, ?, ?)",
+                (name, now(), threshold),
+            ).lastrowid
+            before = {row[0]: row[1:] for row in as_records(df_before, CLUSTER_COLUMNS)}
+            rows = as_records(df_clusters, CLUSTER_COLUMNS)
+            changed = [row for row in rows if before.get(row[0]) != row[1:]]
+            removed = set(before) - {row[0] for row in rows}
+            connection.executemany(
+                f"INSERT INTO clusters ({', '.join(CLUSTER_COLUMNS)}, run_id) VALUES (?, ?, ?, ?, ?)",
+                (row + (run_id,) for row in changed),
+            )
+            connection.executemany(
+                "INSERT INTO clusters (sample, run_id, removed) VALUES (?, ?, 1)",
+                ((sample, run_id) for sample in sorted(removed)),
+            )
+            self.add_samples(df_clusters["sample"])
+        logging.info(
+            f"Recorded run {run_id} in {self.path}: {len(changed)} assignments changed, "
+            f"{len(removed)} samples removed"
+        )
+        return run_id
+
+    def add_exclusions(self, df_exclusions):
+        """
+        Record exclusions (sample, reason, date), an exclusion keeps the date it was first recorded
+        """
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO exclusions (sample, reason, date) VALUES (?, ?, ?)",
+                as_records(df_exclusions, EXCLUSION_COLUMNS),
+            )
+
+    def exclusions(self):
+        """
+        All exclusions, in the columns of list_excluded_samples.tsv
+        """
+        rows = self.connection.execute(
+            f"SELECT {', '.join(EXCLUSION_COLUMNS)} FROM exclusions ORDER BY sample, reason"
+        ).fetchall()
+        return pd.DataFrame(rows, columns=EXCLUSION_COLUMNS)
+
+
+def main(args):
+    with StateStore(args.state_db) as store:
+        if args.clusters:
+            store.clusters(args.run_id).to_csv(args.clusters, index=False)
+            logging.info(f"Clusters written to {args.clusters}")
+        if args.exclusions:
+            store.exclusions().to_csv(args.exclusions, sep="\t", index=False)
+            logging.info(f"Exclusions written to {args.exclusions}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Export the clusters and exclusions in a state store as clusters.csv and list_excluded_samples.tsv"
+    )
+    parser.add_argument(
+        "--state-db",
+        type=Path,
+        metavar="STR",
+        help="Path to the state store.",
+        required=True,
+    )
+    parser.add_argument(
+        "--run-id",
+        type=int,
+        metavar="INT",
+        help="Run to export the clusters of, defaults to the latest run.",
+    )
+    parser.add_argument(
+        "--clusters",
+        type=Path,
+        metavar="STR",
+        help="Path to write the clusters to.",
+    )
+    parser.add_argument(
+        "--exclusions",
+        type=Path,
+        metavar="STR",
+        help="Path to write the exclusions to.",
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Increase verbosity.",
+    )
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+    else:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+        )
+
+    main(args)